@@ -0,0 +1,84 @@
+"""
+Measures how long each lando_util command module takes to import using `python -X importtime`.
+
+Every module is imported in a fresh interpreter several times and the fastest cumulative import time is compared
+with the module's startup budget. Modules are also checked for heavy dependencies that should only be imported by
+the code paths that need them. Exits with status 1 when a module is over budget or loads a deferred dependency.
+
+    python benchmarks/importtime.py
+
+`-X importtime` was added in python 3.7 so the benchmark needs python 3.7 or later, the modules it measures do not.
+"""
+import subprocess
+import sys
+
+# command module -> import time budget in milliseconds
+BUDGETS_MS = {
+    "lando_util.stagedata": 150,
+    "lando_util.organize_project.organizer": 60,
+    "lando_util.pipeline": 150,
+    # uploading always talks to DukeDS so ddsc is imported up front
+    "lando_util.upload": 400,
+}
+# command module -> modules it must not import at startup
+DEFERRED_MODULES = {
+    "lando_util.stagedata": ("ddsc", "requests", "boto3"),
+    "lando_util.organize_project.organizer": ("jinja2", "markdown", "yaml", "dateutil"),
+    "lando_util.pipeline": ("ddsc", "requests", "boto3", "jinja2", "markdown", "yaml"),
+}
+DEFAULT_REPEAT = 5
+
+
+def measure_import(module, python=sys.executable):
+    """
+    Import module in a new interpreter.
+    :param module: str: name of the module to import
+    :param python: str: interpreter to run
+    :return: (float, set): cumulative import time of module in milliseconds, names of every module imported
+    """
+    result = subprocess.run([python, "-X", "importtime", "-c", "import {}".format(module)],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return parse_importtime(result.stderr, module)
+
+
+def parse_importtime(output, module):
+    """
+    :param output: str: stderr of python -X importtime
+    :param module: str: module whose cumulative time to return
+    :return: (float, set): cumulative import time of module in milliseconds, names of every module imported
+    """
+    cumulative_ms = None
+    imported = set()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if not parts[1].strip().isdigit():
+            continue  # header line
+        name = parts[2].strip()
+        imported.add(name)
+        if name == module:
+            cumulative_ms = int(parts[1]) / 1000
+    return cumulative_ms, imported
+
+
+def main(repeat=DEFAULT_REPEAT):
+    failed = False
+    for module, budget_ms in sorted(BUDGETS_MS.items()):
+        measurements = [measure_import(module) for _ in range(repeat)]
+        best_ms = min(cumulative_ms for cumulative_ms, imported in measurements)
+        loaded = sorted(name for name in DEFERRED_MODULES.get(module, ())
+                        if name in measurements[0][1])
+        status = "ok"
+        if best_ms > budget_ms or loaded:
+            status = "FAILED"
+            failed = True
+        line = "{:<40} {:>8.1f} ms (budget {} ms) {}".format(module, best_ms, budget_ms, status)
+        if loaded:
+            line += " imports deferred modules: {}".format(", ".join(loaded))
+        print(line)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Verifies staged files against expected hashes computed while the bytes are written.
+"""
+import hashlib
+from lando_util.fileutil import remove_path
+
+HASH_FILE_CHUNK_SIZE = 1024 * 1024
+
+
+class ChecksumMismatchError(IOError):
+    pass
+
+
+def parse_checksum(value):
+    """
+    Parse a checksum in algorithm:hexdigest format (eg. sha256:9f86d0...).
+    :param value: str: checksum to parse
+    :return: (str, str): algorithm and lowercase hex digest
+    """
+    algorithm, sep, hexdigest = value.partition(':')
+    algorithm = algorithm.lower()
+    if not sep or not hexdigest or algorithm not in hashlib.algorithms_available:
+        raise ValueError("Invalid checksum {}, expected <algorithm>:<hex digest>.".format(value))
+    return algorithm, hexdigest.lower()
+
+
+def get_dukeds_hash(file_data):
+    """
+    Find the hash DukeDS recorded for the current version of a file.
+    :param file_data: dict: DukeDS file response data
+    :return: (str, str): algorithm and hex digest or (None, None) when DukeDS has no hash for the file
+    """
+    current_version = file_data.get('current_version') or {}
+    upload = current_version.get('upload') or {}
+    hash_info = upload.get('hash')
+    if not hash_info:
+        hashes = upload.get('hashes') or []
+        hash_info = hashes[0] if hashes else None
+    if not hash_info:
+        return None, None
+    return hash_info['algorithm'].lower(), hash_info['value'].lower()
+
+
+def hash_file(path, algorithm):
+    """
+    :param path: str: path to the file to hash
+    :param algorithm: str: hashlib algorithm name
+    :return: hashlib hash object updated with the contents of path
+    """
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(HASH_FILE_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+class HashingWriter(object):
+    """
+    Wraps a file object hashing the bytes written to it.
+    """
+    def __init__(self, outfile, hasher):
+        self.outfile = outfile
+        self.hasher = hasher
+        self.size = 0
+
+    def write(self, data):
+        self.outfile.write(data)
+        self.hasher.update(data)
+        self.size += len(data)
+
+    def flush(self):
+        self.outfile.flush()
+
+
+def verify_checksum(path, algorithm, expected, actual):
+    """
+    Remove path (a file or extracted directory) and raise ChecksumMismatchError when actual does not match expected.
+    :return: dict: checksum details to record in the downloaded metadata
+    """
+    if expected is not None and actual != expected:
+        remove_path(path)
+        raise ChecksumMismatchError("{} checksum of {} is {} expected {}.".format(algorithm, path, actual, expected))
+    return {"algorithm": algorithm, "value": actual, "verified": expected is not None}
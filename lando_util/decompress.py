@@ -0,0 +1,188 @@
+"""
+Decompresses files while they are downloaded so only the decompressed result is written to disk.
+
+Plain codecs (gzip, bz2, xz, zstd) write a single decompressed file. Tar codecs (tar, tar.gz, ...) extract the
+archive as a stream into a directory without saving the archive itself.
+"""
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import tarfile
+import threading
+from lando_util.extract import check_member_path, UnsafeArchiveMemberError
+from lando_util.fileutil import remove_path
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, install with lando-util[zstd]
+    zstandard = None
+
+DECOMPRESS_CODECS = ("gzip", "bz2", "xz", "zstd")
+TAR_PREFIX = "tar"
+DECOMPRESS_FORMATS = DECOMPRESS_CODECS + (TAR_PREFIX,) + tuple(
+    "{}.{}".format(TAR_PREFIX, suffix) for suffix in ("gz", "bz2", "xz", "zst"))
+# tar format suffix -> codec used to decompress the archive
+TAR_SUFFIX_CODECS = {"gz": "gzip", "bz2": "bz2", "xz": "xz", "zst": "zstd"}
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def parse_decompress_format(decompress_format):
+    """
+    :param decompress_format: str: one of DECOMPRESS_FORMATS
+    :return: (str, bool): codec (None for an uncompressed tar) and whether the data is a tar archive
+    """
+    if decompress_format not in DECOMPRESS_FORMATS:
+        raise ValueError("Unsupported decompress format {}, expected one of {}.".format(
+            decompress_format, ", ".join(DECOMPRESS_FORMATS)))
+    if decompress_format == TAR_PREFIX:
+        return None, True
+    if decompress_format.startswith(TAR_PREFIX + "."):
+        return TAR_SUFFIX_CODECS[decompress_format.split(".", 1)[1]], True
+    return decompress_format, False
+
+
+def is_tar_format(decompress_format):
+    return parse_decompress_format(decompress_format)[1]
+
+
+def open_decompressed(fileobj, codec):
+    """
+    Wrap fileobj in a reader that returns decompressed data as the compressed data is read.
+    :param fileobj: file: binary file like object returning compressed data
+    :param codec: str: one of DECOMPRESS_CODECS or None for no decompression
+    :return: file: binary file like object returning decompressed data
+    """
+    if codec is None:
+        return fileobj
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if codec == "bz2":
+        return bz2.BZ2File(fileobj, mode='rb')
+    if codec == "xz":
+        return lzma.LZMAFile(fileobj, mode='rb')
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd decompression requires the zstandard package (pip install lando-util[zstd]).")
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+    raise ValueError("Unsupported decompress codec {}".format(codec))
+
+
+class ChunkReader(object):
+    """
+    Read only binary file like object over an iterable of byte chunks, optionally hashing each chunk.
+    Reads are served from the current chunk at an offset so the unread part of a chunk is never copied again.
+    """
+    def __init__(self, chunks, hasher=None):
+        self.chunks = iter(chunks)
+        self.hasher = hasher
+        self.chunk = memoryview(b'')
+        self.offset = 0
+        self.closed = False
+
+    def readable(self):
+        return True
+
+    def _next_piece(self, size):
+        """
+        :param size: int: maximum number of bytes to return, negative for the rest of the current chunk
+        :return: memoryview: unread bytes of the current chunk, empty once every chunk has been read
+        """
+        while self.offset >= len(self.chunk):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return memoryview(b'')
+            if self.hasher:
+                self.hasher.update(chunk)
+            self.chunk, self.offset = memoryview(chunk), 0
+        end = len(self.chunk) if size < 0 else min(len(self.chunk), self.offset + size)
+        piece = self.chunk[self.offset:end]
+        self.offset = end
+        return piece
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            piece = self._next_piece(size)
+            if not piece:
+                break
+            pieces.append(piece)
+            if size > 0:
+                size -= len(piece)
+        return b''.join(pieces)
+
+    def readinto(self, buffer):
+        target = memoryview(buffer).cast('B')
+        count = 0
+        while count < len(target):
+            piece = self._next_piece(len(target) - count)
+            if not piece:
+                break
+            target[count:count + len(piece)] = piece
+            count += len(piece)
+        return count
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_decompressed(chunks, dest, decompress_format, hasher=None):
+    """
+    Decompress chunks as they arrive into dest. The result is built at a temporary path next to dest and moved
+    into place once complete, replacing any existing dest.
+    :param chunks: iterable of bytes: compressed data
+    :param dest: str: file to write or, for tar formats, directory to extract into
+    :param decompress_format: str: one of DECOMPRESS_FORMATS
+    :param hasher: hashlib hash object: updated with the compressed data
+    """
+    codec, is_tar = parse_decompress_format(decompress_format)
+    temp_dest = "{}.{}.{}.tmp".format(dest, os.getpid(), threading.get_ident())
+    try:
+        with open_decompressed(ChunkReader(chunks, hasher), codec) as stream:
+            if is_tar:
+                extract_tar_stream(stream, temp_dest)
+            else:
+                with open(temp_dest, 'wb') as outfile:
+                    shutil.copyfileobj(stream, outfile, COPY_BUFFER_SIZE)
+        if is_tar and os.path.isdir(dest):
+            shutil.rmtree(dest)
+        os.replace(temp_dest, dest)
+    except BaseException:
+        remove_path(temp_dest)
+        raise
+
+
+def extract_tar_stream(fileobj, dest):
+    """
+    Extract the tar archive read from fileobj into dest reading the archive front to back only once.
+    Raises UnsafeArchiveMemberError for members (or link targets) that would be written outside of dest.
+    """
+    os.makedirs(dest, exist_ok=True)
+    with tarfile.open(fileobj=fileobj, mode='r|') as archive:
+        for member in archive:
+            check_tar_member(dest, member)
+            archive.extract(member, dest, set_attrs=not member.isdir(), **get_extract_filter_kwargs())
+
+
+def check_tar_member(dest, member):
+    check_member_path(dest, member.name)
+    if member.issym():
+        check_member_path(dest, os.path.join(os.path.dirname(member.name), member.linkname))
+    elif member.islnk():
+        check_member_path(dest, member.linkname)
+    elif not (member.isfile() or member.isdir()):
+        raise UnsafeArchiveMemberError("Archive member {} is not a file, directory or link.".format(member.name))
+
+
+def get_extract_filter_kwargs():
+    # extraction filters were added in python 3.12 and backported to security releases of earlier versions
+    if hasattr(tarfile, 'data_filter'):
+        return {'filter': 'data'}
+    return {}
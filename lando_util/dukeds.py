@@ -0,0 +1,152 @@
+"""
+Downloads DukeDS files after fetching the metadata and download urls for all of them up front.
+
+The metadata requests are sent concurrently over the DukeDS client's keep-alive session so the API latency
+is paid once in parallel instead of once per file ahead of each transfer.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from lando_util.checksum import get_dukeds_hash, verify_checksum
+from lando_util.decompress import write_decompressed
+
+DEFAULT_PREFETCH_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# algorithm used to hash files that DukeDS has no hash for
+DEFAULT_HASH_ALGORITHM = 'md5'
+# status codes returned when a temporary download url has expired
+EXPIRED_URL_STATUS_CODES = (401, 403)
+
+
+class LazyDukeDSClient(object):
+    """
+    Stands in for a ddsc DukeDSClient, creating the real client the first time one of its attributes is used.
+    ddsc is slow to import so staging cmdfiles without DukeDS items never loads it.
+    """
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        with self._lock:
+            if self._client is None:
+                from ddsc.sdk.client import Client
+                self._client = Client()
+        return getattr(self._client, name)
+
+
+class DukeDSFileInfo(object):
+    def __init__(self, dds_file, file_download):
+        """
+        :param dds_file: ddsc.sdk.client.File: DukeDS file metadata
+        :param file_download: ddsc.sdk.client.FileDownload: temporary url used to download the file contents
+        """
+        self.dds_file = dds_file
+        self.file_download = file_download
+
+    @property
+    def metadata(self):
+        return self.dds_file._data_dict
+
+
+class DukeDSDownloader(object):
+    def __init__(self, dds_client, workers=DEFAULT_PREFETCH_WORKERS):
+        """
+        :param dds_client: DukeDSClient: client used to fetch metadata and download files
+        :param workers: int: number of metadata requests to send at the same time
+        """
+        self.dds_client = dds_client
+        self.workers = workers
+        self.file_infos = {}
+        self.pool_size = None
+
+    def configure_connection_pool(self, pool_size):
+        """
+        Allow the DukeDS client's session to keep pool_size connections open for concurrent requests.
+        The existing pool (and its open connections) is kept when it is already large enough.
+        """
+        if self.pool_size and self.pool_size >= pool_size:
+            return
+        self.pool_size = pool_size
+        from requests.adapters import HTTPAdapter
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        http = self.dds_client.dds_connection.data_service.http
+        http.mount('https://', adapter)
+        http.mount('http://', adapter)
+
+    def prefetch(self, file_ids):
+        """
+        Fetch metadata and download urls for file_ids concurrently.
+        Files that fail are fetched again by get_file_info so the error is raised for the item that needs them.
+        :param file_ids: [str]: DukeDS file ids
+        """
+        unique_file_ids = [file_id for file_id in OrderedDict.fromkeys(file_ids) if file_id not in self.file_infos]
+        if not unique_file_ids:
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for file_id, file_info in zip(unique_file_ids, executor.map(self._try_fetch_file_info, unique_file_ids)):
+                if file_info:
+                    self.file_infos[file_id] = file_info
+
+    def clear(self):
+        """
+        Forget prefetched file info for files that have already been staged.
+        """
+        self.file_infos = {}
+
+    def get_file_info(self, file_id):
+        """
+        :param file_id: str: DukeDS file id
+        :return: DukeDSFileInfo: prefetched info or info fetched now if file_id was not prefetched
+        """
+        file_info = self.file_infos.get(file_id)
+        if not file_info:
+            file_info = self._fetch_file_info(file_id)
+            self.file_infos[file_id] = file_info
+        return file_info
+
+    def _try_fetch_file_info(self, file_id):
+        try:
+            return self._fetch_file_info(file_id)
+        except Exception:
+            return None
+
+    def _fetch_file_info(self, file_id):
+        dds_file = self.dds_client.get_file_by_id(file_id=file_id)
+        file_download = self.dds_client.dds_connection.get_file_download(file_id)
+        return DukeDSFileInfo(dds_file, file_download)
+
+    def download(self, file_info, dest, decompress_format=None):
+        """
+        Download the contents of a DukeDS file fetching a new url if the prefetched one has expired.
+        The contents are hashed as they are written and checked against the hash DukeDS has for the file.
+        Raises ChecksumMismatchError (after removing dest) when the hashes differ.
+        :param file_info: DukeDSFileInfo: file to download
+        :param dest: str: path to save the file to
+        :param decompress_format: str: decompress the contents while downloading (see decompress.DECOMPRESS_FORMATS)
+        :return: dict: checksum details
+        """
+        algorithm, expected_hexdigest = get_dukeds_hash(file_info.metadata)
+        hasher = hashlib.new(algorithm or DEFAULT_HASH_ALGORITHM)
+        response = self._get_download_response(file_info.file_download)
+        if response.status_code in EXPIRED_URL_STATUS_CODES:
+            response.close()
+            file_info.file_download = self.dds_client.dds_connection.get_file_download(file_info.dds_file.id)
+            response = self._get_download_response(file_info.file_download)
+        response.raise_for_status()
+        chunks = (chunk for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+                  if chunk)  # filter out keep-alive new chunks
+        if decompress_format:
+            write_decompressed(chunks, dest, decompress_format, hasher)
+        else:
+            with open(dest, 'wb') as outfile:
+                for chunk in chunks:
+                    outfile.write(chunk)
+                    hasher.update(chunk)
+        return verify_checksum(dest, hasher.name, expected_hexdigest, hasher.hexdigest())
+
+    def _get_download_response(self, file_download):
+        data_service = self.dds_client.dds_connection.data_service
+        return data_service.receive_external(file_download.http_verb, file_download.host, file_download.url,
+                                             file_download.http_headers)
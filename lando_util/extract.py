@@ -0,0 +1,109 @@
+"""
+Extracts zip archives, optionally only selected members and optionally across a pool of processes.
+"""
+import fnmatch
+import os
+import zipfile
+
+
+class UnsafeArchiveMemberError(ValueError):
+    pass
+
+
+def extract_zip(archive_path, dest, member_patterns=None, workers=1):
+    """
+    Extract archive_path into dest.
+    :param archive_path: str: path to the zip file
+    :param dest: str: directory to extract into
+    :param member_patterns: [str]: glob patterns of members to extract, None extracts every member
+    :param workers: int: number of processes to extract with
+    :return: int: number of members extracted
+    """
+    with zipfile.ZipFile(archive_path) as z:
+        members = select_members(z.infolist(), member_patterns)
+    for member in members:
+        check_member_path(dest, member.filename)
+    os.makedirs(dest, exist_ok=True)
+    if workers > 1 and len(members) > workers:
+        # process pools are only imported when extracting in parallel to keep startup fast
+        from concurrent.futures import ProcessPoolExecutor
+        # zipfile creates missing directories without tolerating another process creating them first
+        create_member_directories(dest, members)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(extract_members, archive_path, dest, names)
+                       for names in partition_members(members, workers)]
+            for future in futures:
+                future.result()
+    else:
+        extract_members(archive_path, dest, [member.filename for member in members])
+    return len(members)
+
+
+def select_members(members, member_patterns):
+    """
+    Filter members down to those matching any of member_patterns.
+    :param members: [zipfile.ZipInfo]: members of the archive
+    :param member_patterns: [str]: glob patterns or None to select all members
+    :return: [zipfile.ZipInfo]: selected members
+    """
+    if member_patterns is None:
+        return members
+    unmatched_patterns = set(member_patterns)
+    selected = []
+    for member in members:
+        matched = [pattern for pattern in member_patterns if fnmatch.fnmatchcase(member.filename, pattern)]
+        if matched:
+            selected.append(member)
+            unmatched_patterns.difference_update(matched)
+    if unmatched_patterns:
+        raise ValueError("No archive members match {}.".format(", ".join(sorted(unmatched_patterns))))
+    return selected
+
+
+def check_member_path(dest, member_name):
+    """
+    Raise UnsafeArchiveMemberError if member_name would be written outside of dest (zip-slip).
+    """
+    normalized_name = member_name.replace('\\', '/')
+    if normalized_name.startswith('/') or (len(normalized_name) > 1 and normalized_name[1] == ':'):
+        raise UnsafeArchiveMemberError("Archive member {} has an absolute path.".format(member_name))
+    dest_path = os.path.realpath(dest)
+    member_path = os.path.realpath(os.path.join(dest_path, normalized_name))
+    if os.path.commonpath([dest_path, member_path]) != dest_path:
+        raise UnsafeArchiveMemberError("Archive member {} is outside of {}.".format(member_name, dest))
+
+
+def create_member_directories(dest, members):
+    """
+    Create the directories that members will be extracted into.
+    """
+    for member in members:
+        name = member.filename.replace('\\', '/')
+        member_dir = name.rstrip('/') if member.is_dir() else os.path.dirname(name)
+        if member_dir:
+            os.makedirs(os.path.join(dest, member_dir), exist_ok=True)
+
+
+def partition_members(members, partitions):
+    """
+    Split members into groups with roughly equal uncompressed size, largest members are assigned first.
+    :param members: [zipfile.ZipInfo]: members to split
+    :param partitions: int: number of groups to create
+    :return: [[str]]: member names for each non-empty group
+    """
+    groups = [[] for _ in range(partitions)]
+    group_sizes = [0] * partitions
+    for member in sorted(members, key=lambda member: member.file_size, reverse=True):
+        smallest = group_sizes.index(min(group_sizes))
+        groups[smallest].append(member.filename)
+        group_sizes[smallest] += member.file_size
+    return [group for group in groups if group]
+
+
+def extract_members(archive_path, dest, names):
+    """
+    Extract the named members of archive_path into dest. Runs inside worker processes.
+    """
+    with zipfile.ZipFile(archive_path) as z:
+        for name in names:
+            z.extract(name, dest)
@@ -0,0 +1,163 @@
+"""
+Helpers for placing an existing local file at another path without copying bytes when the filesystem allows it.
+"""
+import errno
+import os
+import shutil
+import fcntl
+import threading
+
+# ioctl request number for cloning a file on filesystems that support reflinks (btrfs, xfs)
+FICLONE = 0x40049409
+# maximum number of bytes copied by a single copy_file_range or sendfile call
+KERNEL_COPY_CHUNK_SIZE = 1024 * 1024 * 1024
+# errors raised when a kernel copy function is not supported for a pair of files
+KERNEL_COPY_UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF,
+                                  errno.ENOTSUP)
+COPY_METHODS = ('copy', 'reflink', 'hardlink', 'auto')
+
+
+def reflink_file(source, dest):
+    """
+    Create dest as a copy-on-write clone of source. Raises OSError when the filesystem does not support reflinks.
+    :param source: str: path to existing file
+    :param dest: str: path to create
+    """
+    with open(source, 'rb') as infile:
+        with open(dest, 'wb') as outfile:
+            try:
+                fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+            except OSError:
+                outfile.close()
+                os.remove(dest)
+                raise
+
+
+def copy_file(source, dest):
+    """
+    Copy source to dest inside the kernel with copy_file_range or sendfile so the data is not read into Python.
+    Falls back to a buffered copy when neither is supported for the two files.
+    :param source: str: path to existing file
+    :param dest: str: path to create or overwrite
+    :return: str: method used 'copy_file_range', 'sendfile' or 'copy'
+    """
+    with open(source, 'rb') as infile:
+        with open(dest, 'wb') as outfile:
+            size = os.fstat(infile.fileno()).st_size
+            for method, copy_function in get_kernel_copy_functions():
+                try:
+                    kernel_copy(copy_function, infile.fileno(), outfile.fileno(), size)
+                    return method
+                except KernelCopyUnsupported:
+                    pass
+            shutil.copyfileobj(infile, outfile)
+    return 'copy'
+
+
+class KernelCopyUnsupported(Exception):
+    pass
+
+
+def get_kernel_copy_functions():
+    """
+    :return: [(str, function)]: kernel copy functions available on this platform, each called as
+    function(infd, outfd, count, offset) and returning the number of bytes copied
+    """
+    functions = []
+    if hasattr(os, 'copy_file_range'):
+        functions.append(('copy_file_range', lambda infd, outfd, count, offset:
+                          os.copy_file_range(infd, outfd, count, offset, offset)))
+    if hasattr(os, 'sendfile'):
+        functions.append(('sendfile', lambda infd, outfd, count, offset:
+                          os.sendfile(outfd, infd, offset, count)))
+    return functions
+
+
+def kernel_copy(copy_function, infd, outfd, size):
+    """
+    Copy size bytes from infd to outfd with copy_function.
+    Raises KernelCopyUnsupported if copy_function fails before copying anything.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            copied = copy_function(infd, outfd, min(KERNEL_COPY_CHUNK_SIZE, size - offset), offset)
+        except OSError as e:
+            if offset == 0 and e.errno in KERNEL_COPY_UNSUPPORTED_ERRNOS:
+                raise KernelCopyUnsupported()
+            raise
+        if copied == 0:
+            if offset == 0:
+                raise KernelCopyUnsupported()
+            raise IOError("Source file shrank while copying, copied {} of {} bytes.".format(offset, size))
+        offset += copied
+
+
+def place_file(source, dest, method='auto'):
+    """
+    Place the contents of source at dest replacing dest atomically if it already exists.
+    :param source: str: path to existing file
+    :param dest: str: path to create or replace
+    :param method: str: 'copy', 'reflink', 'hardlink' or 'auto' to use the first of those that works
+    :return: str: method used
+    """
+    if method == 'auto':
+        return link_or_copy_file(source, dest)
+    if method not in COPY_METHODS:
+        raise ValueError("Unsupported copy method {}".format(method))
+    temp_dest = get_temp_path(dest)
+    try:
+        if method == 'reflink':
+            reflink_file(source, temp_dest)
+        elif method == 'hardlink':
+            os.link(source, temp_dest)
+        else:
+            method = copy_file(source, temp_dest)
+    except BaseException:
+        if os.path.exists(temp_dest):
+            os.remove(temp_dest)
+        raise
+    os.replace(temp_dest, dest)
+    return method
+
+
+def get_temp_path(dest):
+    return "{}.{}.{}.tmp".format(dest, os.getpid(), threading.get_ident())
+
+
+def link_or_copy_file(source, dest):
+    """
+    Place the contents of source at dest using a reflink, hardlink or copy (the first that works).
+    dest is replaced atomically if it already exists.
+    :param source: str: path to existing file
+    :param dest: str: path to create or replace
+    :return: str: method used 'reflink', 'hardlink' or 'copy'
+    """
+    temp_dest = get_temp_path(dest)
+    method = None
+    try:
+        reflink_file(source, temp_dest)
+        method = 'reflink'
+    except OSError:
+        pass
+    if not method:
+        try:
+            os.link(source, temp_dest)
+            method = 'hardlink'
+        except OSError:
+            pass
+    if not method:
+        copy_file(source, temp_dest)
+        method = 'copy'
+    os.replace(temp_dest, dest)
+    return method
+
+
+def remove_path(path):
+    """
+    Remove the file or directory at path if it exists.
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
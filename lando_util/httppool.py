@@ -0,0 +1,270 @@
+"""
+Keep-alive HTTP connections shared by every url download in the process.
+
+urllib.request.urlopen opens a new TCP (and TLS) connection for every request. HTTPConnectionPool keeps
+connections open after a response has been read so the next request to the same host reuses them, and limits how
+many connections are open to each host at the same time. Responses behave like urlopen responses: HTTP error
+statuses raise urllib.error.HTTPError, connection failures raise urllib.error.URLError and redirects are followed.
+Other schemes urlopen supports (file, ftp) are not pooled and are opened with urlopen as before.
+
+Built on http.client rather than requests so staging does not pay the import time of requests at startup.
+"""
+import http.client
+import io
+import ssl
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 16
+DEFAULT_TIMEOUT_SECONDS = 60
+MAX_REDIRECTS = 10
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# unread response bodies up to this size are read so the connection can be reused, larger ones are closed
+DRAIN_LIMIT = 64 * 1024
+# errors that mean a reused idle connection was closed by the server before the request was sent
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class PooledResponse(object):
+    """
+    Response to a request sent over a pooled connection.
+    Closing the response returns the connection to the pool, or closes it when the body was not fully read.
+    """
+    def __init__(self, pool, key, connection, response, url):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+        self.closed = False
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def readinto(self, buffer):
+        return self.response.readinto(buffer)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        reusable = False
+        try:
+            if not self.response.isclosed() and self.response.length is not None and \
+                    self.response.length <= DRAIN_LIMIT:
+                self.response.read()
+            reusable = self.response.isclosed() and not self.response.will_close
+        except (http.client.HTTPException, OSError):
+            pass
+        self.pool._release(self.key, self.connection, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class URLLibResponse(object):
+    """
+    Response to a request for a url that is not pooled, opened with urllib.request.urlopen.
+    Has the same interface as PooledResponse, status is None for schemes without one (file).
+    """
+    def __init__(self, response):
+        self.response = response
+        self.status = response.getcode()
+        self.headers = response.info()
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def readinto(self, buffer):
+        return self.response.readinto(buffer)
+
+    def close(self):
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class HTTPConnectionPool(object):
+    """
+    Thread safe pool of keep-alive connections keyed by scheme, host and port.
+    """
+    def __init__(self, max_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST, ssl_context=None):
+        """
+        :param max_per_host: int: maximum number of connections to a host in use at the same time, requests wait
+        for a connection when the limit is reached
+        :param ssl_context: ssl.SSLContext: context for https connections, None for the default context
+        """
+        self.max_per_host = max_per_host
+        self.ssl_context = ssl_context
+        self.lock = threading.Lock()
+        self.idle = defaultdict(list)
+        self.slots = {}
+        self.connections_opened = 0
+
+    def urlopen(self, url, headers=None, method='GET', timeout=DEFAULT_TIMEOUT_SECONDS):
+        """
+        Send a request following redirects.
+        :param url: str: http or https url, other schemes are opened with urllib.request.urlopen
+        :param headers: dict: request headers
+        :param method: str: GET or HEAD
+        :param timeout: float: socket timeout in seconds
+        :return: PooledResponse: response that must be closed (or used as a context manager)
+        """
+        if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+            request = urllib.request.Request(url, headers=headers or {}, method=method)
+            return URLLibResponse(urllib.request.urlopen(request, timeout=timeout))
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request(url, headers or {}, method, timeout)
+            location = response.headers.get('Location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                break
+            response.close()
+            url = urllib.parse.urljoin(url, location)
+        else:
+            raise urllib.error.HTTPError(url, response.status, "Too many redirects", response.headers, None)
+        if response.status >= 400:
+            body = response.read(DRAIN_LIMIT)
+            response.close()
+            raise urllib.error.HTTPError(url, response.status, response.response.reason, response.headers,
+                                         io.BytesIO(body))
+        return response
+
+    def _request(self, url, headers, method, timeout):
+        parsed = urllib.parse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        path = urllib.parse.urlunsplit(('', '', parsed.path or '/', parsed.query, ''))
+        self._get_slot(key).acquire()
+        try:
+            connection, reused = self._get_connection(key, parsed, timeout)
+            if connection.proxied:
+                path = url
+            try:
+                response = self._send(connection, method, path, headers)
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # the server closed the idle connection, requests are only GET or HEAD so sending again is safe
+                connection.close()
+                connection, reused = self._get_connection(key, parsed, timeout, reuse=False)
+                response = self._send(connection, method, path, headers)
+        except OSError as e:
+            self._get_slot(key).release()
+            if isinstance(e, urllib.error.URLError):
+                raise
+            raise urllib.error.URLError(e)
+        except Exception:
+            self._get_slot(key).release()
+            raise
+        return PooledResponse(self, key, connection, response, url)
+
+    @staticmethod
+    def _send(connection, method, path, headers):
+        try:
+            connection.request(method, path, headers=headers)
+            return connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+
+    def _get_slot(self, key):
+        with self.lock:
+            if key not in self.slots:
+                self.slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self.slots[key]
+
+    def _get_connection(self, key, parsed, timeout, reuse=True):
+        """
+        :return: (http.client.HTTPConnection, bool): idle connection to key or a new one, whether it was idle
+        """
+        with self.lock:
+            idle = self.idle[key]
+            connection = idle.pop() if idle and reuse else None
+        if connection:
+            connection.timeout = timeout
+            if connection.sock:
+                connection.sock.settimeout(timeout)
+            return connection, True
+        return self._create_connection(parsed, timeout), False
+
+    def _create_connection(self, parsed, timeout):
+        proxy = get_proxy(parsed)
+        host, port = (proxy.hostname, proxy.port) if proxy else (parsed.hostname, parsed.port)
+        if parsed.scheme == 'https':
+            connection = http.client.HTTPSConnection(host, port, timeout=timeout, context=self._get_ssl_context())
+            if proxy:
+                connection.set_tunnel(parsed.hostname, parsed.port)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        # plain http requests through a proxy send the absolute url
+        connection.proxied = bool(proxy) and parsed.scheme == 'http'
+        with self.lock:
+            self.connections_opened += 1
+        return connection
+
+    def _get_ssl_context(self):
+        with self.lock:
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            return self.ssl_context
+
+    def _release(self, key, connection, reusable):
+        if reusable:
+            with self.lock:
+                self.idle[key].append(connection)
+        else:
+            connection.close()
+        self._get_slot(key).release()
+
+    def clear(self):
+        """
+        Close every idle connection.
+        """
+        with self.lock:
+            connections = [connection for idle in self.idle.values() for connection in idle]
+            self.idle.clear()
+        for connection in connections:
+            connection.close()
+
+
+def get_proxy(parsed):
+    """
+    :param parsed: urllib.parse.SplitResult: url about to be requested
+    :return: urllib.parse.SplitResult: proxy from the environment (http_proxy, https_proxy, no_proxy) or None
+    """
+    proxy = urllib.request.getproxies().get(parsed.scheme)
+    if not proxy or urllib.request.proxy_bypass(parsed.hostname):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    return urllib.parse.urlsplit(proxy)
+
+
+_default_pool = HTTPConnectionPool()
+
+
+def get_default_pool():
+    """
+    :return: HTTPConnectionPool: pool shared by url downloads that are not given a pool
+    """
+    return _default_pool
+
+
+def configure_default_pool(max_per_host):
+    """
+    Replace the shared pool with one that allows max_per_host connections to each host.
+    """
+    global _default_pool
+    _default_pool.clear()
+    _default_pool = HTTPConnectionPool(max_per_host)
@@ -0,0 +1,130 @@
+"""
+Reads the items of a JSON command file one at a time without loading the whole file.
+
+Two layouts are supported:
+- a JSON object whose "items" key holds the list of items: {"items": [{...}, {...}]}
+- newline delimited JSON with one item object per line
+"""
+import json
+
+READ_CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARS = '.eE+-0123456789'
+
+
+def iter_json_items(infile, list_key='items', chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield items from infile as they are parsed, only the item being parsed is held in memory.
+    :param infile: file: text file to read
+    :param list_key: str: key of the top level object that holds the list of items
+    :param chunk_size: int: number of characters to read at a time
+    :return: generator of dict: items in file order
+    """
+    reader = JSONStreamReader(infile, chunk_size)
+    while reader.peek() is not None:
+        reader.expect('{')
+        item = {}
+        found_list = False
+        if reader.peek() == '}':
+            reader.expect('}')
+        else:
+            while True:
+                key = reader.decode_value()
+                reader.expect(':')
+                if key == list_key and reader.peek() == '[':
+                    found_list = True
+                    yield from iter_array_items(reader)
+                else:
+                    item[key] = reader.decode_value()
+                if reader.expect(',}') == '}':
+                    break
+        if not found_list:
+            yield item
+
+
+def iter_array_items(reader):
+    """
+    Yield each value of the JSON array starting at the reader's position.
+    :param reader: JSONStreamReader: reader positioned at '['
+    """
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.expect(']')
+        return
+    while True:
+        yield reader.decode_value()
+        if reader.expect(',]') == ']':
+            return
+
+
+class JSONStreamReader(object):
+    """
+    Buffers just enough of a file to decode the next JSON token or value.
+    """
+    def __init__(self, infile, chunk_size=READ_CHUNK_SIZE):
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read_more(self):
+        """
+        Append the next chunk of the file to the buffer dropping the part already consumed.
+        :return: bool: False when the end of the file has been reached
+        """
+        if self.eof:
+            return False
+        data = self.infile.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+        :return: str: next character or None at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read_more():
+                return None
+
+    def expect(self, expected):
+        """
+        Skip whitespace and consume the next character raising ValueError if it is not one of expected.
+        :param expected: str: allowed characters
+        :return: str: character consumed
+        """
+        char = self.peek()
+        if char is None or char not in expected:
+            raise ValueError("Expected one of '{}' but found {} in JSON data.".format(
+                expected, repr(char) if char else 'the end of the data'))
+        self.pos += 1
+        return char
+
+    def decode_value(self):
+        """
+        Decode the JSON value at the current position reading more of the file until it is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number followed by the end of the buffer or by a number character (such as '3' before '.5'
+                # when the decoder only saw "3.") may continue in the next chunk
+                is_number = self.buffer[self.pos] in NUMBER_CHARS
+                if self.eof or not (is_number and (end == len(self.buffer) or self.buffer[end] in NUMBER_CHARS)):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._read_more()
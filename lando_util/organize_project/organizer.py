@@ -20,7 +20,6 @@ import json
 import shutil
 import zipfile
 import click
-import dateutil.parser
 from lando_util.organize_project.reports import ReadmeReport, create_workflow_info
 
 
@@ -96,6 +95,7 @@ class Settings(object):
     @property
     def bespin_workflow_elapsed_minutes(self):
         if self.bespin_workflow_started and self.bespin_workflow_finished:
+            import dateutil.parser
             started = dateutil.parser.parse(self.bespin_workflow_started)
             finished = dateutil.parser.parse(self.bespin_workflow_finished)
             return (finished - started).total_seconds() / 60
@@ -171,6 +171,14 @@ class Organizer(object):
 @click.command()
 @click.argument('cmdfile', type=click.File())
 def organize_project(cmdfile):
+    organize_cmdfile(cmdfile)
+
+
+def organize_cmdfile(cmdfile):
+    """
+    Organize the output project described by cmdfile.
+    :param cmdfile: file: organize project command file
+    """
     settings = Settings(cmdfile)
     organizer = Organizer(settings)
     organizer.run()
@@ -5,10 +5,7 @@ https://github.com/Duke-GCB/lando/blob/075b08e9ae1801fe25ddeeb49ef43a0c968a5bcf/
 """
 
 import os
-import yaml
-import jinja2
 import humanfriendly
-import markdown
 import codecs
 
 README_TEMPLATE = """
@@ -28,6 +25,8 @@ class BaseReport(object):
     Base report class that assumes subclass will implement render_markdown() that returns markdown format
     """
     def __init__(self, template_str):
+        # jinja2, markdown and yaml are imported where they are used so the command starts without loading them
+        import jinja2
         self.template = jinja2.Template(template_str)
 
     def render_markdown(self):
@@ -42,6 +41,7 @@ class BaseReport(object):
         Return README content in html format
         :return: str: report contents
         """
+        import markdown
         return markdown.markdown(self.render_markdown())
 
 
@@ -285,6 +285,7 @@ def parse_yaml_or_json(path):
     """
     Return parsed YAML or JSON for a path to a file.
     """
+    import yaml
     with codecs.open(path, mode='r', encoding='utf-8') as infile:
         doc = yaml.safe_load(infile)
     return doc
@@ -0,0 +1,126 @@
+"""
+Runs any of the stage, organize and upload steps in a single process.
+
+Running the steps as separate commands pays interpreter startup, imports and DukeDS client setup once per step.
+Here the steps run one after another sharing one DukeDS client. The upload step only uses it to find or create
+the project and to record provenance, so those calls reuse the client's authentication and keep-alive connection
+pool (sized for staging by --workers). Uploading the files and sharing the project go through ddsc's
+ProjectUpload, RemoteStore and D4S2Project, which open their own sessions from the same configuration.
+
+Run the pipeline command:
+    python -m lando_util.pipeline --stage-cmdfile stage.json --organize-cmdfile organize.json \
+        --upload-cmdfile upload.json --upload-outfile project.sh
+"""
+import click
+import time
+from contextlib import contextmanager
+from humanfriendly import format_timespan
+from lando_util.dukeds import LazyDukeDSClient
+from lando_util.stagedata import StageOptions, stage_cmdfile, create_cache, cache_dir_option, \
+    cache_max_size_option, DEFAULT_WORKERS
+from lando_util.projectcache import create_project_cache, project_cache_option, project_cache_ttl_option
+
+UPLOAD_OUTFILE_FORMATS = ('annotate_script', 'json')
+
+
+class Pipeline(object):
+    """
+    Runs the steps of a job in order sharing a DukeDS client between them.
+    """
+    def __init__(self, dds_client=None):
+        """
+        :param dds_client: DukeDSClient: client shared by the stage and upload steps, None to create one on first use
+        """
+        self.dds_client = dds_client or LazyDukeDSClient()
+
+    def stage(self, cmdfile, downloaded_metadata_file=None, workers=DEFAULT_WORKERS, type_limits=(), options=None,
+              stream=False):
+        """
+        Stage the items in cmdfile, see stagedata.stage_cmdfile.
+        :param cmdfile: file: stagedata command file
+        :param downloaded_metadata_file: file: optional file to write metadata about the staged DukeDS files to
+        :param workers: int: number of items to stage at the same time
+        :param type_limits: [str]: TYPE=N concurrency limits
+        :param options: StageOptions: settings for staging items, None for defaults
+        :param stream: bool: read cmdfile incrementally and stage items in batches
+        """
+        with log_step("stage"):
+            stage_cmdfile(self.dds_client, cmdfile, downloaded_metadata_file, workers, type_limits,
+                          options or StageOptions(), stream)
+            if downloaded_metadata_file:
+                # the upload step reads this file by path to record the input files used
+                downloaded_metadata_file.flush()
+
+    def organize(self, cmdfile):
+        """
+        Organize the output project, see organize_project.organizer.organize_cmdfile.
+        :param cmdfile: file: organize_project command file
+        """
+        from lando_util.organize_project.organizer import organize_cmdfile
+        with log_step("organize"):
+            organize_cmdfile(cmdfile)
+
+    def upload(self, cmdfile, outfile, outfile_format='annotate_script', project_cache=None):
+        """
+        Upload the output project, see upload.upload_cmdfile.
+        :param cmdfile: file: upload command file
+        :param outfile: file: file to write the project details to
+        :param outfile_format: str: one of UPLOAD_OUTFILE_FORMATS
+        :param project_cache: ProjectIdCache: optional cache of project ids by name
+        """
+        from lando_util.upload import upload_cmdfile
+        with log_step("upload"):
+            upload_cmdfile(cmdfile, outfile, outfile_format, self.dds_client, project_cache)
+
+
+@contextmanager
+def log_step(name, clock=time.monotonic):
+    """
+    Log when the step in the body of the with statement starts and how long it took.
+    """
+    click.echo("Starting {} step.".format(name))
+    started = clock()
+    status = "failed"
+    try:
+        yield
+        status = "finished"
+    finally:
+        click.echo("The {} step {} after {}.".format(name, status, format_timespan(clock() - started)))
+
+
+@click.command()
+@click.option('--stage-cmdfile', type=click.File(), help='stagedata command file, stages data when given.')
+@click.option('--downloaded-metadata-file', type=click.File('w'),
+              help='File to write metadata about the staged DukeDS files to.')
+@click.option('--workers', type=click.IntRange(min=1), default=DEFAULT_WORKERS,
+              help='Number of items to stage at the same time.')
+@click.option('--type-limit', 'type_limits', multiple=True,
+              help='Maximum number of items of a type to stage at the same time in TYPE=N format.')
+@cache_dir_option
+@cache_max_size_option
+@click.option('--organize-cmdfile', type=click.File(),
+              help='organize_project command file, organizes the output project when given.')
+@click.option('--upload-cmdfile', type=click.File(), help='upload command file, uploads the project when given.')
+@click.option('--upload-outfile', type=click.File('w'), help='File to write the uploaded project details to.')
+@click.option('--upload-outfile-format', type=click.Choice(UPLOAD_OUTFILE_FORMATS), default='annotate_script')
+@project_cache_option
+@project_cache_ttl_option
+def main(stage_cmdfile, downloaded_metadata_file, workers, type_limits, cache_dir, cache_max_size, organize_cmdfile,
+         upload_cmdfile, upload_outfile, upload_outfile_format, project_cache, project_cache_ttl):
+    if not (stage_cmdfile or organize_cmdfile or upload_cmdfile):
+        raise click.UsageError("At least one of --stage-cmdfile, --organize-cmdfile or --upload-cmdfile is required.")
+    if upload_cmdfile and not upload_outfile:
+        raise click.UsageError("--upload-outfile is required with --upload-cmdfile.")
+    pipeline = Pipeline()
+    if stage_cmdfile:
+        pipeline.stage(stage_cmdfile, downloaded_metadata_file, workers, type_limits,
+                       StageOptions(cache=create_cache(cache_dir, cache_max_size)))
+    if organize_cmdfile:
+        pipeline.organize(organize_cmdfile)
+    if upload_cmdfile:
+        pipeline.upload(upload_cmdfile, upload_outfile, upload_outfile_format,
+                        create_project_cache(project_cache, project_cache_ttl))
+
+
+if __name__ == '__main__':
+    main()
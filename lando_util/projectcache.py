@@ -0,0 +1,98 @@
+"""
+Remembers the id of the DukeDS project uploaded to under each name.
+
+DukeDS has no way to look up a project by name, so finding the upload destination means listing every project the
+account can access, which grows with the number of projects a service account owns. The cache maps
+(service url, project name) to the project id found by the last upload. A cached id is only trusted for
+ttl_seconds and is checked by fetching the single project it names: if the project was deleted, renamed or is not
+visible to this account the entry is dropped and the project is found by listing projects again.
+
+The cache is a small JSON file that may be shared by several jobs. It is replaced atomically, an unreadable file is
+treated as empty and concurrent writers keep the last entry written.
+"""
+import click
+import json
+import os
+import threading
+import time
+
+DEFAULT_PROJECT_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+
+class ProjectIdCache(object):
+    """
+    JSON file of project name -> id entries per DukeDS service url.
+    """
+    def __init__(self, path, ttl_seconds=DEFAULT_PROJECT_CACHE_TTL_SECONDS, clock=time.time):
+        """
+        :param path: str: path of the cache file
+        :param ttl_seconds: float: seconds an entry is used before the project is looked up by name again
+        :param clock: function: returns the current time in seconds since the epoch
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+
+    def get(self, url, name):
+        """
+        :param url: str: url of the DukeDS service
+        :param name: str: project name
+        :return: str: id of the project or None when it is not cached or the entry has expired
+        """
+        entry = self._read().get(url, {}).get(name)
+        if not entry or self.clock() - entry['cached'] >= self.ttl_seconds:
+            return None
+        return entry['id']
+
+    def set(self, url, name, project_id):
+        """
+        Remember project_id as the project named name.
+        """
+        data = self._read()
+        data.setdefault(url, {})[name] = {"id": project_id, "cached": self.clock()}
+        self._write(data)
+
+    def remove(self, url, name):
+        """
+        Forget the project named name.
+        """
+        data = self._read()
+        if data.get(url, {}).pop(name, None) is not None:
+            self._write(data)
+
+    def _read(self):
+        try:
+            with open(self.path) as infile:
+                data = json.load(infile)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _write(self, data):
+        parent_directory = os.path.dirname(self.path)
+        if parent_directory:
+            os.makedirs(parent_directory, exist_ok=True)
+        temp_path = "{}.{}.{}.tmp".format(self.path, os.getpid(), threading.get_ident())
+        with open(temp_path, 'w') as outfile:
+            json.dump(data, outfile)
+        os.replace(temp_path, self.path)
+
+
+def create_project_cache(project_cache, project_cache_ttl):
+    """
+    :param project_cache: str: path of the cache file or None to disable caching
+    :param project_cache_ttl: float: seconds an entry is used
+    :return: ProjectIdCache or None
+    """
+    if not project_cache:
+        return None
+    return ProjectIdCache(project_cache, project_cache_ttl)
+
+
+project_cache_option = click.option('--project-cache', envvar='LANDO_UTIL_PROJECT_CACHE',
+                                    help='File remembering the id of the project uploaded to under each name so '
+                                         'later uploads do not list every project to find it.')
+project_cache_ttl_option = click.option('--project-cache-ttl', type=click.FloatRange(min=0),
+                                        default=DEFAULT_PROJECT_CACHE_TTL_SECONDS,
+                                        help='Seconds a cached project id is used before the project is looked up '
+                                             'by name again.')
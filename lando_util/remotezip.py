@@ -0,0 +1,143 @@
+"""
+Extracts selected members of a zip archive on a web server without downloading the whole archive.
+
+The archive is read through HTTPRangeFile, a seekable file whose reads are HTTP Range requests. zipfile reads the
+central directory from the end of the archive and then only the local headers and compressed data of the members
+being extracted, so the archive itself never lands on disk. Sequential reads continue the open response so each
+member costs about one request.
+"""
+import io
+import os
+import time
+import zipfile
+from lando_util.extract import select_members, check_member_path
+from lando_util.httppool import get_default_pool
+from lando_util.urldownload import probe_ranges, get_validator, RemoteFileChangedError, IncompleteDownloadError, \
+    RETRYABLE_ERRORS, DEFAULT_RETRIES, DEFAULT_RETRY_WAIT_SECONDS, DEFAULT_TIMEOUT_SECONDS
+
+
+class RangeRequestsNotSupportedError(IOError):
+    pass
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    Read only seekable file over a url that supports HTTP Range requests.
+    Every response is checked against the validator (ETag or Last-Modified) seen when the file was opened so a
+    remote file that changes while being read raises RemoteFileChangedError instead of mixing bytes of two versions.
+    """
+    def __init__(self, url, retries=DEFAULT_RETRIES, retry_wait_seconds=DEFAULT_RETRY_WAIT_SECONDS,
+                 timeout=DEFAULT_TIMEOUT_SECONDS, pool=None):
+        """
+        :param url: str: url of the file
+        :param retries: int: number of times to reopen the response after a failed read
+        :param retry_wait_seconds: float: seconds to wait before the first retry, doubled for each further retry
+        :param timeout: float: socket timeout in seconds
+        :param pool: HTTPConnectionPool: connections to send requests over, None for the shared pool
+        """
+        super(HTTPRangeFile, self).__init__()
+        self.url = url
+        self.retries = retries
+        self.retry_wait_seconds = retry_wait_seconds
+        self.timeout = timeout
+        self.pool = pool or get_default_pool()
+        self.size, self.validator = probe_ranges(url, timeout, self.pool)
+        if self.size is None or not self.validator:
+            raise RangeRequestsNotSupportedError(
+                "{} does not support range requests with an ETag or Last-Modified header.".format(url))
+        self.pos = 0
+        self.response = None
+        self.response_pos = None
+        self.requests = 0
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError("Invalid whence {}".format(whence))
+        if pos < 0:
+            raise ValueError("Negative seek position {}".format(pos))
+        self.pos = pos
+        return self.pos
+
+    def readinto(self, buffer):
+        if self.pos >= self.size or not len(buffer):
+            return 0
+        attempt = 0
+        while True:
+            try:
+                if self.response_pos != self.pos:
+                    self._open_response()
+                count = self.response.readinto(buffer)
+                if not count:
+                    raise IncompleteDownloadError("Response for {} ended early at byte {}.".format(
+                        self.url, self.pos))
+                break
+            except RETRYABLE_ERRORS + (IncompleteDownloadError,):
+                self._close_response()
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.retry_wait_seconds * (2 ** attempt))
+                attempt += 1
+        self.pos += count
+        self.response_pos = self.pos
+        self.bytes_read += count
+        return count
+
+    def _open_response(self):
+        """
+        Request the bytes from the current position to the end of the file.
+        """
+        self._close_response()
+        headers = {'Range': 'bytes={}-'.format(self.pos), 'If-Range': self.validator}
+        response = self.pool.urlopen(self.url, headers, timeout=self.timeout)
+        self.requests += 1
+        if response.status != 206 or get_validator(response.headers) != self.validator:
+            response.close()
+            raise RemoteFileChangedError("{} changed while reading zip members.".format(self.url))
+        self.response = response
+        self.response_pos = self.pos
+
+    def _close_response(self):
+        if self.response:
+            self.response.close()
+        self.response = None
+        self.response_pos = None
+
+    def close(self):
+        self._close_response()
+        super(HTTPRangeFile, self).close()
+
+
+def extract_remote_zip(url, dest, member_patterns=None):
+    """
+    Extract members of the zip archive at url into dest reading only the parts of the archive they need.
+    :param url: str: url of the zip archive, the server must support range requests
+    :param dest: str: directory to extract into
+    :param member_patterns: [str]: glob patterns of members to extract, None extracts every member
+    :return: (int, int): number of members extracted, number of archive bytes read
+    """
+    with HTTPRangeFile(url) as remote_file:
+        with zipfile.ZipFile(io.BufferedReader(remote_file)) as z:
+            members = select_members(z.infolist(), member_patterns)
+            for member in members:
+                check_member_path(dest, member.filename)
+            os.makedirs(dest, exist_ok=True)
+            # extracting in archive order lets each member continue the response that read the previous one
+            for member in sorted(members, key=lambda member: member.header_offset):
+                z.extract(member, dest)
+        return len(members), remote_file.bytes_read
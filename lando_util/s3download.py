@@ -0,0 +1,216 @@
+"""
+Downloads objects from S3 compatible object stores.
+
+The source of an s3 item is s3://<bucket>/<key>. A source ending in / is a prefix: every object below it is staged
+into the dest directory using the rest of its key as the relative path. Large objects are fetched as byte ranges
+in parallel and written at their offsets into a preallocated partial file. Each ranged GET sends If-Match with the
+object's ETag so an object that changes while it is being downloaded raises RemoteFileChangedError instead of
+mixing bytes of two versions.
+
+boto3 is an optional dependency (pip install lando-util[s3]) imported when the first s3 item is staged.
+A single client, which keeps a pool of keep-alive connections to the endpoint, is shared by every thread.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from lando_util.extract import check_member_path
+from lando_util.httppool import DEFAULT_MAX_CONNECTIONS_PER_HOST
+from lando_util.urldownload import split_ranges, preallocate_file, IncompleteDownloadError, RemoteFileChangedError, \
+    RETRYABLE_ERRORS, DEFAULT_RETRIES, DEFAULT_RETRY_WAIT_SECONDS, DOWNLOAD_CHUNK_SIZE, PARTIAL_SUFFIX
+
+S3_SCHEME = "s3"
+PRECONDITION_FAILED_CODES = ("PreconditionFailed", "412")
+
+
+def parse_s3_url(url):
+    """
+    :param url: str: s3://<bucket>/<key or prefix>
+    :return: (str, str): bucket and key (or prefix)
+    """
+    parsed = urlsplit(url)
+    key = parsed.path.lstrip('/')
+    if parsed.scheme != S3_SCHEME or not parsed.netloc or not key:
+        raise ValueError("Invalid s3 source {}, expected s3://<bucket>/<key>.".format(url))
+    return parsed.netloc, key
+
+
+def is_s3_prefix(url):
+    return url.endswith('/')
+
+
+def create_s3_client(endpoint_url=None, max_pool_connections=DEFAULT_MAX_CONNECTIONS_PER_HOST):
+    """
+    :param endpoint_url: str: url of an S3 compatible service, None for AWS
+    :param max_pool_connections: int: number of keep-alive connections the client keeps to the endpoint
+    :return: boto3 S3 client using credentials from the environment or boto3 configuration files
+    """
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError:
+        raise ValueError("s3 items require the boto3 package (pip install lando-util[s3]).")
+    # a session per client since creating clients from the default session is not thread safe
+    return boto3.session.Session().client('s3', endpoint_url=endpoint_url,
+                                          config=Config(max_pool_connections=max_pool_connections))
+
+
+def get_retryable_errors():
+    errors = RETRYABLE_ERRORS + (IncompleteDownloadError,)
+    try:
+        from botocore.exceptions import BotoCoreError
+        return errors + (BotoCoreError,)
+    except ImportError:
+        return errors
+
+
+def get_error_code(exception):
+    """
+    :return: str: error code of a botocore ClientError, None for other exceptions
+    """
+    response = getattr(exception, 'response', None)
+    if not isinstance(response, dict):
+        return None
+    return response.get('Error', {}).get('Code')
+
+
+class S3Downloader(object):
+    """
+    Downloads objects and prefixes with a client created on first use.
+    """
+    def __init__(self, endpoint_url=None, max_pool_connections=DEFAULT_MAX_CONNECTIONS_PER_HOST, client=None,
+                 retries=DEFAULT_RETRIES, retry_wait_seconds=DEFAULT_RETRY_WAIT_SECONDS):
+        """
+        :param endpoint_url: str: url of an S3 compatible service, None for AWS
+        :param max_pool_connections: int: number of keep-alive connections to keep to the endpoint
+        :param client: boto3 S3 client to use instead of creating one
+        :param retries: int: number of times to resume each range after a failed read
+        :param retry_wait_seconds: float: seconds to wait before the first retry, doubled for each further retry
+        """
+        self.endpoint_url = endpoint_url
+        self.max_pool_connections = max_pool_connections
+        self.retries = retries
+        self.retry_wait_seconds = retry_wait_seconds
+        self._client = client
+        self.lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self.lock:
+            if self._client is None:
+                self._client = create_s3_client(self.endpoint_url, self.max_pool_connections)
+            return self._client
+
+    def download(self, source, dest, segments=1, segment_threshold=0):
+        """
+        Download the object at source to dest, or every object below a prefix into the dest directory.
+        :param source: str: s3://<bucket>/<key> or s3://<bucket>/<prefix>/
+        :param dest: str: path to save the object to, directory for prefixes
+        :param segments: int: number of ranges (or objects of a prefix) to download in parallel
+        :param segment_threshold: int: objects smaller than this many bytes are downloaded with a single GET
+        :return: int: number of bytes downloaded
+        """
+        bucket, key = parse_s3_url(source)
+        if is_s3_prefix(source):
+            return self.download_prefix(bucket, key, dest, segments, segment_threshold)
+        head = self.client.head_object(Bucket=bucket, Key=key)
+        return self.download_object(bucket, key, head['ContentLength'], head['ETag'], dest, segments,
+                                    segment_threshold)
+
+    def get_size(self, source):
+        """
+        :param source: str: s3://<bucket>/<key> or s3://<bucket>/<prefix>/
+        :return: int: size of the object in bytes, total size of the objects below a prefix
+        """
+        bucket, key = parse_s3_url(source)
+        if is_s3_prefix(source):
+            return sum(size for object_key, size, etag in self.list_objects(bucket, key))
+        return self.client.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+    def download_prefix(self, bucket, prefix, dest, segments=1, segment_threshold=0):
+        """
+        Download every object whose key starts with prefix into dest keeping the rest of the key as its path.
+        :return: int: number of bytes downloaded
+        """
+        objects = []
+        for key, size, etag in self.list_objects(bucket, prefix):
+            relative_path = key[len(prefix):]
+            if not relative_path or relative_path.endswith('/'):
+                continue  # the prefix itself or an empty "directory" marker object
+            check_member_path(dest, relative_path)
+            objects.append((key, size, etag, os.path.join(dest, relative_path)))
+        os.makedirs(dest, exist_ok=True)
+        for path in set(os.path.dirname(path) for key, size, etag, path in objects):
+            os.makedirs(path, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [executor.submit(self.download_object, bucket, key, size, etag, path, 1, segment_threshold)
+                       for key, size, etag, path in objects]
+            return sum(future.result() for future in futures)
+
+    def list_objects(self, bucket, prefix):
+        """
+        :return: generator of (str, int, str): key, size and ETag of each object whose key starts with prefix
+        """
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'], obj['Size'], obj['ETag']
+
+    def download_object(self, bucket, key, size, etag, dest, segments=1, segment_threshold=0):
+        """
+        Download an object into <dest>.partial, in segments ranges when it is at least segment_threshold bytes,
+        then move it to dest.
+        :return: int: size of the object
+        """
+        partial_path = dest + PARTIAL_SUFFIX
+        preallocate_file(partial_path, size)
+        if segments > 1 and size >= segment_threshold:
+            ranges = split_ranges(size, segments)
+        else:
+            ranges = [(0, size - 1)] if size else []
+        if len(ranges) > 1:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [executor.submit(self._download_range, bucket, key, etag, partial_path, start, end)
+                           for start, end in ranges]
+                for future in futures:
+                    future.result()
+        else:
+            for start, end in ranges:
+                self._download_range(bucket, key, etag, partial_path, start, end)
+        os.replace(partial_path, dest)
+        return size
+
+    def _download_range(self, bucket, key, etag, partial_path, start, end):
+        """
+        Download bytes start through end (inclusive) into the partial file, resuming the remainder after errors.
+        """
+        retryable_errors = get_retryable_errors()
+        offset = start
+        attempt = 0
+        fd = os.open(partial_path, os.O_WRONLY)
+        try:
+            while offset <= end:
+                try:
+                    response = self.client.get_object(Bucket=bucket, Key=key, IfMatch=etag,
+                                                      Range='bytes={}-{}'.format(offset, end))
+                    body = response['Body']
+                    try:
+                        while offset <= end:
+                            chunk = body.read(min(DOWNLOAD_CHUNK_SIZE, end + 1 - offset))
+                            if not chunk:
+                                raise IncompleteDownloadError("Range of s3://{}/{} ended early at byte {}.".format(
+                                    bucket, key, offset))
+                            os.pwrite(fd, chunk, offset)
+                            offset += len(chunk)
+                    finally:
+                        body.close()
+                except Exception as e:
+                    if get_error_code(e) in PRECONDITION_FAILED_CODES:
+                        raise RemoteFileChangedError("s3://{}/{} changed while downloading.".format(bucket, key))
+                    if not isinstance(e, retryable_errors) or attempt >= self.retries:
+                        raise
+                    time.sleep(self.retry_wait_seconds * (2 ** attempt))
+                    attempt += 1
+        finally:
+            os.close(fd)
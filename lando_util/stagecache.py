@@ -0,0 +1,245 @@
+"""
+Content addressed on-disk cache of downloaded DukeDS files.
+
+Files are stored under <cache_dir>/objects/<key> where key is built from the DukeDS file version id and hash.
+The modification time of <cache_dir>/used/<key>.used records when each cached file was last used so the least
+recently used files can be evicted when the cache grows beyond its maximum size. Cache hits are hardlinks to the
+cached file, so touching the cached file itself would also change the modification time of every staged copy and
+make their manifest entries look stale. Entries without a .used file fall back to the cached file's modification
+time.
+
+Processes sharing a cache directory (for example pods on one node mounting the same volume) coordinate downloads
+with lock files under <cache_dir>/locks/<key>.lock. The first process to lock a key downloads the file while the
+others wait for the lock and then link the cached file. The lock file records which process holds it. The locks are
+flock locks so the kernel releases them when the holding process exits or is killed, which lets a waiting process
+take over the download after a crash without any manual cleanup.
+"""
+import errno
+import fcntl
+import glob
+import json
+import os
+import re
+import socket
+import time
+from contextlib import contextmanager
+from lando_util.fileutil import link_or_copy_file
+from lando_util.checksum import get_dukeds_hash
+
+OBJECTS_DIRNAME = "objects"
+LOCKS_DIRNAME = "locks"
+USED_DIRNAME = "used"
+LOCK_POLL_SECONDS = 1
+# errors raised by file systems that do not support flock
+UNSUPPORTED_LOCK_ERRNOS = (errno.ENOLCK, errno.EOPNOTSUPP, errno.ENOSYS)
+VALID_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+def get_dukeds_cache_key(file_data):
+    """
+    Build a cache key for a DukeDS file from the DukeDS file response data.
+    :param file_data: dict: DukeDS file response data
+    :return: str: cache key or None when the version id or hash is missing
+    """
+    version_id = (file_data.get('current_version') or {}).get('id')
+    algorithm, hexdigest = get_dukeds_hash(file_data)
+    if not version_id or not hexdigest:
+        return None
+    key = "{}-{}-{}".format(version_id, algorithm, hexdigest)
+    if not VALID_KEY_PATTERN.match(key):
+        return None
+    return key
+
+
+class CacheEntry(object):
+    def __init__(self, path, size, last_used):
+        self.path = path
+        self.size = size
+        self.last_used = last_used
+
+
+class FileCache(object):
+    def __init__(self, cache_dir, max_size=None):
+        """
+        :param cache_dir: str: directory to store cached files in
+        :param max_size: int: maximum number of bytes to keep in the cache, None for unlimited
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.objects_dir = os.path.join(cache_dir, OBJECTS_DIRNAME)
+        self.locks_dir = os.path.join(cache_dir, LOCKS_DIRNAME)
+        self.used_dir = os.path.join(cache_dir, USED_DIRNAME)
+
+    def _get_path(self, key):
+        return os.path.join(self.objects_dir, key)
+
+    def _get_used_path(self, key):
+        return os.path.join(self.used_dir, "{}.used".format(key))
+
+    def _mark_used(self, key):
+        os.makedirs(self.used_dir, exist_ok=True)
+        used_path = self._get_used_path(key)
+        with open(used_path, 'a'):
+            pass
+        os.utime(used_path)
+
+    def _get_last_used(self, key, stat):
+        try:
+            return os.stat(self._get_used_path(key)).st_mtime
+        except FileNotFoundError:
+            return stat.st_mtime
+
+    def _get_lock_path(self, key):
+        return os.path.join(self.locks_dir, "{}.lock".format(key))
+
+    @contextmanager
+    def lock(self, key, on_wait=None, poll_seconds=LOCK_POLL_SECONDS):
+        """
+        Hold the lock for key shared by every process using this cache directory.
+        Waits while another process holds the lock. When the lock is acquired the body should check the cache
+        again since the previous holder has usually just added the file.
+        When the file system does not support locks the body runs without waiting.
+        :param key: str: cache key
+        :param on_wait: func(dict): called once with the holder's marker (host, pid, started) if the lock is held
+        :param poll_seconds: float: how often to retry the lock while waiting
+        """
+        os.makedirs(self.locks_dir, exist_ok=True)
+        with open(self._get_lock_path(key), 'a+') as lock_file:
+            if not self._acquire(lock_file, on_wait, poll_seconds):
+                yield
+                return
+            try:
+                # a previous holder that crashed mid download may have left a partial file behind
+                self._remove_temp_files(key)
+                self._write_marker(lock_file, key)
+                yield
+            finally:
+                lock_file.truncate(0)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _acquire(lock_file, on_wait, poll_seconds):
+        """
+        :return: bool: True if the lock was acquired, False if the file system does not support locks
+        """
+        waiting = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                if e.errno in UNSUPPORTED_LOCK_ERRNOS:
+                    return False
+                raise
+            if not waiting and on_wait:
+                on_wait(FileCache._read_marker(lock_file))
+            waiting = True
+            time.sleep(poll_seconds)
+
+    @staticmethod
+    def _read_marker(lock_file):
+        lock_file.seek(0)
+        try:
+            return json.loads(lock_file.read())
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _write_marker(lock_file, key):
+        lock_file.truncate(0)
+        lock_file.write(json.dumps({
+            "key": key,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started": time.time(),
+        }))
+        lock_file.flush()
+
+    def _remove_temp_files(self, key):
+        for path in glob.glob(glob.escape(self._get_path(key)) + ".*.tmp"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get_cached_path(self, key):
+        """
+        :param key: str: cache key
+        :return: str: path of the cached file for key or None if it is not in the cache
+        """
+        path = self._get_path(key)
+        return path if os.path.exists(path) else None
+
+    def fetch(self, key, dest):
+        """
+        Place the cached file for key at dest.
+        :param key: str: cache key
+        :param dest: str: path to place the cached file at
+        :return: bool: True if the file was found in the cache
+        """
+        try:
+            link_or_copy_file(self._get_path(key), dest)
+        except FileNotFoundError:
+            return False
+        self._mark_used(key)
+        return True
+
+    def add(self, key, source):
+        """
+        Add the file at source to the cache under key then evict old entries if the cache is too large.
+        :param key: str: cache key
+        :param source: str: path to the downloaded file
+        """
+        os.makedirs(self.objects_dir, exist_ok=True)
+        link_or_copy_file(source, self._get_path(key))
+        self._mark_used(key)
+        if self.max_size is not None:
+            self.prune(self.max_size)
+
+    def entries(self):
+        """
+        :return: [CacheEntry]: entries in the cache ordered from least to most recently used
+        """
+        entries = []
+        if os.path.exists(self.objects_dir):
+            for dir_entry in os.scandir(self.objects_dir):
+                if dir_entry.is_file() and not dir_entry.name.endswith('.tmp'):
+                    stat = dir_entry.stat()
+                    entries.append(CacheEntry(dir_entry.path, stat.st_size, self._get_last_used(dir_entry.name, stat)))
+        return sorted(entries, key=lambda entry: entry.last_used)
+
+    def stats(self):
+        """
+        :return: dict: summary of the cache contents
+        """
+        entries = self.entries()
+        return {
+            "cache_dir": self.cache_dir,
+            "entries": len(entries),
+            "size": sum(entry.size for entry in entries),
+            "max_size": self.max_size,
+            "oldest_last_used": entries[0].last_used if entries else None,
+        }
+
+    def prune(self, max_size):
+        """
+        Remove least recently used entries until the cache is no larger than max_size.
+        :param max_size: int: number of bytes to reduce the cache to
+        :return: [CacheEntry]: removed entries
+        """
+        entries = self.entries()
+        total_size = sum(entry.size for entry in entries)
+        removed = []
+        for entry in entries:
+            if total_size <= max_size:
+                break
+            for path in (entry.path, self._get_used_path(os.path.basename(entry.path))):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_size -= entry.size
+            removed.append(entry)
+        return removed
@@ -1,55 +1,706 @@
 import click
+import itertools
 import json
 import os
-import zipfile
-import urllib.request
-from ddsc.sdk.client import Client as DukeDSClient
+import threading
+from contextlib import contextmanager
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from humanfriendly import parse_size, format_size
+from lando_util.stagecache import FileCache, get_dukeds_cache_key
+from lando_util.urldownload import SegmentedDownload, DecompressingDownload
+from lando_util.httppool import configure_default_pool, DEFAULT_MAX_CONNECTIONS_PER_HOST
+from lando_util.decompress import parse_decompress_format, write_decompressed
+from lando_util.extract import extract_zip
+from lando_util.remotezip import extract_remote_zip
+from lando_util.s3download import S3Downloader, parse_s3_url, is_s3_prefix
+from lando_util.dukeds import DukeDSDownloader, LazyDukeDSClient, DEFAULT_PREFETCH_WORKERS
+from lando_util.checksum import parse_checksum, verify_checksum, get_dukeds_hash, hash_file, ChecksumMismatchError
+from lando_util.stagemanifest import StageManifest
+from lando_util.stagestatus import StageStatus, is_critical, detach_when_critical_ready
+from lando_util.jsonstream import iter_json_items
+from lando_util.stagemetrics import StageMetrics, ProgressReporter, DEFAULT_PROGRESS_INTERVAL_SECONDS
+from lando_util.stageplan import get_item_sizes, create_schedule, format_schedule, find_duplicate_sources, \
+    promote_duplicate_sources, SCHEDULES, DEFAULT_SCHEDULE, LARGEST_FIRST_SCHEDULE
+from lando_util.stageshard import parse_shard, assign_shards, create_shard_metadata, merge_shard_metadata, \
+    ShardAssignmentError, ShardMergeError
+from lando_util.stagepreflight import create_plan, check_free_space, format_plan, DEFAULT_EXPECTED_RATE
+from lando_util.fileutil import link_or_copy_file, place_file, COPY_METHODS
+
+STAGE_ITEM_TYPES = ("DukeDS", "url", "write", "local", "s3")
+DEFAULT_WORKERS = 1
+DEFAULT_URL_SEGMENTS = 1
+DEFAULT_URL_SEGMENT_THRESHOLD = "256MB"
+DEFAULT_UNZIP_WORKERS = 1
+# optional cmdfile item fields stored in StageItem.settings
+STAGE_ITEM_SETTINGS = ("unzip_members", "checksum", "priority", "copy_method", "decompress", "remote_unzip",
+                       "critical")
+# item types that support the decompress setting
+DECOMPRESS_ITEM_TYPES = ("DukeDS", "url", "local")
+# number of cmdfile items read ahead of staging when streaming the cmdfile
+STREAM_BATCH_SIZE = 1000
+METADATA_FORMATS = ("json", "ndjson")
+# bytes read at a time when decompressing local files
+LOCAL_READ_SIZE = 1024 * 1024
+
+
+class StagingError(Exception):
+    """
+    Raised when one or more items could not be staged. failures contains (item, exception) tuples in cmdfile order.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        lines = ["Failed to stage {} item(s):".format(len(failures))]
+        for (item_type, source, dest, unzip_to), exception in failures:
+            lines.append("{} {} to {}: {}".format(item_type, source, dest, exception))
+        super(StagingError, self).__init__("\n".join(lines))
+
+
+class StageItem(namedtuple('StageItem', ['item_type', 'source', 'dest', 'unzip_to'])):
+    """
+    Item to stage that unpacks as (item_type, source, dest, unzip_to).
+    Optional cmdfile fields (see STAGE_ITEM_SETTINGS) are kept in the settings dictionary.
+    """
+    def __new__(cls, item_type, source, dest, unzip_to=None, **settings):
+        item = super(StageItem, cls).__new__(cls, item_type, source, dest, unzip_to)
+        item.settings = settings
+        return item
+
+    @staticmethod
+    def create(item):
+        """
+        :param item: StageItem or (item_type, source, dest, unzip_to) tuple
+        :return: StageItem
+        """
+        if isinstance(item, StageItem):
+            return item
+        return StageItem(*item)
 
 
 def get_stage_items(cmdfile):
     data = json.load(cmdfile)
-    items = []
-    for file_data in data['items']:
-        item_type = file_data['type']
-        source = file_data['source']
-        dest = file_data['dest']
-        unzip_to = file_data.get('unzip_to')
-        items.append((item_type, source, dest, unzip_to))
-    return items
-
-
-def stage_data(dds_client, stage_items):
-    downloaded_metadata_items = []
+    return [create_stage_item(file_data) for file_data in data['items']]
+
+
+def iter_stage_items(cmdfile):
+    """
+    Read items from cmdfile one at a time. cmdfile may be a JSON object with an items list or contain one
+    JSON item per line.
+    :param cmdfile: file: command file to read
+    :return: generator of StageItem
+    """
+    for file_data in iter_json_items(cmdfile):
+        yield create_stage_item(file_data)
+
+
+def create_stage_item(file_data):
+    """
+    :param file_data: dict: item from the cmdfile
+    :return: StageItem
+    """
+    item_type = file_data['type']
+    source = file_data['source']
+    dest = file_data['dest']
+    unzip_to = file_data.get('unzip_to')
+    settings = dict((name, file_data[name]) for name in STAGE_ITEM_SETTINGS if name in file_data)
+    if 'checksum' in settings:
+        parse_checksum(settings['checksum'])
+    if not isinstance(settings.get('critical', False), bool):
+        raise ValueError("Invalid critical {} for {}, expected true or false.".format(settings['critical'], dest))
+    if not isinstance(settings.get('priority', 0), int):
+        raise ValueError("Invalid priority {} for {}, expected an integer.".format(settings['priority'], dest))
+    if settings.get('copy_method', 'copy') not in COPY_METHODS:
+        raise ValueError("Invalid copy_method {} for {}, expected one of {}.".format(
+            settings['copy_method'], dest, ", ".join(COPY_METHODS)))
+    if 'decompress' in settings:
+        if item_type not in DECOMPRESS_ITEM_TYPES:
+            raise ValueError("decompress is not supported for {} items.".format(item_type))
+        codec, is_tar = parse_decompress_format(settings['decompress'])
+        if is_tar and unzip_to:
+            raise ValueError("unzip_to can not be used with decompress {} for {}, the archive is extracted to "
+                             "dest.".format(settings['decompress'], dest))
+    if item_type == "s3":
+        parse_s3_url(source)
+        if is_s3_prefix(source) and (unzip_to or 'checksum' in settings):
+            raise ValueError("unzip_to and checksum can not be used with the s3 prefix {}.".format(source))
+    if settings.get('remote_unzip'):
+        if item_type != "url" or not unzip_to:
+            raise ValueError("remote_unzip requires a url item with unzip_to for {}.".format(dest))
+        if 'checksum' in settings or 'decompress' in settings:
+            raise ValueError("remote_unzip can not be used with checksum or decompress for {}, the whole archive "
+                             "is never downloaded.".format(dest))
+    return StageItem(item_type, source, dest, unzip_to, **settings)
+
+
+class StageOptions(object):
+    """
+    Settings that apply to how every item is staged.
+    """
+    def __init__(self, cache=None, url_segments=DEFAULT_URL_SEGMENTS,
+                 url_segment_threshold=parse_size(DEFAULT_URL_SEGMENT_THRESHOLD), unzip_workers=DEFAULT_UNZIP_WORKERS,
+                 prefetch_workers=DEFAULT_PREFETCH_WORKERS, manifest=None, metrics=None, schedule=DEFAULT_SCHEDULE,
+                 metadata_writer=None, space_check=False, expected_rate=parse_size(DEFAULT_EXPECTED_RATE),
+                 status=None, s3_downloader=None):
+        """
+        :param cache: FileCache: optional cache of previously downloaded DukeDS files
+        :param url_segments: int: number of parallel connections used to download large url and s3 items
+        :param url_segment_threshold: int: url and s3 items smaller than this many bytes use a single connection
+        :param unzip_workers: int: number of processes used to extract each zip file
+        :param prefetch_workers: int: number of DukeDS metadata requests to send at the same time
+        :param manifest: StageManifest: optional record of staged items used to skip items already in place
+        :param metrics: StageMetrics: collects timing of each item, None to create a new one
+        :param schedule: str: order to start items in, one of SCHEDULES
+        :param metadata_writer: NDJSONMetadataWriter: optional writer that saves each DukeDS item's metadata as soon
+        as the item is staged
+        :param space_check: bool: estimate the space each batch needs and fail before staging when a destination
+        filesystem does not have enough free space
+        :param expected_rate: int: bytes per second used to estimate the transfer time of a plan
+        :param status: StageStatus: optional publisher of each item's readiness
+        :param s3_downloader: S3Downloader: downloader for s3 items, None for one using the default endpoint
+        """
+        self.cache = cache
+        self.url_segments = url_segments
+        self.url_segment_threshold = url_segment_threshold
+        self.unzip_workers = unzip_workers
+        self.prefetch_workers = prefetch_workers
+        self.manifest = manifest
+        self.metrics = metrics or StageMetrics()
+        self.schedule = schedule
+        self.metadata_writer = metadata_writer
+        self.space_check = space_check
+        self.expected_rate = expected_rate
+        self.status = status
+        self.s3_downloader = s3_downloader or S3Downloader()
+
+
+def stage_data(dds_client, stage_items, workers=DEFAULT_WORKERS, type_limits=None, options=None,
+               dukeds_downloader=None):
+    """
+    Stage stage_items, when workers is more than one items are staged concurrently.
+    :param dds_client: DukeDSClient: client used to download DukeDS items
+    :param stage_items: [(item_type, source, dest, unzip_to)]: items to stage
+    :param workers: int: maximum number of items to stage at the same time
+    :param type_limits: dict: item_type -> maximum number of items of that type to stage at the same time
+    :param options: StageOptions: settings for staging items, None for defaults
+    :param dukeds_downloader: DukeDSDownloader: downloader that may already hold metadata for the DukeDS items,
+    None to create one for dds_client
+    :return: [dict]: metadata for the DukeDS items in the same order as stage_items
+    """
+    options = options or StageOptions()
     click.echo("Staging {} items.".format(len(stage_items)))
-    for item_type, source, dest, unzip_to in stage_items:
-        parent_directory = os.path.dirname(dest)
-        os.makedirs(parent_directory, exist_ok=True)
-        if item_type == "DukeDS":
-            metadata_item = download_dukeds_file(dds_client, source, dest)
-            downloaded_metadata_items.append(metadata_item)
-        elif item_type == "url":
-            download_url(source, dest)
-        elif item_type == "write":
-            write_file(source, dest)
-        else:
-            raise ValueError("Unsupported type {}".format(item_type))
-        if unzip_to:
-            # if specified unzip downloaded file to `unzip_to` location
-            unzip(dest, unzip_to)
+    options.metrics.expect_items(len(stage_items))
+    if options.status:
+        options.status.expect_critical(sum(1 for item in stage_items if is_critical(StageItem.create(item))))
+    dukeds_downloader = dukeds_downloader or DukeDSDownloader(dds_client, options.prefetch_workers)
+    with publish_completion(options.status):
+        results = stage_batch(dukeds_downloader, stage_items, workers, type_limits, options)
     click.echo("Staging complete.".format(len(stage_items)))
-    return downloaded_metadata_items
+    return [metadata_item for metadata_item in results if metadata_item is not None]
+
+
+def stream_stage_data(dds_client, stage_items, workers=DEFAULT_WORKERS, type_limits=None, options=None,
+                      batch_size=STREAM_BATCH_SIZE):
+    """
+    Stage items as they are read from stage_items holding at most batch_size items in memory.
+    Items are staged a batch at a time so a failure stops staging after the batch that contains it.
+    :param dds_client: DukeDSClient: client used to download DukeDS items
+    :param stage_items: iterable of StageItem: items to stage, typically from iter_stage_items
+    :param workers: int: maximum number of items to stage at the same time
+    :param type_limits: dict: item_type -> maximum number of items of that type to stage at the same time
+    :param options: StageOptions: settings for staging items, None for defaults
+    :param batch_size: int: number of items to read ahead of staging
+    :return: generator of dict: metadata for the DukeDS items in the same order as stage_items
+    """
+    options = options or StageOptions()
+    click.echo("Staging items in batches of {}.".format(batch_size))
+    dukeds_downloader = DukeDSDownloader(dds_client, options.prefetch_workers)
+    staged_count = 0
+    batch = []
+    with publish_completion(options.status):
+        for item in itertools.chain(stage_items, [None]):
+            if item is not None:
+                batch.append(item)
+            if batch and (item is None or len(batch) == batch_size):
+                results = stage_batch(dukeds_downloader, batch, workers, type_limits, options)
+                dukeds_downloader.clear()
+                staged_count += len(batch)
+                batch = []
+                for metadata_item in results:
+                    if metadata_item is not None:
+                        yield metadata_item
+    click.echo("Staging complete, staged {} items.".format(staged_count))
+
+
+@contextmanager
+def publish_completion(status):
+    """
+    Publish that staging ended, and whether it failed, once the body of the with statement finishes.
+    :param status: StageStatus: status to publish to, None to do nothing
+    """
+    if not status:
+        yield
+        return
+    try:
+        yield
+    except Exception as e:
+        status.finish(e)
+        raise
+    status.finish()
+
+
+def stage_batch(dukeds_downloader, stage_items, workers, type_limits, options):
+    """
+    Prefetch DukeDS metadata for stage_items then stage them.
+    Items that share a source with an earlier item are staged once the earlier item has finished by
+    linking or copying its dest instead of downloading the source again. Critical items are copied as soon as their
+    source is staged, other items after every source has been staged.
+    :return: [object]: result of stage_item for each item in the same order as stage_items
+    """
+    stage_items = [StageItem.create(item) for item in stage_items]
+    with options.metrics.phase('prefetch'):
+        prefetch_dukeds_files(dukeds_downloader, stage_items, workers)
+    duplicates = find_duplicate_sources(stage_items)
+    unique_indexes = [idx for idx in range(len(stage_items)) if idx not in duplicates]
+    unique_items = [stage_items[idx] for idx in unique_indexes]
+    sizes = None
+    if options.space_check or options.schedule == LARGEST_FIRST_SCHEDULE:
+        with options.metrics.phase('sizes'):
+            sizes = get_item_sizes(dukeds_downloader, stage_items, options.prefetch_workers,
+                           s3_downloader=options.s3_downloader)
+    if options.space_check:
+        with options.metrics.phase('preflight'):
+            plan = create_plan(dukeds_downloader, stage_items, sizes, options.expected_rate, duplicates,
+                               options.prefetch_workers, options.cache)
+        for line in format_plan(plan):
+            click.echo(line)
+        for warning in check_free_space(plan):
+            click.echo(warning, err=True)
+    unique_sizes = [sizes[idx] for idx in unique_indexes] if sizes else None
+    scheduled_items = promote_duplicate_sources(stage_items, duplicates)
+    order = schedule_items(dukeds_downloader, [scheduled_items[idx] for idx in unique_indexes], options,
+                           unique_sizes)
+    results = [None] * len(stage_items)
+    critical_duplicates = {}
+    for idx, source_idx in sorted(duplicates.items()):
+        if is_critical(stage_items[idx]):
+            critical_duplicates.setdefault(source_idx, []).append(idx)
+    failures = []
+    # a checksum mismatch only fails that item, staging one item at a time other errors stop staging
+    item_errors = Exception if workers > 1 else ChecksumMismatchError
+
+    def stage_duplicate(idx, source_idx):
+        try:
+            results[idx] = stage_item(dukeds_downloader, stage_items[idx], options,
+                                      duplicate_of=(stage_items[source_idx], results[source_idx]))
+        except item_errors as e:
+            report_failure(stage_items[idx], e)
+            failures.append((stage_items[idx], e))
+
+    staged_sources = set()
+    source_errors = {}
+
+    def on_source_staged(unique_idx, result):
+        source_idx = unique_indexes[unique_idx]
+        results[source_idx] = result
+        staged_sources.add(source_idx)
+        for idx in critical_duplicates.get(source_idx, []):
+            stage_duplicate(idx, source_idx)
+
+    if workers > 1:
+        try:
+            StagingPool(dukeds_downloader, workers, type_limits, options).run(unique_items, order,
+                                                                              on_staged=on_source_staged)
+        except StagingError as e:
+            # the pool reports failures in the order of the items it was given
+            failed_sources = [idx for idx in unique_indexes if idx not in staged_sources]
+            source_errors.update((idx, failure[1]) for idx, failure in zip(failed_sources, e.failures))
+            failures.extend(e.failures)
+    else:
+        for idx in order:
+            try:
+                result = stage_item(dukeds_downloader, unique_items[idx], options)
+            except item_errors as e:
+                report_failure(unique_items[idx], e)
+                source_errors[unique_indexes[idx]] = e
+                failures.append((unique_items[idx], e))
+                continue
+            on_source_staged(idx, result)
+    # duplicates of a source that could not be staged fail with the same error
+    remaining_duplicates = []
+    for idx, source_idx in sorted(duplicates.items()):
+        if source_idx in source_errors:
+            failures.append((stage_items[idx], source_errors[source_idx]))
+        elif not is_critical(stage_items[idx]):
+            remaining_duplicates.append((idx, source_idx))
+    if remaining_duplicates:
+        click.echo("Copying {} items whose source was already staged.".format(len(remaining_duplicates)))
+    for idx, source_idx in remaining_duplicates:
+        stage_duplicate(idx, source_idx)
+    if failures:
+        raise StagingError(sorted(failures, key=lambda failure: stage_items.index(failure[0])))
+    return results
+
+
+def plan_stage_items(dds_client, stage_items, options, dukeds_downloader=None):
+    """
+    Estimate what staging stage_items would transfer and write without staging them.
+    :param dds_client: DukeDSClient: client used to look up DukeDS items
+    :param stage_items: [StageItem]: items to plan
+    :param options: StageOptions: settings for staging items
+    :param dukeds_downloader: DukeDSDownloader: downloader that may already hold metadata for the DukeDS items,
+    None to create one for dds_client
+    :return: dict: plan from stagepreflight.create_plan
+    """
+    stage_items = [StageItem.create(item) for item in stage_items]
+    dukeds_downloader = dukeds_downloader or DukeDSDownloader(dds_client, options.prefetch_workers)
+    prefetch_dukeds_files(dukeds_downloader, stage_items, options.prefetch_workers)
+    sizes = get_item_sizes(dukeds_downloader, stage_items, options.prefetch_workers,
+                           s3_downloader=options.s3_downloader)
+    return create_plan(dukeds_downloader, stage_items, sizes, options.expected_rate,
+                       find_duplicate_sources(stage_items), options.prefetch_workers, options.cache)
+
+
+def select_shard(dukeds_downloader, stage_items, shard, options):
+    """
+    Look up the size of every item and choose the items staged by shard.
+    :param dukeds_downloader: DukeDSDownloader: downloader used to look up DukeDS items, keeps their metadata for
+    staging the shard
+    :param stage_items: [StageItem]: every item in the cmdfile
+    :param shard: (int, int): shard index and number of shards
+    :param options: StageOptions: settings for staging items
+    :return: [int]: indexes into stage_items staged by shard in cmdfile order
+    """
+    with options.metrics.phase('sizes'):
+        prefetch_dukeds_files(dukeds_downloader, stage_items, options.prefetch_workers)
+        try:
+            # every shard must see the same sizes to split the items the same way
+            sizes = get_item_sizes(dukeds_downloader, stage_items, options.prefetch_workers, strict=True,
+                                   s3_downloader=options.s3_downloader)
+        except Exception as e:
+            raise ShardAssignmentError("Could not look up the sizes used to split items between shards: {}".format(
+                e)) from e
+    indexes = assign_shards(stage_items, sizes, shard[1])[shard[0]]
+    click.echo("Shard {}/{} stages {} of {} items ({} of {}).".format(
+        shard[0], shard[1], len(indexes), len(stage_items), format_size(sum(sizes[idx] or 0 for idx in indexes)),
+        format_size(sum(size or 0 for size in sizes))))
+    return indexes
+
+
+def schedule_items(dukeds_downloader, stage_items, options, sizes=None):
+    """
+    Choose the order to start stage_items in logging the schedule when it differs from cmdfile order.
+    :param sizes: [int]: size of each item when already known, looked up for largest-first when None
+    :return: [int]: indexes into stage_items in the order they should start
+    """
+    stage_items = [StageItem.create(item) for item in stage_items]
+    if options.schedule != LARGEST_FIRST_SCHEDULE:
+        sizes = None
+    elif sizes is None:
+        with options.metrics.phase('sizes'):
+            sizes = get_item_sizes(dukeds_downloader, stage_items, options.prefetch_workers,
+                           s3_downloader=options.s3_downloader)
+    order = create_schedule(stage_items, sizes, options.schedule)
+    options.metrics.schedule = options.schedule
+    if sizes is not None or order != sorted(order):
+        for line in format_schedule(stage_items, order, sizes, options.schedule):
+            click.echo(line)
+    return order
+
+
+def prefetch_dukeds_files(dukeds_downloader, stage_items, workers):
+    """
+    Fetch metadata and download urls for all DukeDS items before any bytes are transferred.
+    :param dukeds_downloader: DukeDSDownloader: downloader to prefetch with
+    :param stage_items: [(item_type, source, dest, unzip_to)]: items to stage
+    :param workers: int: maximum number of items that will be staged at the same time
+    """
+    file_ids = [source for item_type, source, dest, unzip_to in stage_items if item_type == "DukeDS"]
+    if file_ids:
+        click.echo("Fetching metadata for {} DukeDS files.".format(len(file_ids)))
+        dukeds_downloader.configure_connection_pool(max(workers, dukeds_downloader.workers))
+        dukeds_downloader.prefetch(file_ids)
+
+
+def stage_item(dukeds_downloader, item, options, duplicate_of=None):
+    """
+    Stage a single item.
+    :param dukeds_downloader: DukeDSDownloader: downloader used for DukeDS items
+    :param item: StageItem or (item_type, source, dest, unzip_to) tuple: item to stage
+    :param options: StageOptions: settings for staging items
+    :param duplicate_of: (StageItem, dict): staged item with the same source and its metadata, when set its
+    dest is linked or copied to item's dest instead of fetching the source
+    :return: dict: metadata for DukeDS items otherwise None
+    """
+    item = StageItem.create(item)
+    item_metrics = options.metrics.start_item(item)
+    if options.status:
+        options.status.start_item(item)
+    try:
+        metadata_item, status = _stage_item(dukeds_downloader, item, options, item_metrics, duplicate_of)
+    except Exception as e:
+        options.metrics.finish_item(item_metrics, "failed")
+        if options.status:
+            options.status.finish_item(item, "failed", e)
+        raise
+    options.metrics.finish_item(item_metrics, status)
+    if options.status:
+        options.status.finish_item(item, status)
+    if options.metadata_writer and metadata_item is not None:
+        options.metadata_writer.write(metadata_item)
+    return metadata_item
+
+
+def _stage_item(dukeds_downloader, item, options, item_metrics, duplicate_of=None):
+    """
+    Stage item recording the time spent in each phase in item_metrics.
+    :return: (dict, str): metadata for DukeDS items otherwise None and whether the item was staged or skipped
+    """
+    item_type, source, dest, unzip_to = item
+    metrics = options.metrics
+    version = None
+    if options.manifest:
+        with metrics.phase('metadata', item_metrics):
+            version = get_source_version(dukeds_downloader, item)
+        entry = options.manifest.get_current_entry(item, version)
+        if entry:
+            click.echo("Skipping {} {}, already staged to {}.".format(item_type, source, dest))
+            return entry['metadata'], "skipped"
+    metadata_item = None
+    checksum = None
+    parent_directory = os.path.dirname(dest)
+    os.makedirs(parent_directory, exist_ok=True)
+    if duplicate_of:
+        with metrics.phase('transfer', item_metrics):
+            metadata_item = copy_staged_file(duplicate_of[0], duplicate_of[1], item)
+        checksum = metadata_item['checksum'] if metadata_item else None
+    elif item_type == "DukeDS":
+        with metrics.phase('metadata', item_metrics):
+            dukeds_downloader.get_file_info(source)
+        with metrics.phase('transfer', item_metrics):
+            metadata_item = download_dukeds_file(dukeds_downloader, source, dest, options.cache,
+                                                 item.settings.get('decompress'))
+        checksum = metadata_item['checksum']
+    elif item_type == "url" and item.settings.get('remote_unzip'):
+        with metrics.phase('transfer', item_metrics):
+            item_metrics.bytes = unzip_remote(source, unzip_to, item.settings.get('unzip_members'))
+    elif item_type == "url":
+        with metrics.phase('transfer', item_metrics):
+            checksum = download_url(source, dest, options.url_segments, options.url_segment_threshold,
+                                    item.settings.get('checksum'), item.settings.get('decompress'))
+    elif item_type == "s3":
+        with metrics.phase('transfer', item_metrics):
+            item_metrics.bytes, checksum = download_s3(options.s3_downloader, source, dest, options.url_segments,
+                                                       options.url_segment_threshold, item.settings.get('checksum'))
+    elif item_type == "write":
+        with metrics.phase('transfer', item_metrics):
+            write_file(source, dest)
+    elif item_type == "local":
+        with metrics.phase('transfer', item_metrics):
+            copy_local_file(source, dest, item.settings.get('copy_method', 'copy'), item.settings.get('decompress'))
+    else:
+        raise ValueError("Unsupported type {}".format(item_type))
+    if unzip_to and not item.settings.get('remote_unzip'):
+        # if specified unzip downloaded file to `unzip_to` location
+        with metrics.phase('unzip', item_metrics):
+            unzip(dest, unzip_to, item.settings.get('unzip_members'), options.unzip_workers)
+    if options.manifest:
+        options.manifest.record(item, version, checksum, metadata_item)
+    return metadata_item, "staged"
+
+
+def copy_staged_file(staged_item, staged_metadata_item, item):
+    """
+    Reflink, hardlink or copy the dest of staged_item to the dest of item.
+    :param staged_item: StageItem: item already staged with the same source as item
+    :param staged_metadata_item: dict: metadata returned when staging staged_item
+    :param item: StageItem: item to stage
+    :return: dict: copy of staged_metadata_item or None
+    """
+    if item.dest != staged_item.dest:
+        method = link_or_copy_file(staged_item.dest, item.dest)
+        click.echo("Copied {} to {} using {}.".format(staged_item.dest, item.dest, method))
+    return dict(staged_metadata_item) if staged_metadata_item is not None else None
+
+
+def get_source_version(dukeds_downloader, item):
+    """
+    :param dukeds_downloader: DukeDSDownloader: downloader used for DukeDS items
+    :param item: StageItem: item to find the source version of
+    :return: str: current DukeDS file version id for DukeDS items, size and modification time of the source
+    for local items otherwise None
+    """
+    if item.item_type == "local":
+        source_stat = os.stat(item.source)
+        return "{}-{}".format(source_stat.st_size, source_stat.st_mtime_ns)
+    if item.item_type != "DukeDS":
+        return None
+    metadata = dukeds_downloader.get_file_info(item.source).metadata
+    return (metadata.get('current_version') or {}).get('id')
+
+
+def report_failure(item, exception):
+    """
+    Log that item could not be staged.
+    :param item: StageItem: item that failed
+    :param exception: Exception: why it failed
+    """
+    item_type, source, dest, unzip_to = item
+    click.echo("Failed to stage {} {} to {}: {}".format(item_type, source, dest, exception), err=True)
+
+
+class StagingPool(object):
+    """
+    Stages items using a bounded pool of threads. Each item type has its own concurrency limit.
+    Items are started in cmdfile order skipping over items whose type is already at its limit.
+    """
+    def __init__(self, dukeds_downloader, workers, type_limits=None, options=None):
+        """
+        :param dukeds_downloader: DukeDSDownloader: downloader used for DukeDS items
+        :param workers: int: maximum number of items to stage at the same time
+        :param type_limits: dict: item_type -> maximum number of items of that type to stage at the same time
+        :param options: StageOptions: settings for staging items, None for defaults
+        """
+        self.dukeds_downloader = dukeds_downloader
+        self.workers = workers
+        self.type_limits = type_limits or {}
+        self.options = options or StageOptions()
 
+    def type_limit(self, item_type):
+        return min(self.type_limits.get(item_type, self.workers), self.workers)
 
-def download_dukeds_file(dds_client, source, dest):
-    click.echo("Downloading DukeDS file {} to {}.".format(source, dest))
-    dds_file = dds_client.get_file_by_id(file_id=source)
-    dds_file.download_to_path(dest)
-    return dds_file._data_dict
+    def run(self, stage_items, order=None, on_staged=None):
+        """
+        Stage all items raising StagingError after all items have finished if any of them failed.
+        :param stage_items: [(item_type, source, dest, unzip_to)]: items to stage
+        :param order: [int]: indexes into stage_items in the order they should start, None for cmdfile order
+        :param on_staged: function: called with the index and result of each staged item as it finishes, from the
+        thread running the pool
+        :return: [object]: result of stage_item for each item in the same order as stage_items
+        """
+        order = order if order is not None else range(len(stage_items))
+        rank = [0] * len(stage_items)
+        pending_by_type = OrderedDict((item_type, deque()) for item_type in STAGE_ITEM_TYPES)
+        for position, idx in enumerate(order):
+            item_type = stage_items[idx][0]
+            if item_type not in pending_by_type:
+                raise ValueError("Unsupported type {}".format(item_type))
+            pending_by_type[item_type].append(idx)
+            rank[idx] = position
+        running_by_type = dict((item_type, 0) for item_type in STAGE_ITEM_TYPES)
+        results = [None] * len(stage_items)
+        errors = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                while len(running) < self.workers:
+                    idx = self._pop_next_startable(pending_by_type, running_by_type, rank)
+                    if idx is None:
+                        break
+                    running_by_type[stage_items[idx][0]] += 1
+                    running[executor.submit(stage_item, self.dukeds_downloader, stage_items[idx], self.options)] = idx
+                if not running:
+                    break
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx = running.pop(future)
+                    running_by_type[stage_items[idx][0]] -= 1
+                    try:
+                        results[idx] = future.result()
+                    except Exception as e:
+                        report_failure(stage_items[idx], e)
+                        errors[idx] = e
+                        continue
+                    if on_staged:
+                        on_staged(idx, results[idx])
+        if errors:
+            raise StagingError([(stage_items[idx], errors[idx]) for idx in sorted(errors)])
+        return results
 
+    def _pop_next_startable(self, pending_by_type, running_by_type, rank):
+        """
+        Remove and return the earliest scheduled pending index whose item type is below its concurrency limit.
+        :param rank: [int]: position of each index in the schedule
+        :return: int: index into stage_items or None when no item can be started
+        """
+        next_item_type = None
+        for item_type, pending in pending_by_type.items():
+            if pending and running_by_type[item_type] < self.type_limit(item_type):
+                if next_item_type is None or rank[pending[0]] < rank[pending_by_type[next_item_type][0]]:
+                    next_item_type = item_type
+        if next_item_type is None:
+            return None
+        return pending_by_type[next_item_type].popleft()
 
-def download_url(source, dest):
+
+def download_dukeds_file(dukeds_downloader, source, dest, cache=None, decompress_format=None):
+    file_info = dukeds_downloader.get_file_info(source)
+    # the cache holds the files as stored in DukeDS so decompressed files are not cached
+    cache_key = get_dukeds_cache_key(file_info.metadata) if cache and not decompress_format else None
+    checksum = fetch_cached_dukeds_file(cache, cache_key, file_info, source, dest) if cache_key else None
+    if cache_key and not checksum:
+        # single-flight: other processes sharing the cache wait here while one of them downloads the file
+        with cache.lock(cache_key, on_wait=lambda holder: echo_waiting_for_download(holder, source)):
+            checksum = fetch_cached_dukeds_file(cache, cache_key, file_info, source, dest)
+            if not checksum:
+                click.echo("Downloading DukeDS file {} to {}.".format(source, dest))
+                checksum = dukeds_downloader.download(file_info, dest, decompress_format)
+                cache.add(cache_key, dest)
+    elif not checksum:
+        click.echo("Downloading DukeDS file {} to {}.".format(source, dest))
+        checksum = dukeds_downloader.download(file_info, dest, decompress_format)
+    metadata_item = dict(file_info.metadata)
+    metadata_item['checksum'] = checksum
+    return metadata_item
+
+
+def fetch_cached_dukeds_file(cache, cache_key, file_info, source, dest):
+    """
+    Place the cached copy of a DukeDS file at dest.
+    :return: dict: checksum details for the file or None if it is not in the cache
+    """
+    if not cache.fetch(cache_key, dest):
+        return None
+    click.echo("Using cached DukeDS file {} for {}.".format(source, dest))
+    # cache entries are keyed by the DukeDS hash they were verified against when added
+    algorithm, hexdigest = get_dukeds_hash(file_info.metadata)
+    return {"algorithm": algorithm, "value": hexdigest, "verified": True}
+
+
+def echo_waiting_for_download(holder, source):
+    """
+    :param holder: dict: marker written by the process holding the cache lock
+    :param source: str: DukeDS file id being waited for
+    """
+    click.echo("Waiting for {} pid {} to download DukeDS file {}.".format(
+        holder.get("host", "another process"), holder.get("pid", "unknown"), source))
+
+
+def download_url(source, dest, segments=DEFAULT_URL_SEGMENTS,
+                 segment_threshold=parse_size(DEFAULT_URL_SEGMENT_THRESHOLD), checksum=None, decompress_format=None):
     click.echo("Downloading URL {} to {}.".format(source, dest))
-    urllib.request.urlretrieve(source, dest)
+    algorithm, expected_hexdigest = parse_checksum(checksum) if checksum else (None, None)
+    if decompress_format:
+        download = DecompressingDownload(source, dest, decompress_format, hash_algorithm=algorithm)
+    else:
+        download = SegmentedDownload(source, dest, segments, segment_threshold, hash_algorithm=algorithm)
+    download.run()
+    if checksum:
+        return verify_checksum(dest, algorithm, expected_hexdigest, download.hexdigest)
+    return None
+
+
+def download_s3(s3_downloader, source, dest, segments=DEFAULT_URL_SEGMENTS,
+                segment_threshold=parse_size(DEFAULT_URL_SEGMENT_THRESHOLD), checksum=None):
+    """
+    :return: (int, dict): bytes downloaded, checksum details when checksum is set otherwise None
+    """
+    click.echo("Downloading S3 {} to {}.".format(source, dest))
+    size = s3_downloader.download(source, dest, segments, segment_threshold)
+    if checksum:
+        algorithm, expected_hexdigest = parse_checksum(checksum)
+        # ranges arrive out of order so the assembled file is hashed once complete
+        return size, verify_checksum(dest, algorithm, expected_hexdigest, hash_file(dest, algorithm).hexdigest())
+    return size, None
 
 
 def write_file(source, dest):
@@ -58,10 +709,30 @@ def write_file(source, dest):
         outfile.write(source)
 
 
-def unzip(source, dest):
+def copy_local_file(source, dest, copy_method='copy', decompress_format=None):
+    if decompress_format:
+        click.echo("Decompressing local file {} to {}.".format(source, dest))
+        with open(source, 'rb') as infile:
+            write_decompressed(iter(lambda: infile.read(LOCAL_READ_SIZE), b''), dest, decompress_format)
+        return
+    method = place_file(source, dest, copy_method)
+    click.echo("Copied local file {} to {} using {}.".format(source, dest, method))
+
+
+def unzip(source, dest, member_patterns=None, workers=DEFAULT_UNZIP_WORKERS):
     click.echo("Unzip file {} to {}.".format(source, dest))
-    with zipfile.ZipFile(source) as z:
-        z.extractall(dest)
+    extract_zip(source, dest, member_patterns, workers)
+
+
+def unzip_remote(url, dest, member_patterns=None):
+    """
+    Extract members of the zip archive at url into dest fetching only the parts of the archive they need.
+    :return: int: number of archive bytes read
+    """
+    click.echo("Unzip url {} to {}.".format(url, dest))
+    member_count, bytes_read = extract_remote_zip(url, dest, member_patterns)
+    click.echo("Extracted {} members reading {} of the archive.".format(member_count, format_size(bytes_read)))
+    return bytes_read
 
 
 def write_downloaded_metadata(outfile, downloaded_metadata_items):
@@ -71,16 +742,313 @@ def write_downloaded_metadata(outfile, downloaded_metadata_items):
     }))
 
 
+def write_shard_metadata(outfile, shard_metadata):
+    click.echo("Writing {} metadata items for shard {}/{} to {}.".format(
+        len(shard_metadata["items"]), shard_metadata["shard"], shard_metadata["shards"], outfile.name))
+    outfile.write(json.dumps(shard_metadata))
+
+
+def stream_downloaded_metadata(outfile, downloaded_metadata_items):
+    """
+    Write metadata items in the same format as write_downloaded_metadata as they are produced.
+    :param outfile: file: file to write to
+    :param downloaded_metadata_items: iterable of dict: metadata items
+    """
+    count = 0
+    outfile.write('{"items": [')
+    for metadata_item in downloaded_metadata_items:
+        if count:
+            outfile.write(', ')
+        outfile.write(json.dumps(metadata_item))
+        count += 1
+    outfile.write(']}')
+    click.echo("Wrote {} metadata items to {}.".format(count, outfile.name))
+
+
+class NDJSONMetadataWriter(object):
+    """
+    Appends one line of JSON metadata per item as items finish so partial results survive a failed run.
+    Lines are written in the order items finish, which may differ from cmdfile order.
+    """
+    def __init__(self, outfile):
+        """
+        :param outfile: file: file to write to
+        """
+        self.outfile = outfile
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def write(self, metadata_item):
+        line = json.dumps(metadata_item) + "\n"
+        with self.lock:
+            self.outfile.write(line)
+            self.outfile.flush()
+            self.count += 1
+
+
+def parse_shard_option(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def parse_type_limits(values):
+    """
+    Parse TYPE=N strings into a dictionary of item type to concurrency limit.
+    :param values: [str]: values in TYPE=N format
+    :return: dict: item_type -> int
+    """
+    type_limits = {}
+    for value in values:
+        item_type, sep, limit = value.partition('=')
+        if not sep or item_type not in STAGE_ITEM_TYPES or not limit.isdigit() or int(limit) < 1:
+            raise click.BadParameter("Invalid type limit {}, expected TYPE=N with TYPE one of {}.".format(
+                value, ", ".join(STAGE_ITEM_TYPES)))
+        type_limits[item_type] = int(limit)
+    return type_limits
+
+
+def create_cache(cache_dir, cache_max_size):
+    """
+    :param cache_dir: str: directory to store cached files in or None to disable caching
+    :param cache_max_size: str: human readable maximum cache size (eg. 500GB) or None for unlimited
+    :return: FileCache or None
+    """
+    if not cache_dir:
+        return None
+    max_size = parse_size(cache_max_size) if cache_max_size else None
+    return FileCache(cache_dir, max_size)
+
+
+class DefaultCommandGroup(click.Group):
+    """
+    Command group that runs default_command when the first argument is not one of its subcommands.
+    This keeps `stagedata <COMMAND_FILE>` working alongside subcommands such as `stagedata cache stats`.
+    """
+    def __init__(self, *args, **kwargs):
+        self.default_command = kwargs.pop('default_command')
+        super(DefaultCommandGroup, self).__init__(*args, **kwargs)
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] != '--help':
+            args.insert(0, self.default_command)
+        return super(DefaultCommandGroup, self).parse_args(ctx, args)
+
+
+cache_dir_option = click.option('--cache-dir', envvar='LANDO_UTIL_CACHE_DIR',
+                                 help='Directory used to cache downloaded DukeDS files between jobs.')
+cache_max_size_option = click.option('--cache-max-size', envvar='LANDO_UTIL_CACHE_MAX_SIZE',
+                                     help='Maximum size of the cache (eg. 500GB), least recently used files are '
+                                          'removed when the cache grows larger.')
+
+
 @click.command()
 @click.argument('cmdfile', type=click.File())
 @click.argument('downloaded_metadata_file', type=click.File('w'), required=False)
-def main(cmdfile, downloaded_metadata_file):
-    dds_client = DukeDSClient()
+@click.option('--workers', type=click.IntRange(min=1), default=DEFAULT_WORKERS,
+              help='Number of items to stage at the same time.')
+@click.option('--type-limit', 'type_limits', multiple=True,
+              help='Maximum number of items of a type to stage at the same time in TYPE=N format.')
+@cache_dir_option
+@cache_max_size_option
+@click.option('--url-segments', type=click.IntRange(min=1), default=DEFAULT_URL_SEGMENTS,
+              help='Number of parallel connections used to download large url and s3 items.')
+@click.option('--url-segment-threshold', default=DEFAULT_URL_SEGMENT_THRESHOLD,
+              help='url and s3 items smaller than this size (eg. 256MB) are downloaded with a single connection.')
+@click.option('--url-connections-per-host', type=click.IntRange(min=1), default=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+              help='Maximum number of connections open to a url host at the same time. Connections are kept alive '
+                   'and reused by later requests to the same host.')
+@click.option('--s3-endpoint-url', envvar='LANDO_UTIL_S3_ENDPOINT_URL',
+              help='Url of the S3 compatible service s3 items are downloaded from, defaults to AWS.')
+@click.option('--unzip-workers', type=click.IntRange(min=1), default=DEFAULT_UNZIP_WORKERS,
+              help='Number of processes used to extract each unzip_to archive.')
+@click.option('--prefetch-workers', type=click.IntRange(min=1), default=DEFAULT_PREFETCH_WORKERS,
+              help='Number of DukeDS metadata requests to send at the same time before downloading.')
+@click.option('--manifest', envvar='LANDO_UTIL_STAGE_MANIFEST',
+              help='File recording staged items. Items whose dest still matches it are skipped when staging again.')
+@click.option('--metrics-file', type=click.File('w'),
+              help='Write timing and throughput of the staged items to this JSON file when staging finishes.')
+@click.option('--progress-interval', type=click.FloatRange(min=0), default=DEFAULT_PROGRESS_INTERVAL_SECONDS,
+              help='Seconds between progress reports written to stderr, 0 disables them.')
+@click.option('--schedule', type=click.Choice(SCHEDULES), default=DEFAULT_SCHEDULE,
+              help='Order to start items in. largest-first looks up item sizes and starts large items first. '
+                   'Items with a higher priority field always start first.')
+@click.option('--metadata-format', type=click.Choice(METADATA_FORMATS), default="json",
+              help='Format of DOWNLOADED_METADATA_FILE. ndjson appends one line per DukeDS item as soon as it is '
+                   'staged instead of writing a single document when staging finishes.')
+@click.option('--stream', is_flag=True,
+              help='Read the command file incrementally (a JSON items list or one JSON item per line) and stage '
+                   'items in batches so memory use does not grow with the number of items.')
+@click.option('--plan', 'plan_file', type=click.File('w'),
+              help='Write the sizes, disk space and estimated transfer time staging would need to this JSON file '
+                   'and exit without staging.')
+@click.option('--space-check/--no-space-check', default=True,
+              help='Check that each destination filesystem has room for the items before staging them.')
+@click.option('--expected-rate', default=DEFAULT_EXPECTED_RATE,
+              help='Transfer rate per second (eg. 50MB) used to estimate how long staging will take.')
+@click.option('--status-file', type=click.File('w'),
+              help='Append a JSON line to this file as each item finishes, once the critical items have finished '
+                   'and when staging ends.')
+@click.option('--ready-markers', is_flag=True,
+              help='Write a <dest>.ready file next to each item once it has been staged.')
+@click.option('--detach-after-critical', is_flag=True,
+              help='Exit as soon as the items marked critical are staged while a background process stages the '
+                   'remaining items. Exits with status 1 if a critical item fails.')
+@click.option('--detach-log', default=os.devnull,
+              help='File the background process started by --detach-after-critical appends its output to.')
+@click.option('--shard', callback=parse_shard_option,
+              help='Stage only shard i of N (i/N, i counts from 0). Items are split between shards by size. '
+                   'DOWNLOADED_METADATA_FILE receives partial metadata to combine with `stagedata merge`.')
+def main(cmdfile, downloaded_metadata_file, workers, type_limits, cache_dir, cache_max_size, url_segments,
+         url_segment_threshold, url_connections_per_host, s3_endpoint_url, unzip_workers, prefetch_workers, manifest,
+         metrics_file, progress_interval, schedule, metadata_format, stream, plan_file, space_check, expected_rate,
+         status_file, ready_markers, detach_after_critical, detach_log, shard):
+    if detach_after_critical and stream:
+        raise click.UsageError("--detach-after-critical can not be used with --stream.")
+    if shard and (stream or metadata_format == "ndjson"):
+        raise click.UsageError("--shard can not be used with --stream or --metadata-format ndjson.")
+    status = None
+    if status_file or ready_markers or detach_after_critical:
+        status = StageStatus(status_file, ready_markers)
+    if detach_after_critical and not plan_file:
+        exit_code = detach_when_critical_ready(status, detach_log)
+        if exit_code is not None:
+            if exit_code:
+                raise click.ClickException("Staging a critical item failed.")
+            click.echo("Critical items staged, staging the remaining items in the background.")
+            return
+    dds_client = LazyDukeDSClient()
+    configure_default_pool(url_connections_per_host)
+    metrics = StageMetrics()
+    options = StageOptions(cache=create_cache(cache_dir, cache_max_size),
+                           url_segments=url_segments,
+                           url_segment_threshold=parse_size(url_segment_threshold),
+                           unzip_workers=unzip_workers,
+                           prefetch_workers=prefetch_workers,
+                           manifest=StageManifest(manifest) if manifest else None,
+                           metrics=metrics,
+                           schedule=schedule,
+                           space_check=space_check,
+                           expected_rate=parse_size(expected_rate),
+                           status=status,
+                           s3_downloader=S3Downloader(s3_endpoint_url, url_connections_per_host))
+    if plan_file:
+        click.echo("Writing plan to {}.".format(plan_file.name))
+        stage_items = get_stage_items(cmdfile)
+        dukeds_downloader = DukeDSDownloader(dds_client, options.prefetch_workers)
+        if shard:
+            stage_items = [stage_items[idx] for idx in select_shard(dukeds_downloader, stage_items, shard, options)]
+        json.dump(plan_stage_items(dds_client, stage_items, options, dukeds_downloader), plan_file, indent=2)
+        return
+    if downloaded_metadata_file and metadata_format == "ndjson":
+        options.metadata_writer = NDJSONMetadataWriter(downloaded_metadata_file)
+        downloaded_metadata_file = None
+    try:
+        if progress_interval:
+            with ProgressReporter(metrics, progress_interval):
+                stage_cmdfile(dds_client, cmdfile, downloaded_metadata_file, workers, type_limits, options, stream,
+                              shard)
+        else:
+            stage_cmdfile(dds_client, cmdfile, downloaded_metadata_file, workers, type_limits, options, stream,
+                          shard)
+    finally:
+        if options.metadata_writer:
+            click.echo("Wrote {} metadata items to {}.".format(options.metadata_writer.count,
+                                                                options.metadata_writer.outfile.name))
+        if metrics_file:
+            click.echo("Writing metrics to {}.".format(metrics_file.name))
+            metrics.write(metrics_file)
+
+
+def stage_cmdfile(dds_client, cmdfile, downloaded_metadata_file, workers, type_limits, options, stream,
+                  shard=None):
+    """
+    Stage the items in cmdfile and write metadata about the DukeDS items to downloaded_metadata_file.
+    When shard (index, count) is set only the items of that shard are staged and partial metadata is written.
+    """
+    if stream:
+        downloaded_metadata_items = stream_stage_data(dds_client, iter_stage_items(cmdfile), workers=workers,
+                                                      type_limits=parse_type_limits(type_limits), options=options)
+        if downloaded_metadata_file:
+            stream_downloaded_metadata(downloaded_metadata_file, downloaded_metadata_items)
+        else:
+            for _ in downloaded_metadata_items:
+                pass
+        return
     stage_items = get_stage_items(cmdfile)
-    downloaded_metadata_items = stage_data(dds_client, stage_items)
+    if shard:
+        # the metadata fetched to size every item is reused to stage the shard's DukeDS items
+        dukeds_downloader = DukeDSDownloader(dds_client, options.prefetch_workers)
+        indexes = select_shard(dukeds_downloader, stage_items, shard, options)
+        downloaded_metadata_items = stage_data(dds_client, [stage_items[idx] for idx in indexes], workers=workers,
+                                               type_limits=parse_type_limits(type_limits), options=options,
+                                               dukeds_downloader=dukeds_downloader)
+        if downloaded_metadata_file:
+            write_shard_metadata(downloaded_metadata_file,
+                                 create_shard_metadata(shard, stage_items, indexes, downloaded_metadata_items))
+        return
+    downloaded_metadata_items = stage_data(dds_client, stage_items, workers=workers,
+                                           type_limits=parse_type_limits(type_limits), options=options)
     if downloaded_metadata_file:
         write_downloaded_metadata(downloaded_metadata_file, downloaded_metadata_items)
 
 
+@click.group(cls=DefaultCommandGroup, default_command='stage')
+def cli():
+    pass
+
+
+@cli.group()
+def cache():
+    """Inspect or shrink the DukeDS download cache."""
+    pass
+
+
+@cache.command()
+@cache_dir_option
+@cache_max_size_option
+def stats(cache_dir, cache_max_size):
+    """Print the number of files and total size of the cache."""
+    file_cache = create_cache(cache_dir, cache_max_size)
+    if not file_cache:
+        raise click.UsageError("--cache-dir is required.")
+    cache_stats = file_cache.stats()
+    click.echo("Cache directory: {}".format(cache_stats['cache_dir']))
+    click.echo("Entries: {}".format(cache_stats['entries']))
+    click.echo("Size: {}".format(format_size(cache_stats['size'])))
+    if cache_stats['max_size'] is not None:
+        click.echo("Max size: {}".format(format_size(cache_stats['max_size'])))
+
+
+@cache.command()
+@cache_dir_option
+@cache_max_size_option
+def prune(cache_dir, cache_max_size):
+    """Remove least recently used files until the cache is no larger than --cache-max-size."""
+    file_cache = create_cache(cache_dir, cache_max_size)
+    if not file_cache or file_cache.max_size is None:
+        raise click.UsageError("--cache-dir and --cache-max-size are required.")
+    removed = file_cache.prune(file_cache.max_size)
+    click.echo("Removed {} entries ({}).".format(len(removed), format_size(sum(entry.size for entry in removed))))
+
+
+@cli.command()
+@click.argument('downloaded_metadata_file', type=click.File('w'))
+@click.argument('partial_metadata_files', type=click.File(), nargs=-1, required=True)
+def merge(downloaded_metadata_file, partial_metadata_files):
+    """Combine the partial metadata files written by every --shard into DOWNLOADED_METADATA_FILE."""
+    try:
+        downloaded_metadata_items = merge_shard_metadata([json.load(infile) for infile in partial_metadata_files])
+    except ShardMergeError as e:
+        raise click.ClickException(str(e))
+    write_downloaded_metadata(downloaded_metadata_file, downloaded_metadata_items)
+
+
+cli.add_command(main, 'stage')
+
+
 if __name__ == '__main__':
-    main()
+    cli()
@@ -0,0 +1,121 @@
+"""
+Records each staged item so that staging the same cmdfile again can skip items that are already in place.
+
+The manifest is a file of JSON lines appended (and fsynced) as each item finishes so it survives the process
+being killed part way through staging. The last line recorded for a dest wins.
+"""
+import json
+import os
+import threading
+
+
+class StageManifest(object):
+    def __init__(self, path):
+        """
+        :param path: str: path of the manifest file, created when the first item is recorded
+        """
+        self.path = path
+        self.entries = read_manifest_entries(path)
+        self.lock = threading.Lock()
+        self._compact()
+
+    def get_current_entry(self, item, version=None):
+        """
+        Find the entry for item if its dest has not changed since it was recorded.
+        :param item: StageItem: item about to be staged
+        :param version: str: version of the source (DukeDS file version id), None for other item types
+        :return: dict: recorded entry or None if item must be staged
+        """
+        entry = self.entries.get(item.dest)
+        if not entry or entry['item'] != get_item_key(item) or entry['version'] != version:
+            return None
+        try:
+            dest_stat = os.stat(get_staged_path(item))
+        except FileNotFoundError:
+            return None
+        if dest_stat.st_size != entry['size'] or dest_stat.st_mtime_ns != entry['mtime_ns']:
+            return None
+        if item.unzip_to and not os.path.isdir(item.unzip_to):
+            return None
+        return entry
+
+    def record(self, item, version=None, checksum=None, metadata=None):
+        """
+        Save the size and modification time of item's dest after it has been staged.
+        :param item: StageItem: item that was staged
+        :param version: str: version of the source (DukeDS file version id), None for other item types
+        :param checksum: dict: checksum details of dest or None if the contents were not hashed
+        :param metadata: dict: downloaded metadata returned for the item
+        """
+        dest_stat = os.stat(get_staged_path(item))
+        entry = {
+            "dest": item.dest,
+            "item": get_item_key(item),
+            "version": version,
+            "size": dest_stat.st_size,
+            "mtime_ns": dest_stat.st_mtime_ns,
+            "checksum": checksum,
+            "metadata": metadata,
+        }
+        with self.lock:
+            self.entries[item.dest] = entry
+            with open(self.path, 'a') as outfile:
+                outfile.write(json.dumps(entry) + "\n")
+                outfile.flush()
+                os.fsync(outfile.fileno())
+
+    def _compact(self):
+        """
+        Rewrite the manifest with only the latest entry for each dest so it does not grow with every rerun.
+        """
+        if not os.path.exists(self.path):
+            return
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(temp_path, 'w') as outfile:
+            for entry in self.entries.values():
+                outfile.write(json.dumps(entry) + "\n")
+        os.replace(temp_path, self.path)
+
+
+def get_item_key(item):
+    """
+    :param item: StageItem: item to build a key for
+    :return: dict: fields of item that must be unchanged for a recorded entry to be reused
+    """
+    # round trip through json so tuples and lists compare equal to values read back from the manifest
+    return json.loads(json.dumps({
+        "type": item.item_type,
+        "source": item.source,
+        "unzip_to": item.unzip_to,
+        "settings": item.settings,
+    }))
+
+
+def get_staged_path(item):
+    """
+    :param item: StageItem: item to find the path of
+    :return: str: path whose size and modification time are recorded, unzip_to for remote_unzip items since they
+    never write dest
+    """
+    if item.settings.get('remote_unzip'):
+        return item.unzip_to
+    return item.dest
+
+
+def read_manifest_entries(path):
+    """
+    Read the latest entry for each dest from a manifest file ignoring a partially written last line.
+    :param path: str: path of the manifest file
+    :return: dict: dest -> entry
+    """
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path) as infile:
+        for line in infile:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry['dest']] = entry
+    return entries
@@ -0,0 +1,251 @@
+"""
+Collects timing and throughput of staged items for periodic progress reports and a final metrics file.
+
+Each item's time is split into phases: metadata (DukeDS lookups), transfer (download, cache fetch or write) and
+unzip. Totals are also kept per data source (url host, DukeDS or write) so slow sources stand out across jobs.
+Only aggregates and the slowest items are kept so memory does not grow with the number of items.
+"""
+import click
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from humanfriendly import format_size, format_timespan
+
+DEFAULT_SLOWEST_COUNT = 10
+DEFAULT_PROGRESS_INTERVAL_SECONDS = 30
+
+
+class ItemMetrics(object):
+    def __init__(self, item_type, source, dest, started):
+        self.item_type = item_type
+        self.source = source
+        self.dest = dest
+        self.started = started
+        self.finished = None
+        self.status = None
+        self.phases = {}
+        self.bytes = 0
+
+    @property
+    def duration(self):
+        return self.finished - self.started
+
+    @property
+    def bytes_per_second(self):
+        return rate(self.bytes, self.phases.get('transfer', 0))
+
+    def to_dict(self):
+        return {
+            "type": self.item_type,
+            "source": self.source if self.item_type != "write" else None,
+            "dest": self.dest,
+            "status": self.status,
+            "seconds": self.duration,
+            "phase_seconds": self.phases,
+            "bytes": self.bytes,
+            "bytes_per_second": self.bytes_per_second,
+        }
+
+
+class StageMetrics(object):
+    """
+    Thread safe collector of staging metrics.
+    """
+    def __init__(self, slowest_count=DEFAULT_SLOWEST_COUNT, clock=time.monotonic):
+        """
+        :param slowest_count: int: number of slowest items to keep
+        :param clock: function: returns the current time in seconds
+        """
+        self.slowest_count = slowest_count
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.started = clock()
+        self.total_items = None
+        self.schedule = None
+        self.status_counts = {}
+        self.running = 0
+        self.bytes = 0
+        self.phase_seconds = {}
+        self.sources = {}
+        self.slowest = []
+        self.counter = itertools.count()
+
+    def expect_items(self, count):
+        """
+        :param count: int: number of items that will be staged, used to estimate the time remaining
+        """
+        with self.lock:
+            self.total_items = count
+
+    @contextmanager
+    def phase(self, name, item_metrics=None):
+        """
+        Time the body of the with statement adding it to the total for phase name and to item_metrics.
+        """
+        started = self.clock()
+        try:
+            yield
+        finally:
+            seconds = self.clock() - started
+            with self.lock:
+                self.phase_seconds[name] = self.phase_seconds.get(name, 0) + seconds
+                if item_metrics:
+                    item_metrics.phases[name] = item_metrics.phases.get(name, 0) + seconds
+
+    def start_item(self, item):
+        """
+        :param item: StageItem: item about to be staged
+        :return: ItemMetrics: metrics to pass to phase and finish_item
+        """
+        item_type, source, dest, unzip_to = item
+        with self.lock:
+            self.running += 1
+        return ItemMetrics(item_type, source, dest, self.clock())
+
+    def finish_item(self, item_metrics, status):
+        """
+        :param item_metrics: ItemMetrics: metrics returned by start_item
+        :param status: str: staged, skipped or failed
+        """
+        item_metrics.finished = self.clock()
+        item_metrics.status = status
+        # items that do not write dest (such as remote_unzip) set bytes while staging
+        if status == "staged" and not item_metrics.bytes:
+            item_metrics.bytes = get_file_size(item_metrics.dest)
+        with self.lock:
+            self.running -= 1
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            self.bytes += item_metrics.bytes
+            source_totals = self.sources.setdefault(get_source_name(item_metrics), {
+                "items": 0, "bytes": 0, "transfer_seconds": 0
+            })
+            source_totals["items"] += 1
+            source_totals["bytes"] += item_metrics.bytes
+            source_totals["transfer_seconds"] += item_metrics.phases.get('transfer', 0)
+            entry = (item_metrics.duration, next(self.counter), item_metrics)
+            if len(self.slowest) < self.slowest_count:
+                heapq.heappush(self.slowest, entry)
+            elif self.slowest and entry > self.slowest[0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def progress(self):
+        """
+        :return: dict: snapshot of the items and bytes staged so far
+        """
+        with self.lock:
+            elapsed = self.clock() - self.started
+            completed = sum(self.status_counts.values())
+            eta_seconds = None
+            if self.total_items is not None and completed:
+                eta_seconds = elapsed / completed * (self.total_items - completed)
+            return {
+                "elapsed_seconds": elapsed,
+                "total_items": self.total_items,
+                "completed_items": completed,
+                "failed_items": self.status_counts.get("failed", 0),
+                "running_items": self.running,
+                "bytes": self.bytes,
+                "bytes_per_second": rate(self.bytes, elapsed),
+                "eta_seconds": eta_seconds,
+            }
+
+    def summary(self):
+        """
+        :return: dict: metrics for the whole run
+        """
+        summary = self.progress()
+        with self.lock:
+            summary["schedule"] = self.schedule
+            summary["items"] = dict(self.status_counts)
+            summary["phase_seconds"] = dict(self.phase_seconds)
+            summary["sources"] = dict(
+                (name, dict(totals, bytes_per_second=rate(totals["bytes"], totals["transfer_seconds"])))
+                for name, totals in self.sources.items()
+            )
+            summary["slowest_items"] = [item_metrics.to_dict()
+                                        for _, _, item_metrics in sorted(self.slowest, reverse=True)]
+        return summary
+
+    def write(self, outfile):
+        """
+        Write the summary to outfile as JSON.
+        :param outfile: file: file to write to
+        """
+        json.dump(self.summary(), outfile, indent=2)
+
+
+class ProgressReporter(object):
+    """
+    Echos a progress line to stderr every interval seconds while used as a context manager.
+    """
+    def __init__(self, metrics, interval=DEFAULT_PROGRESS_INTERVAL_SECONDS, echo=None):
+        """
+        :param metrics: StageMetrics: metrics to report
+        :param interval: float: seconds between reports
+        :param echo: function: called with each progress line, defaults to click.echo to stderr
+        """
+        self.metrics = metrics
+        self.interval = interval
+        self.echo = echo or (lambda message: click.echo(message, err=True))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stopped.set()
+        self.thread.join()
+        self.echo(format_progress(self.metrics.progress()))
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.echo(format_progress(self.metrics.progress()))
+
+
+def format_progress(progress):
+    """
+    :param progress: dict: result of StageMetrics.progress
+    :return: str: human readable progress line
+    """
+    # failed items are finished but not staged so they are reported separately
+    staged = progress["completed_items"] - progress["failed_items"]
+    if progress["total_items"] is not None:
+        items = "{}/{} items".format(staged, progress["total_items"])
+    else:
+        items = "{} items".format(staged)
+    failed = ", {} failed".format(progress["failed_items"]) if progress["failed_items"] else ""
+    line = "Progress: {} staged{}, {} running, {} at {}/s".format(
+        items, failed, progress["running_items"], format_size(progress["bytes"]),
+        format_size(int(progress["bytes_per_second"])))
+    if progress["eta_seconds"] is not None:
+        line += ", about {} remaining".format(format_timespan(progress["eta_seconds"]))
+    return line + "."
+
+
+def get_source_name(item_metrics):
+    """
+    Name of the data source an item came from: the url host, s3 bucket, DukeDS or write.
+    """
+    if item_metrics.item_type == "url":
+        return urlparse(item_metrics.source).netloc or item_metrics.source
+    if item_metrics.item_type == "s3":
+        return "s3://{}".format(urlparse(item_metrics.source).netloc)
+    return item_metrics.item_type
+
+
+def get_file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def rate(amount, seconds):
+    return amount / seconds if seconds > 0 else 0
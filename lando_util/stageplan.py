@@ -0,0 +1,174 @@
+"""
+Orders staging items so that large items start first and small items fill in around them.
+
+Sizes come from the prefetched DukeDS metadata, HEAD requests for url items, HEAD requests (or listings for
+prefixes) for s3 items, the length of write items and the size of local files.
+An optional per-item priority is applied before size, higher priorities start first. Items marked critical start
+before all others.
+Items that share a source with an earlier item are found so the source is only fetched once. The first item of
+such a group is scheduled with the critical flag and highest priority of the group so the source is fetched as
+early as the most urgent item that needs it.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from humanfriendly import format_size
+from lando_util.urldownload import get_url_size
+
+CMDFILE_SCHEDULE = "cmdfile"
+LARGEST_FIRST_SCHEDULE = "largest-first"
+SCHEDULES = (CMDFILE_SCHEDULE, LARGEST_FIRST_SCHEDULE)
+DEFAULT_SCHEDULE = CMDFILE_SCHEDULE
+DEFAULT_SIZE_WORKERS = 8
+# number of scheduled items listed when logging a schedule
+SCHEDULE_LOG_COUNT = 20
+# item types whose source is fetched once when several items share it
+DEDUPLICATED_ITEM_TYPES = ("DukeDS", "url")
+
+
+def get_item_sizes(dukeds_downloader, stage_items, workers=DEFAULT_SIZE_WORKERS, strict=False, s3_downloader=None):
+    """
+    Find the size of each item without downloading it.
+    :param dukeds_downloader: DukeDSDownloader: downloader holding prefetched DukeDS metadata
+    :param stage_items: [StageItem]: items to find sizes for
+    :param workers: int: number of HEAD requests to send at the same time
+    :param strict: bool: raise when DukeDS metadata or a url or s3 size can not be fetched so sizes are only unknown
+    when the source does not report one, instead of also when a lookup fails
+    :param s3_downloader: S3Downloader: downloader used to look up s3 items, None to leave their sizes unknown
+    :return: [int]: size of each item in bytes, None when unknown
+    """
+    sizes = [None] * len(stage_items)
+    lookups = []
+    for idx, (item_type, source, dest, unzip_to) in enumerate(stage_items):
+        if item_type == "DukeDS":
+            file_info = dukeds_downloader.get_file_info(source) if strict else dukeds_downloader.file_infos.get(source)
+            if file_info:
+                sizes[idx] = get_dukeds_size(file_info.metadata)
+        elif item_type == "url":
+            lookups.append((idx, partial(get_url_size, source, raise_errors=True) if strict
+                            else partial(get_url_size, source)))
+        elif item_type == "s3" and s3_downloader:
+            lookups.append((idx, partial(get_s3_size, s3_downloader, source, strict)))
+        elif item_type == "write":
+            sizes[idx] = len(source.encode('utf-8'))
+        elif item_type == "local":
+            sizes[idx] = get_local_size(source)
+    if lookups:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for (idx, lookup), size in zip(lookups, executor.map(lambda idx_lookup: idx_lookup[1](), lookups)):
+                sizes[idx] = size
+    return sizes
+
+
+def get_s3_size(s3_downloader, source, strict=False):
+    """
+    :param s3_downloader: S3Downloader: downloader whose client looks up the object
+    :param source: str: s3://<bucket>/<key> or s3://<bucket>/<prefix>/
+    :param strict: bool: raise errors instead of returning None
+    :return: int: size in bytes or None when the lookup fails
+    """
+    try:
+        return s3_downloader.get_size(source)
+    except Exception:
+        # botocore errors, or ValueError when boto3 is not installed
+        if strict:
+            raise
+        return None
+
+
+def get_local_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def get_dukeds_size(file_data):
+    """
+    :param file_data: dict: DukeDS file response data
+    :return: int: size of the current version of the file or None if unknown
+    """
+    upload = (file_data.get('current_version') or {}).get('upload') or {}
+    return upload.get('size')
+
+
+def create_schedule(stage_items, sizes=None, schedule=DEFAULT_SCHEDULE):
+    """
+    Choose the order to start items in. Critical items start first, then items are ordered by priority and,
+    for largest-first, by size.
+    Ties keep cmdfile order and items with an unknown size are treated as empty.
+    :param stage_items: [StageItem]: items to order
+    :param sizes: [int]: size of each item, None when unknown, only used by largest-first
+    :param schedule: str: one of SCHEDULES
+    :return: [int]: indexes into stage_items in the order they should start
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError("Unsupported schedule {}".format(schedule))
+
+    def sort_key(idx):
+        critical = bool(stage_items[idx].settings.get('critical'))
+        priority = stage_items[idx].settings.get('priority', 0)
+        if schedule == LARGEST_FIRST_SCHEDULE:
+            return not critical, -priority, -(sizes[idx] or 0), idx
+        return not critical, -priority, idx
+    return sorted(range(len(stage_items)), key=sort_key)
+
+
+def format_schedule(stage_items, order, sizes=None, schedule=DEFAULT_SCHEDULE, log_count=SCHEDULE_LOG_COUNT):
+    """
+    :return: [str]: lines describing the first log_count items of the schedule
+    """
+    lines = ["Schedule {}: {} items{}.".format(
+        schedule, len(order), ", {} known".format(format_size(sum(size or 0 for size in sizes))) if sizes else "")]
+    for position, idx in enumerate(order[:log_count], start=1):
+        item_type, source, dest, unzip_to = stage_items[idx]
+        size = sizes[idx] if sizes else None
+        lines.append("  {}. {} {} ({})".format(position, item_type, dest,
+                                                format_size(size) if size is not None else "unknown size"))
+    if len(order) > log_count:
+        lines.append("  ... {} more items.".format(len(order) - log_count))
+    return lines
+
+
+def find_duplicate_sources(stage_items):
+    """
+    Find DukeDS and url items whose source is also fetched by an earlier item.
+    :param stage_items: [StageItem]: items to check
+    :return: dict: index of each duplicate item -> index of the first item with the same source
+    """
+    first_indexes = {}
+    duplicates = {}
+    for idx, item in enumerate(stage_items):
+        # decompressed and remotely unzipped items do not leave the source file at dest to share
+        if item.item_type not in DEDUPLICATED_ITEM_TYPES or 'decompress' in item.settings or \
+                item.settings.get('remote_unzip'):
+            continue
+        key = (item.item_type, item.source, item.settings.get('checksum'))
+        if key in first_indexes:
+            duplicates[idx] = first_indexes[key]
+        else:
+            first_indexes[key] = idx
+    return duplicates
+
+
+def promote_duplicate_sources(stage_items, duplicates):
+    """
+    Give the first item of each group sharing a source the critical flag and highest priority of its group.
+    :param stage_items: [StageItem]: items to schedule
+    :param duplicates: dict: result of find_duplicate_sources for stage_items
+    :return: [StageItem]: stage_items with the first item of each group replaced when the group outranks it
+    """
+    settings = {}
+    for idx, source_idx in duplicates.items():
+        group_settings = settings.setdefault(source_idx, dict(stage_items[source_idx].settings))
+        if stage_items[idx].settings.get('critical'):
+            group_settings['critical'] = True
+        priority = stage_items[idx].settings.get('priority', 0)
+        if priority > group_settings.get('priority', 0):
+            group_settings['priority'] = priority
+    promoted_items = list(stage_items)
+    for source_idx, group_settings in settings.items():
+        item = stage_items[source_idx]
+        if group_settings != item.settings:
+            promoted_items[source_idx] = type(item)(*item, **group_settings)
+    return promoted_items
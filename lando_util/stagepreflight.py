@@ -0,0 +1,283 @@
+"""
+Estimates the bytes staging will transfer and write to each filesystem before any data is moved.
+
+Item sizes come from stageplan.get_item_sizes. Archives extracted with unzip_to are sized from their zip central
+directory (read locally, or with HTTP Range requests for url and DukeDS items) so the extracted size is known up
+front. Bytes already present at an item's destination are subtracted since staging replaces them, which keeps a
+rerun after a failure from needing space for the items that finished.
+
+Items placed at dest by a reflink or hardlink need no space at dest: DukeDS files found in a cache on the same
+filesystem, items that share a source with an earlier item staged to the same filesystem and local items copied
+with copy_method hardlink or reflink (or auto on the same filesystem). Only a shortfall that remains without the
+items whose size is estimated fails the check, others are reported as warnings.
+"""
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from humanfriendly import format_size, format_timespan
+from lando_util.extract import select_members
+from lando_util.remotezip import HTTPRangeFile
+from lando_util.stagecache import get_dukeds_cache_key
+
+DEFAULT_EXPECTED_RATE = "50MB"
+DEFAULT_ARCHIVE_WORKERS = 8
+
+
+class InsufficientSpaceError(Exception):
+    pass
+
+
+def create_plan(dukeds_downloader, stage_items, sizes, expected_rate, duplicates=None,
+                workers=DEFAULT_ARCHIVE_WORKERS, cache=None):
+    """
+    Estimate the transfer and disk usage of staging stage_items.
+    :param dukeds_downloader: DukeDSDownloader: downloader holding prefetched DukeDS metadata
+    :param stage_items: [StageItem]: items that will be staged
+    :param sizes: [int]: size of each item from get_item_sizes, None when unknown
+    :param expected_rate: int: bytes per second used to estimate the transfer time
+    :param duplicates: dict: index of each item whose source is fetched by an earlier item -> index of that item
+    :param workers: int: number of archive central directories to read at the same time
+    :param cache: FileCache: cache DukeDS files are placed from, None when caching is disabled
+    :return: dict: plan with an entry for each item, totals and the free space on each destination filesystem
+    """
+    duplicates = duplicates or {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        archive_sizes = list(executor.map(lambda item: get_archive_size(dukeds_downloader, item), stage_items))
+    item_plans = []
+    for idx, (item, size, archive_size) in enumerate(zip(stage_items, sizes, archive_sizes)):
+        duplicate_of = stage_items[duplicates[idx]] if idx in duplicates else None
+        linked = is_placed_by_link(dukeds_downloader, item, duplicate_of, cache)
+        item_plans.append(plan_item(item, size, archive_size, idx in duplicates, linked))
+    transfer_bytes = sum(item_plan["transfer_bytes"] or 0 for item_plan in item_plans)
+    return {
+        "items": item_plans,
+        "transfer_bytes": transfer_bytes,
+        "unknown_size_items": sum(1 for item_plan in item_plans if item_plan["transfer_bytes"] is None),
+        "expected_bytes_per_second": expected_rate,
+        "estimated_transfer_seconds": transfer_bytes / expected_rate if expected_rate else None,
+        "filesystems": get_filesystem_usage(item_plans),
+    }
+
+
+def plan_item(item, size, archive_size, is_duplicate=False, linked=False):
+    """
+    :param item: StageItem: item to plan
+    :param size: int: size of the item's source or None when unknown
+    :param archive_size: (int, int, int): result of get_archive_size
+    :param is_duplicate: bool: True when the source is fetched by an earlier item and copied to dest
+    :param linked: bool: True when dest will be a reflink or hardlink that needs no space
+    :return: dict: bytes transferred and bytes that must be free at dest and unzip_to
+    """
+    item_type, source, dest, unzip_to = item
+    estimated = size is None
+    remote_unzip = item.settings.get('remote_unzip')
+    if remote_unzip:
+        transfer_bytes = archive_size[0] if archive_size else None
+        dest_bytes = 0
+    else:
+        transfer_bytes = size
+        # the size of a decompressed file is not known until it has been decompressed
+        dest_bytes = 0 if linked else size or 0
+        estimated = not linked and (estimated or 'decompress' in item.settings)
+    unzip_bytes = 0
+    if unzip_to:
+        if archive_size:
+            unzip_bytes = archive_size[1]
+        else:
+            # without a readable central directory assume the archive extracts to its own size
+            unzip_bytes = size or 0
+            estimated = True
+    required = [(dest, max(0, dest_bytes - get_existing_size(dest)))]
+    if unzip_to:
+        existing_unzip_bytes = archive_size[2] if archive_size else 0
+        required.append((unzip_to, max(0, unzip_bytes - existing_unzip_bytes)))
+    return {
+        "type": item_type,
+        "source": source if item_type != "write" else None,
+        "dest": dest,
+        "unzip_to": unzip_to,
+        "transfer_bytes": 0 if is_duplicate else transfer_bytes,
+        "dest_bytes": dest_bytes,
+        "unzip_bytes": unzip_bytes,
+        "linked": linked,
+        "required": [{"path": path, "bytes": required_bytes} for path, required_bytes in required],
+        "estimated": estimated,
+    }
+
+
+def is_placed_by_link(dukeds_downloader, item, duplicate_of=None, cache=None):
+    """
+    :param dukeds_downloader: DukeDSDownloader: downloader holding prefetched DukeDS metadata
+    :param item: StageItem: item to check
+    :param duplicate_of: StageItem: earlier item with the same source whose dest is copied to item's dest
+    :param cache: FileCache: cache DukeDS files are placed from
+    :return: bool: True when item's dest will be a reflink or hardlink of an existing file
+    """
+    item_type, source, dest, unzip_to = item
+    if duplicate_of:
+        return on_same_filesystem(duplicate_of.dest, dest)
+    if 'decompress' in item.settings:
+        return False
+    if item_type == "local":
+        copy_method = item.settings.get('copy_method', 'copy')
+        return copy_method in ('hardlink', 'reflink') or (copy_method == 'auto' and on_same_filesystem(source, dest))
+    if item_type == "DukeDS" and cache:
+        file_info = dukeds_downloader.file_infos.get(source)
+        cache_key = get_dukeds_cache_key(file_info.metadata) if file_info else None
+        cached_path = cache.get_cached_path(cache_key) if cache_key else None
+        return bool(cached_path) and on_same_filesystem(cached_path, dest)
+    return False
+
+
+def on_same_filesystem(path, other_path):
+    try:
+        return os.stat(get_existing_parent(path)).st_dev == os.stat(get_existing_parent(other_path)).st_dev
+    except OSError:
+        return False
+
+
+def get_archive_size(dukeds_downloader, item):
+    """
+    Read the zip central directory of an item with unzip_to.
+    :param dukeds_downloader: DukeDSDownloader: downloader holding prefetched DukeDS metadata
+    :param item: StageItem: item to size
+    :return: (int, int, int): compressed size, extracted size and bytes already extracted to unzip_to of the
+    selected members, None when the item has no unzip_to or the archive can not be read
+    """
+    item_type, source, dest, unzip_to = item
+    if not unzip_to or 'decompress' in item.settings:
+        return None
+    try:
+        if item_type == "local":
+            archive = open(source, 'rb')
+        elif item_type == "url":
+            archive = io.BufferedReader(HTTPRangeFile(source))
+        elif item_type == "DukeDS":
+            archive = open_dukeds_archive(dukeds_downloader, source)
+        else:
+            return None
+        if archive is None:
+            return None
+        with archive, zipfile.ZipFile(archive) as z:
+            members = select_members(z.infolist(), item.settings.get('unzip_members'))
+    except Exception:
+        # sizing is best effort, staging reports the actual problem with the archive
+        return None
+    compressed_size = sum(member.compress_size for member in members)
+    extracted_size = sum(member.file_size for member in members)
+    existing_size = sum(get_existing_size(os.path.join(unzip_to, member.filename)) for member in members
+                        if not member.is_dir())
+    return compressed_size, extracted_size, existing_size
+
+
+def open_dukeds_archive(dukeds_downloader, file_id):
+    """
+    :return: file: reader for the prefetched download url of a DukeDS file or None if it can not be
+    read with a plain GET request
+    """
+    file_info = dukeds_downloader.file_infos.get(file_id)
+    if not file_info:
+        return None
+    file_download = file_info.file_download
+    if file_download.http_verb != "GET" or file_download.http_headers:
+        return None
+    return io.BufferedReader(HTTPRangeFile(file_download.host + file_download.url))
+
+
+def get_existing_size(path):
+    try:
+        return os.path.getsize(path) if os.path.isfile(path) else 0
+    except OSError:
+        return 0
+
+
+def get_filesystem_usage(item_plans):
+    """
+    Total the bytes required on each filesystem.
+    :param item_plans: [dict]: results of plan_item
+    :return: [dict]: mount point, required bytes and free bytes of each filesystem items are staged to
+    """
+    filesystems = {}
+    for item_plan in item_plans:
+        for required in item_plan["required"]:
+            existing_parent = get_existing_parent(required["path"])
+            device = os.stat(existing_parent).st_dev
+            if device not in filesystems:
+                filesystems[device] = {
+                    "mount_point": get_mount_point(existing_parent),
+                    "required_bytes": 0,
+                    "estimated_bytes": 0,
+                    "free_bytes": get_free_space(existing_parent),
+                }
+            filesystems[device]["required_bytes"] += required["bytes"]
+            if item_plan["estimated"]:
+                filesystems[device]["estimated_bytes"] += required["bytes"]
+    return sorted(filesystems.values(), key=lambda filesystem: filesystem["mount_point"])
+
+
+def get_existing_parent(path):
+    """
+    :return: str: path or its closest ancestor that exists
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def get_mount_point(path):
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def get_free_space(path):
+    """
+    :return: int: bytes available to unprivileged users on the filesystem holding path
+    """
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def check_free_space(plan):
+    """
+    Raise InsufficientSpaceError when any filesystem does not have room for the bytes the plan requires, not
+    counting the bytes of items whose size is estimated.
+    :param plan: dict: result of create_plan
+    :return: [str]: warnings for filesystems that only lack room once estimated sizes are counted
+    """
+    short = [filesystem for filesystem in plan["filesystems"]
+             if filesystem["required_bytes"] > filesystem["free_bytes"]]
+    known_short = [filesystem for filesystem in short
+                   if filesystem["required_bytes"] - filesystem["estimated_bytes"] > filesystem["free_bytes"]]
+    if known_short:
+        raise InsufficientSpaceError("Not enough free space to stage: {}.".format("; ".join(
+            format_shortfall(filesystem) for filesystem in known_short)))
+    return ["Staging may not have enough free space, {} including {} of estimated sizes.".format(
+        format_shortfall(filesystem), format_size(filesystem["estimated_bytes"])) for filesystem in short]
+
+
+def format_shortfall(filesystem):
+    return "{} needs {} but has {} free".format(filesystem["mount_point"], format_size(filesystem["required_bytes"]),
+                                                format_size(filesystem["free_bytes"]))
+
+
+def format_plan(plan):
+    """
+    :param plan: dict: result of create_plan
+    :return: [str]: lines summarizing the plan
+    """
+    line = "Plan: {} items, {} to transfer".format(len(plan["items"]), format_size(plan["transfer_bytes"]))
+    if plan["unknown_size_items"]:
+        line += " ({} items of unknown size)".format(plan["unknown_size_items"])
+    if plan["estimated_transfer_seconds"] is not None:
+        line += ", about {} at {}/s".format(format_timespan(plan["estimated_transfer_seconds"]),
+                                           format_size(plan["expected_bytes_per_second"]))
+    lines = [line + "."]
+    for filesystem in plan["filesystems"]:
+        lines.append("  {}: {} required, {} free.".format(filesystem["mount_point"],
+                                                        format_size(filesystem["required_bytes"]),
+                                                        format_size(filesystem["free_bytes"])))
+    return lines
@@ -0,0 +1,139 @@
+"""
+Splits a cmdfile between several staging processes and reassembles their metadata.
+
+With --shard i/N each of N processes reads the same cmdfile, looks up the size of every item and assigns items to
+shards largest first onto the shard with the fewest bytes so each shard transfers about the same amount of data.
+The assignment only depends on the cmdfile and the item sizes so every process computes the same split without
+coordinating. Size lookups that fail stop the shard instead of being treated as unknown, and items whose size is
+unknown (s3 items, servers that do not report one) are placed by a hash of the item, so a lookup failing on one
+process never gives it a different split. Items that share a source are kept on one shard so the source is only
+fetched once.
+
+Each shard writes a partial metadata file recording the cmdfile indexes it was assigned and the metadata of its
+DukeDS items. merge_shard_metadata checks the partial files came from the same cmdfile and together cover every
+item exactly once (sizes that changed between processes could split the items differently) and returns the
+metadata items in cmdfile order.
+"""
+import hashlib
+import json
+from lando_util.stageplan import find_duplicate_sources
+
+
+class ShardAssignmentError(Exception):
+    """
+    The size of every item could not be looked up so the items can not be split the same way as other shards.
+    """
+    pass
+
+
+class ShardMergeError(Exception):
+    """
+    Partial metadata files do not make up a complete staging of a single cmdfile.
+    """
+    pass
+
+
+def parse_shard(value):
+    """
+    :param value: str: shard in i/N format where i counts from 0
+    :return: (int, int): shard index and number of shards
+    """
+    index, sep, count = value.partition('/')
+    if not sep or not index.isdigit() or not count.isdigit() or int(index) >= int(count):
+        raise ValueError("Invalid shard {}, expected i/N with 0 <= i < N.".format(value))
+    return int(index), int(count)
+
+
+def assign_shards(stage_items, sizes, shard_count):
+    """
+    Deterministically split items into shard_count shards with similar total sizes.
+    Items of unknown size are placed by get_item_hash, the others largest first onto the shard with the fewest bytes
+    (then fewest items, then lowest index).
+    :param stage_items: [StageItem]: items to split
+    :param sizes: [int]: size of each item, None when unknown
+    :param shard_count: int: number of shards
+    :return: [[int]]: indexes into stage_items assigned to each shard in cmdfile order
+    """
+    groups = {}
+    duplicates = find_duplicate_sources(stage_items)
+    for idx in range(len(stage_items)):
+        groups.setdefault(duplicates.get(idx, idx), []).append(idx)
+    shard_bytes = [0] * shard_count
+    shard_indexes = [[] for _ in range(shard_count)]
+    for first_idx in sorted(groups):
+        if sizes[first_idx] is None:
+            shard_indexes[get_item_hash(stage_items[first_idx]) % shard_count].extend(groups[first_idx])
+    sized_groups = [first_idx for first_idx in groups if sizes[first_idx] is not None]
+    for first_idx in sorted(sized_groups, key=lambda first_idx: (-sizes[first_idx], first_idx)):
+        shard = min(range(shard_count), key=lambda shard: (shard_bytes[shard], len(shard_indexes[shard]), shard))
+        shard_bytes[shard] += sizes[first_idx]
+        shard_indexes[shard].extend(groups[first_idx])
+    return [sorted(indexes) for indexes in shard_indexes]
+
+
+def get_item_hash(item):
+    """
+    :param item: StageItem: item to hash
+    :return: int: hash of the item's type, source and dest that is the same in every process
+    """
+    return int(hashlib.sha256(json.dumps([item.item_type, item.source, item.dest]).encode()).hexdigest(), 16)
+
+
+def get_cmdfile_digest(stage_items):
+    """
+    :param stage_items: [StageItem]: items read from a cmdfile
+    :return: str: sha256 hex digest identifying the items and their settings
+    """
+    digest = hashlib.sha256()
+    for item in stage_items:
+        digest.update(json.dumps([list(item), item.settings], sort_keys=True).encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def create_shard_metadata(shard, stage_items, indexes, metadata_items):
+    """
+    :param shard: (int, int): shard index and number of shards
+    :param stage_items: [StageItem]: every item in the cmdfile
+    :param indexes: [int]: indexes into stage_items staged by this shard in cmdfile order
+    :param metadata_items: [dict]: metadata for the DukeDS items of this shard in cmdfile order
+    :return: dict: partial metadata document for merge_shard_metadata
+    """
+    dukeds_indexes = [idx for idx in indexes if stage_items[idx].item_type == "DukeDS"]
+    if len(dukeds_indexes) != len(metadata_items):
+        raise ValueError("Expected metadata for {} DukeDS items, found {}.".format(len(dukeds_indexes),
+                                                                                   len(metadata_items)))
+    return {
+        "shard": shard[0],
+        "shards": shard[1],
+        "cmdfile_items": len(stage_items),
+        "cmdfile_digest": get_cmdfile_digest(stage_items),
+        "indexes": indexes,
+        "items": [{"index": idx, "metadata": metadata_item}
+                  for idx, metadata_item in zip(dukeds_indexes, metadata_items)],
+    }
+
+
+def merge_shard_metadata(partials):
+    """
+    Combine the partial metadata of every shard.
+    :param partials: [dict]: documents from create_shard_metadata, one per shard in any order
+    :return: [dict]: metadata items in cmdfile order
+    """
+    if not partials:
+        raise ShardMergeError("No partial metadata files to merge.")
+    first = partials[0]
+    for partial in partials:
+        for key in ("shards", "cmdfile_items", "cmdfile_digest"):
+            if partial[key] != first[key]:
+                raise ShardMergeError("Partial metadata files were staged from different cmdfiles or shard counts.")
+    shards = sorted(partial["shard"] for partial in partials)
+    if shards != list(range(first["shards"])):
+        raise ShardMergeError("Expected partial metadata for shards 0 to {}, found shards {}.".format(
+            first["shards"] - 1, ", ".join(str(shard) for shard in shards)))
+    indexes = sorted(idx for partial in partials for idx in partial["indexes"])
+    if indexes != list(range(first["cmdfile_items"])):
+        raise ShardMergeError("Shards did not stage every cmdfile item exactly once, item sizes may have changed "
+                              "between shards.")
+    items = sorted((item for partial in partials for item in partial["items"]), key=lambda item: item["index"])
+    return [item["metadata"] for item in items]
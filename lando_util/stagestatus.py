@@ -0,0 +1,202 @@
+"""
+Publishes when each staged item is ready so a workflow can start before every item has been staged.
+
+Readiness is published in two ways:
+- a status file of JSON lines, one per finished item, followed by a "critical" line once every item marked
+  critical in the cmdfile has finished and a "complete" line when staging ends
+- optional <path>.ready marker files written atomically next to each staged path once the item (including any
+  unzip) is in place, stale markers are removed when an item is staged again
+
+Items marked critical are started before all other items. With detach_when_critical_ready the command returns as
+soon as they are staged while the remaining items are staged by a child process in its own session, whose output
+goes to a log file (or /dev/null).
+"""
+import json
+import os
+import sys
+import threading
+import time
+from lando_util.stagemanifest import get_staged_path
+
+READY_MARKER_SUFFIX = ".ready"
+CRITICAL_OK_MESSAGE = "ok"
+
+
+def get_ready_marker_path(item):
+    """
+    :param item: StageItem: item to find the marker path for
+    :return: str: path of the marker written when item is ready
+    """
+    return get_staged_path(item).rstrip(os.sep) + READY_MARKER_SUFFIX
+
+
+def is_critical(item):
+    return bool(item.settings.get('critical'))
+
+
+class StageStatus(object):
+    """
+    Thread safe publisher of item readiness.
+    """
+    def __init__(self, outfile=None, ready_markers=False, clock=time.time):
+        """
+        :param outfile: file: optional file to write a JSON line to as each item finishes
+        :param ready_markers: bool: write a <path>.ready marker file for each staged item
+        :param clock: function: returns the current time in seconds since the epoch
+        """
+        self.outfile = outfile
+        self.ready_markers = ready_markers
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.critical_remaining = 0
+        self.critical_failed = False
+        self.critical_finished = threading.Event()
+        self.on_critical = None
+
+    def expect_critical(self, count):
+        """
+        :param count: int: number of critical items that will be staged, 0 waits for every item
+        """
+        with self.lock:
+            self.critical_remaining = count
+
+    def start_item(self, item):
+        """
+        Remove the marker left for item by an earlier run so it is not mistaken for this one.
+        :param item: StageItem: item about to be staged
+        """
+        if self.ready_markers:
+            try:
+                os.remove(get_ready_marker_path(item))
+            except FileNotFoundError:
+                pass
+
+    def finish_item(self, item, status, error=None):
+        """
+        :param item: StageItem: item that finished
+        :param status: str: staged, skipped or failed
+        :param error: Exception: reason a failed item was not staged
+        """
+        event = {
+            "event": "item",
+            "status": status,
+            "type": item.item_type,
+            "source": item.source if item.item_type != "write" else None,
+            "dest": item.dest,
+            "unzip_to": item.unzip_to,
+            "critical": is_critical(item),
+            "time": self.clock(),
+        }
+        if error is not None:
+            event["error"] = str(error)
+        if self.ready_markers and status != "failed":
+            write_ready_marker(get_ready_marker_path(item), event)
+        self._write(event)
+        if is_critical(item):
+            with self.lock:
+                self.critical_remaining -= 1
+                self.critical_failed = self.critical_failed or status == "failed"
+                finished = self.critical_remaining == 0 or status == "failed"
+            if finished:
+                self._finish_critical()
+
+    def finish(self, error=None):
+        """
+        Publish that staging has ended.
+        :param error: Exception: reason staging failed, None when every item was staged
+        """
+        if error is not None:
+            with self.lock:
+                self.critical_failed = True
+        self._finish_critical()
+        event = {"event": "complete", "status": "failed" if error is not None else "staged", "time": self.clock()}
+        if error is not None:
+            event["error"] = str(error)
+        self._write(event)
+
+    def wait_critical(self, timeout=None):
+        """
+        Wait until every critical item has been staged, a critical item failed or staging ended.
+        :param timeout: float: seconds to wait, None to wait forever
+        :return: bool: True when every critical item was staged
+        """
+        if not self.critical_finished.wait(timeout):
+            return False
+        return not self.critical_failed
+
+    def _finish_critical(self):
+        with self.lock:
+            if self.critical_finished.is_set():
+                return
+            self.critical_finished.set()
+        self._write({"event": "critical", "status": "failed" if self.critical_failed else "staged",
+                     "time": self.clock()})
+        if self.on_critical:
+            self.on_critical(not self.critical_failed)
+
+    def _write(self, event):
+        if self.outfile:
+            line = json.dumps(event) + "\n"
+            with self.lock:
+                self.outfile.write(line)
+                self.outfile.flush()
+
+
+def write_ready_marker(path, event):
+    """
+    Atomically create the marker at path so readers never see a partially written marker.
+    :param path: str: path of the marker
+    :param event: dict: status of the item stored in the marker
+    """
+    temp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(temp_path, 'w') as outfile:
+        outfile.write(json.dumps(event))
+    os.replace(temp_path, path)
+
+
+def detach_when_critical_ready(status, log_path=os.devnull):
+    """
+    Fork so the items are staged by a child process while this process waits for the critical items.
+    The child starts a new session and writes its output to log_path so it neither holds the command's output open
+    nor receives signals sent to the command's process group.
+    Must be called before any threads are started.
+    :param status: StageStatus: status the child publishes critical readiness through
+    :param log_path: str: file the child appends its output to
+    :return: int: exit status for this process once the critical items are staged (0) or failed (1),
+    None in the child process which should go on to stage the items
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        os.setsid()
+        redirect_output(log_path)
+
+        def notify(ok):
+            if ok:
+                os.write(write_fd, CRITICAL_OK_MESSAGE.encode())
+            os.close(write_fd)
+        status.on_critical = notify
+        return None
+    os.close(write_fd)
+    with os.fdopen(read_fd) as reader:
+        # the child closes the pipe once the critical items finish, or by exiting if it fails first
+        message = reader.read()
+    if message != CRITICAL_OK_MESSAGE:
+        return 1
+    return 0
+
+
+def redirect_output(log_path):
+    """
+    Read stdin from /dev/null and append stdout and stderr to log_path.
+    """
+    stdin_fd = os.open(os.devnull, os.O_RDONLY)
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(stdin_fd, 0)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(stdin_fd)
+    os.close(log_fd)
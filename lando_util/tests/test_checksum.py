@@ -0,0 +1,52 @@
+import io
+import os
+import hashlib
+import tempfile
+from unittest import TestCase
+from lando_util.checksum import parse_checksum, get_dukeds_hash, hash_file, HashingWriter, verify_checksum, \
+    ChecksumMismatchError
+
+
+class TestChecksum(TestCase):
+    def test_parse_checksum(self):
+        self.assertEqual(parse_checksum("SHA256:ABC123"), ("sha256", "abc123"))
+        self.assertEqual(parse_checksum("md5:abc"), ("md5", "abc"))
+        for bad_value in ["abc123", "md5:", "nohash:abc"]:
+            with self.assertRaises(ValueError):
+                parse_checksum(bad_value)
+
+    def test_get_dukeds_hash(self):
+        self.assertEqual(get_dukeds_hash({
+            "current_version": {"upload": {"hashes": [{"algorithm": "MD5", "value": "ABC"}]}}
+        }), ("md5", "abc"))
+        self.assertEqual(get_dukeds_hash({
+            "current_version": {"upload": {"hash": {"algorithm": "md5", "value": "def"}}}
+        }), ("md5", "def"))
+        self.assertEqual(get_dukeds_hash({"current_version": {"upload": {"hashes": []}}}), (None, None))
+        self.assertEqual(get_dukeds_hash({}), (None, None))
+
+    def test_hashing_writer(self):
+        outfile = io.BytesIO()
+        writer = HashingWriter(outfile, hashlib.md5())
+        writer.write(b"abc")
+        writer.write(b"def")
+        writer.flush()
+        self.assertEqual(outfile.getvalue(), b"abcdef")
+        self.assertEqual(writer.size, 6)
+        self.assertEqual(writer.hasher.hexdigest(), hashlib.md5(b"abcdef").hexdigest())
+
+    def test_hash_file_and_verify_checksum(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "file.dat")
+            with open(path, 'wb') as outfile:
+                outfile.write(b"abcdef")
+            actual = hash_file(path, "sha256").hexdigest()
+            self.assertEqual(actual, hashlib.sha256(b"abcdef").hexdigest())
+
+            self.assertEqual(verify_checksum(path, "sha256", actual, actual),
+                             {"algorithm": "sha256", "value": actual, "verified": True})
+            self.assertEqual(verify_checksum(path, "sha256", None, actual),
+                             {"algorithm": "sha256", "value": actual, "verified": False})
+            with self.assertRaises(ChecksumMismatchError):
+                verify_checksum(path, "sha256", "0" * 64, actual)
+            self.assertFalse(os.path.exists(path))
@@ -0,0 +1,135 @@
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import tarfile
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from lando_util.decompress import parse_decompress_format, write_decompressed, ChunkReader, open_decompressed
+from lando_util.extract import UnsafeArchiveMemberError
+
+CONTENT = b"ACGT" * 50000
+
+
+def split_chunks(data, size=1000):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def create_tar(members, compression=''):
+    """
+    :param members: list of tarfile.TarInfo, bytes: members with their contents (None for no contents)
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:' + compression) as archive:
+        for info, data in members:
+            if data is not None:
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+            else:
+                archive.addfile(info)
+    return buffer.getvalue()
+
+
+def tar_symlink_info(name, linkname):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = linkname
+    return info
+
+
+class TestParseDecompressFormat(TestCase):
+    def test_parse_decompress_format(self):
+        self.assertEqual(parse_decompress_format("gzip"), ("gzip", False))
+        self.assertEqual(parse_decompress_format("zstd"), ("zstd", False))
+        self.assertEqual(parse_decompress_format("tar"), (None, True))
+        self.assertEqual(parse_decompress_format("tar.gz"), ("gzip", True))
+        self.assertEqual(parse_decompress_format("tar.zst"), ("zstd", True))
+        with self.assertRaises(ValueError):
+            parse_decompress_format("zip")
+
+
+class TestChunkReader(TestCase):
+    def test_read_across_chunks(self):
+        hasher = hashlib.md5()
+        reader = ChunkReader([b"abc", b"de", b"fgh"], hasher)
+
+        self.assertEqual(reader.read(4), b"abcd")
+        buffer = bytearray(3)
+        self.assertEqual(reader.readinto(buffer), 3)
+        self.assertEqual(bytes(buffer), b"efg")
+        self.assertEqual(reader.read(), b"h")
+        self.assertEqual(reader.read(10), b"")
+        self.assertEqual(hasher.hexdigest(), hashlib.md5(b"abcdefgh").hexdigest())
+
+    def test_small_reads_of_large_chunks(self):
+        reader = ChunkReader([b"abcdef" * 1000, b"", b"xyz"])
+
+        self.assertEqual(b"".join(iter(lambda: reader.read(7), b"")), b"abcdef" * 1000 + b"xyz")
+        reader = ChunkReader([b"ab", b"cd", b"ef"])
+        self.assertEqual(reader.read(1), b"a")
+        self.assertEqual(reader.read(), b"bcdef")
+        buffer = bytearray(4)
+        self.assertEqual(reader.readinto(buffer), 0)
+
+
+class TestWriteDecompressed(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.temp_dir.name, 'data')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read_dest(self, path=None):
+        with open(path or self.dest, 'rb') as infile:
+            return infile.read()
+
+    def test_decompresses_codecs(self):
+        for decompress_format, compress in [("gzip", gzip.compress), ("bz2", bz2.compress), ("xz", lzma.compress)]:
+            compressed = compress(CONTENT)
+            hasher = hashlib.sha256()
+
+            write_decompressed(split_chunks(compressed), self.dest, decompress_format, hasher)
+
+            self.assertEqual(self.read_dest(), CONTENT, decompress_format)
+            self.assertEqual(hasher.hexdigest(), hashlib.sha256(compressed).hexdigest())
+        self.assertEqual(os.listdir(self.temp_dir.name), ['data'])
+
+    def test_truncated_data_leaves_no_dest(self):
+        compressed = gzip.compress(CONTENT)
+
+        with self.assertRaises(EOFError):
+            write_decompressed(split_chunks(compressed[:len(compressed) // 2]), self.dest, "gzip")
+
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+    def test_extracts_tar(self):
+        archive = create_tar([
+            (tarfile.TarInfo("genome/chr1.fa"), b">chr1"),
+            (tar_symlink_info("genome/latest.fa", "chr1.fa"), None),
+        ], compression='gz')
+        os.makedirs(os.path.join(self.dest, "old"))
+
+        write_decompressed(split_chunks(archive, 100), self.dest, "tar.gz")
+
+        self.assertEqual(sorted(os.listdir(self.dest)), ["genome"])
+        self.assertEqual(self.read_dest(os.path.join(self.dest, "genome", "chr1.fa")), b">chr1")
+        self.assertEqual(os.readlink(os.path.join(self.dest, "genome", "latest.fa")), "chr1.fa")
+        self.assertEqual(os.listdir(self.temp_dir.name), ['data'])
+
+    def test_rejects_unsafe_tar_members(self):
+        for info in [tarfile.TarInfo("../escape.txt"), tar_symlink_info("link", "../../etc/passwd")]:
+            archive = create_tar([(info, b"x" if info.isfile() else None)])
+
+            with self.assertRaises(UnsafeArchiveMemberError):
+                write_decompressed([archive], self.dest, "tar")
+
+            self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+    @patch('lando_util.decompress.zstandard', None)
+    def test_zstd_requires_zstandard(self):
+        with self.assertRaises(ValueError):
+            open_decompressed(io.BytesIO(b""), "zstd")
@@ -0,0 +1,167 @@
+import os
+import gzip
+import hashlib
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch, Mock, call
+from lando_util.dukeds import DukeDSDownloader, DukeDSFileInfo, LazyDukeDSClient
+from lando_util.checksum import ChecksumMismatchError
+
+ABCDEF_MD5 = "e80b5017098950fc58aad83c8c14978e"
+
+
+def create_dds_file(md5=ABCDEF_MD5):
+    return Mock(id="1", _data_dict={
+        "id": "1",
+        "current_version": {"id": "v1", "upload": {"hashes": [{"algorithm": "md5", "value": md5}]}}
+    })
+
+
+class TestLazyDukeDSClient(TestCase):
+    @patch('ddsc.sdk.client.Client')
+    def test_creates_client_on_first_use(self, mock_client):
+        dds_client = LazyDukeDSClient()
+        mock_client.assert_not_called()
+
+        self.assertEqual(dds_client.get_file_by_id, mock_client.return_value.get_file_by_id)
+        self.assertEqual(dds_client.dds_connection, mock_client.return_value.dds_connection)
+        mock_client.assert_called_once_with()
+
+
+class TestDukeDSDownloader(TestCase):
+    def setUp(self):
+        self.dds_client = Mock()
+        self.dds_client.get_file_by_id.side_effect = lambda file_id: Mock(id=file_id, _data_dict={"id": file_id})
+        self.dds_client.dds_connection.get_file_download.side_effect = lambda file_id: Mock(url="/" + file_id)
+
+    def test_prefetch_fetches_each_file_once(self):
+        downloader = DukeDSDownloader(self.dds_client, workers=4)
+
+        downloader.prefetch(["1", "2", "1", "3"])
+
+        self.assertEqual(sorted(downloader.file_infos.keys()), ["1", "2", "3"])
+        self.assertEqual(self.dds_client.get_file_by_id.call_count, 3)
+        self.assertEqual(downloader.file_infos["2"].metadata, {"id": "2"})
+        self.assertEqual(downloader.file_infos["2"].file_download.url, "/2")
+
+    def test_get_file_info_uses_prefetched_info(self):
+        downloader = DukeDSDownloader(self.dds_client)
+        downloader.prefetch(["1"])
+        self.dds_client.get_file_by_id.reset_mock()
+
+        self.assertEqual(downloader.get_file_info("1").metadata, {"id": "1"})
+        self.dds_client.get_file_by_id.assert_not_called()
+
+        self.assertEqual(downloader.get_file_info("2").metadata, {"id": "2"})
+        self.dds_client.get_file_by_id.assert_called_with(file_id="2")
+
+    def test_prefetch_failures_are_raised_by_get_file_info(self):
+        self.dds_client.get_file_by_id.side_effect = ValueError("Not found")
+        downloader = DukeDSDownloader(self.dds_client)
+
+        downloader.prefetch(["1"])
+
+        self.assertEqual(downloader.file_infos, {})
+        with self.assertRaises(ValueError):
+            downloader.get_file_info("1")
+
+    @patch('requests.adapters.HTTPAdapter')
+    def test_configure_connection_pool(self, mock_http_adapter):
+        downloader = DukeDSDownloader(self.dds_client)
+
+        downloader.configure_connection_pool(12)
+
+        mock_http_adapter.assert_called_with(pool_connections=12, pool_maxsize=12)
+        self.dds_client.dds_connection.data_service.http.mount.assert_has_calls([
+            call('https://', mock_http_adapter.return_value),
+            call('http://', mock_http_adapter.return_value),
+        ])
+
+        mock_http_adapter.reset_mock()
+        downloader.configure_connection_pool(8)
+        mock_http_adapter.assert_not_called()
+        downloader.configure_connection_pool(16)
+        mock_http_adapter.assert_called_with(pool_connections=16, pool_maxsize=16)
+
+    def test_clear(self):
+        downloader = DukeDSDownloader(self.dds_client)
+        downloader.prefetch(["1"])
+
+        downloader.clear()
+
+        self.assertEqual(downloader.file_infos, {})
+
+    def test_download(self):
+        data_service = self.dds_client.dds_connection.data_service
+        data_service.receive_external.return_value = Mock(status_code=200)
+        data_service.receive_external.return_value.iter_content.return_value = [b"abc", b"", b"def"]
+        file_download = Mock(http_verb="GET", host="https://host", url="/file", http_headers={})
+        file_info = DukeDSFileInfo(create_dds_file(), file_download)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "file.dat")
+            checksum = DukeDSDownloader(self.dds_client).download(file_info, dest)
+            with open(dest, 'rb') as infile:
+                self.assertEqual(infile.read(), b"abcdef")
+
+        self.assertEqual(checksum, {"algorithm": "md5", "value": ABCDEF_MD5, "verified": True})
+        data_service.receive_external.assert_called_with("GET", "https://host", "/file", {})
+        data_service.receive_external.return_value.raise_for_status.assert_called_with()
+
+    def test_download_decompress(self):
+        compressed = gzip.compress(b"abcdef" * 1000)
+        data_service = self.dds_client.dds_connection.data_service
+        data_service.receive_external.return_value = Mock(status_code=200)
+        data_service.receive_external.return_value.iter_content.return_value = [compressed[:10], compressed[10:]]
+        file_download = Mock(http_verb="GET", host="https://host", url="/file", http_headers={})
+        file_info = DukeDSFileInfo(create_dds_file(md5=hashlib.md5(compressed).hexdigest()), file_download)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "file.dat")
+            checksum = DukeDSDownloader(self.dds_client).download(file_info, dest, "gzip")
+            with open(dest, 'rb') as infile:
+                self.assertEqual(infile.read(), b"abcdef" * 1000)
+
+        self.assertEqual(checksum["verified"], True)
+
+    def test_download_checksum_mismatch(self):
+        data_service = self.dds_client.dds_connection.data_service
+        data_service.receive_external.return_value = Mock(status_code=200)
+        data_service.receive_external.return_value.iter_content.return_value = [b"abcdeX"]
+        file_download = Mock(http_verb="GET", host="https://host", url="/file", http_headers={})
+        file_info = DukeDSFileInfo(create_dds_file(), file_download)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "file.dat")
+            with self.assertRaises(ChecksumMismatchError):
+                DukeDSDownloader(self.dds_client).download(file_info, dest)
+            self.assertFalse(os.path.exists(dest))
+
+    def test_download_without_dukeds_hash(self):
+        data_service = self.dds_client.dds_connection.data_service
+        data_service.receive_external.return_value = Mock(status_code=200)
+        data_service.receive_external.return_value.iter_content.return_value = [b"abcdef"]
+        file_download = Mock(http_verb="GET", host="https://host", url="/file", http_headers={})
+        file_info = DukeDSFileInfo(Mock(id="1", _data_dict={"id": "1"}), file_download)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            checksum = DukeDSDownloader(self.dds_client).download(file_info, os.path.join(temp_dir, "file.dat"))
+
+        self.assertEqual(checksum, {"algorithm": "md5", "value": ABCDEF_MD5, "verified": False})
+
+    def test_download_refreshes_expired_url(self):
+        data_service = self.dds_client.dds_connection.data_service
+        expired_response = Mock(status_code=401)
+        ok_response = Mock(status_code=200)
+        ok_response.iter_content.return_value = [b"abcdef"]
+        data_service.receive_external.side_effect = [expired_response, ok_response]
+        file_download = Mock(http_verb="GET", host="https://host", url="/old", http_headers={})
+        file_info = DukeDSFileInfo(create_dds_file(), file_download)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            DukeDSDownloader(self.dds_client).download(file_info, os.path.join(temp_dir, "file.dat"))
+
+        self.dds_client.dds_connection.get_file_download.assert_called_with("1")
+        self.assertEqual(file_info.file_download.url, "/1")
+        expired_response.close.assert_called_with()
+        ok_response.raise_for_status.assert_called_with()
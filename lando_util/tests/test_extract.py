@@ -0,0 +1,100 @@
+import os
+import tempfile
+import zipfile
+from unittest import TestCase
+from lando_util.extract import extract_zip, select_members, check_member_path, partition_members, \
+    create_member_directories, UnsafeArchiveMemberError
+
+
+class TestExtractZip(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.archive_path = os.path.join(self.temp_dir.name, 'bundle.zip')
+        self.dest = os.path.join(self.temp_dir.name, 'out')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_archive(self, members):
+        with zipfile.ZipFile(self.archive_path, 'w') as z:
+            for name, data in members.items():
+                z.writestr(name, data)
+
+    def read_extracted(self):
+        contents = {}
+        for root, dirs, files in os.walk(self.dest):
+            for filename in files:
+                path = os.path.join(root, filename)
+                with open(path) as infile:
+                    contents[os.path.relpath(path, self.dest)] = infile.read()
+        return contents
+
+    def test_extract_all(self):
+        self.create_archive({'genome/chr1.fa': 'ACGT', 'README': 'hello'})
+
+        count = extract_zip(self.archive_path, self.dest)
+
+        self.assertEqual(count, 2)
+        self.assertEqual(self.read_extracted(), {'genome/chr1.fa': 'ACGT', 'README': 'hello'})
+
+    def test_extract_selected_members(self):
+        self.create_archive({'genome/chr1.fa': 'ACGT', 'genome/chr1.fa.fai': 'idx', 'README': 'hello'})
+
+        count = extract_zip(self.archive_path, self.dest, member_patterns=['genome/*.fa', 'README'])
+
+        self.assertEqual(count, 2)
+        self.assertEqual(self.read_extracted(), {'genome/chr1.fa': 'ACGT', 'README': 'hello'})
+
+    def test_extract_with_process_pool(self):
+        members = dict(('data/file{}.txt'.format(idx), 'x' * idx) for idx in range(12))
+        self.create_archive(members)
+
+        count = extract_zip(self.archive_path, self.dest, workers=3)
+
+        self.assertEqual(count, 12)
+        self.assertEqual(self.read_extracted(), members)
+
+    def test_rejects_zip_slip_members(self):
+        with zipfile.ZipFile(self.archive_path, 'w') as z:
+            z.writestr('ok.txt', 'ok')
+            z.writestr(zipfile.ZipInfo('../../evil.txt'), 'evil')
+
+        with self.assertRaises(UnsafeArchiveMemberError):
+            extract_zip(self.archive_path, self.dest)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, 'evil.txt')))
+        self.assertFalse(os.path.exists(self.dest))
+
+
+class TestExtractHelpers(TestCase):
+    def test_select_members_requires_every_pattern_to_match(self):
+        members = [zipfile.ZipInfo('a.txt'), zipfile.ZipInfo('b.csv')]
+        self.assertEqual(select_members(members, None), members)
+        self.assertEqual([m.filename for m in select_members(members, ['*.txt'])], ['a.txt'])
+        with self.assertRaises(ValueError) as raised_exception:
+            select_members(members, ['*.txt', '*.bam'])
+        self.assertEqual(str(raised_exception.exception), 'No archive members match *.bam.')
+
+    def test_check_member_path(self):
+        check_member_path('/data/out', 'genome/chr1.fa')
+        check_member_path('/data/out', 'genome/../chr1.fa')
+        for bad_name in ['/etc/passwd', '../evil', 'genome/../../evil', 'C:\\evil', '..\\evil']:
+            with self.assertRaises(UnsafeArchiveMemberError):
+                check_member_path('/data/out', bad_name)
+
+    def test_partition_members_balances_sizes(self):
+        members = []
+        for name, size in [('a', 100), ('b', 60), ('c', 50), ('d', 10)]:
+            member = zipfile.ZipInfo(name)
+            member.file_size = size
+            members.append(member)
+        self.assertEqual(partition_members(members, 2), [['a', 'd'], ['b', 'c']])
+        self.assertEqual(partition_members(members[:1], 3), [['a']])
+
+    def test_create_member_directories(self):
+        members = [zipfile.ZipInfo(name) for name in ['top.txt', 'data/a/1.txt', 'data/b/', 'data/a/2.txt']]
+
+        with tempfile.TemporaryDirectory() as dest:
+            create_member_directories(dest, members)
+
+            self.assertEqual(sorted(os.listdir(dest)), ['data'])
+            self.assertEqual(sorted(os.listdir(os.path.join(dest, 'data'))), ['a', 'b'])
@@ -0,0 +1,123 @@
+import os
+import errno
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from lando_util.fileutil import link_or_copy_file, copy_file, place_file
+
+
+class TestLinkOrCopyFile(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, 'source.txt')
+        self.dest = os.path.join(self.temp_dir.name, 'dest.txt')
+        with open(self.source, 'w') as outfile:
+            outfile.write('data')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read_dest(self):
+        with open(self.dest) as infile:
+            return infile.read()
+
+    @patch('lando_util.fileutil.reflink_file')
+    def test_falls_back_to_hardlink(self, mock_reflink_file):
+        mock_reflink_file.side_effect = OSError("not supported")
+        method = link_or_copy_file(self.source, self.dest)
+        self.assertEqual(method, 'hardlink')
+        self.assertEqual(self.read_dest(), 'data')
+        self.assertEqual(os.stat(self.source).st_ino, os.stat(self.dest).st_ino)
+
+    @patch('lando_util.fileutil.os.link')
+    @patch('lando_util.fileutil.reflink_file')
+    def test_falls_back_to_copy(self, mock_reflink_file, mock_link):
+        mock_reflink_file.side_effect = OSError("not supported")
+        mock_link.side_effect = OSError("cross device link")
+        method = link_or_copy_file(self.source, self.dest)
+        self.assertEqual(method, 'copy')
+        self.assertEqual(self.read_dest(), 'data')
+        self.assertNotEqual(os.stat(self.source).st_ino, os.stat(self.dest).st_ino)
+
+    def test_replaces_existing_dest(self):
+        with open(self.dest, 'w') as outfile:
+            outfile.write('old')
+        link_or_copy_file(self.source, self.dest)
+        self.assertEqual(self.read_dest(), 'data')
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)), ['dest.txt', 'source.txt'])
+
+
+class TestCopyFile(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, 'source.bin')
+        self.dest = os.path.join(self.temp_dir.name, 'dest.bin')
+        self.content = bytes(range(256)) * 1000
+        with open(self.source, 'wb') as outfile:
+            outfile.write(self.content)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read_dest(self):
+        with open(self.dest, 'rb') as infile:
+            return infile.read()
+
+    @patch('lando_util.fileutil.KERNEL_COPY_CHUNK_SIZE', 1000)
+    def test_copy_file(self):
+        method = copy_file(self.source, self.dest)
+
+        self.assertIn(method, ['copy_file_range', 'sendfile'])
+        self.assertEqual(self.read_dest(), self.content)
+
+    @patch('lando_util.fileutil.get_kernel_copy_functions')
+    def test_falls_back_when_kernel_copy_is_unsupported(self, mock_get_kernel_copy_functions):
+        def unsupported(infd, outfd, count, offset):
+            raise OSError(errno.EXDEV, "cross device")
+
+        def sendfile(infd, outfd, count, offset):
+            return os.sendfile(outfd, infd, offset, count)
+        mock_get_kernel_copy_functions.return_value = [('copy_file_range', unsupported), ('sendfile', sendfile)]
+        self.assertEqual(copy_file(self.source, self.dest), 'sendfile')
+        self.assertEqual(self.read_dest(), self.content)
+
+        mock_get_kernel_copy_functions.return_value = [('copy_file_range', unsupported)]
+        self.assertEqual(copy_file(self.source, self.dest), 'copy')
+        self.assertEqual(self.read_dest(), self.content)
+
+    @patch('lando_util.fileutil.get_kernel_copy_functions')
+    def test_errors_after_copying_are_raised(self, mock_get_kernel_copy_functions):
+        calls = []
+
+        def fails_part_way(infd, outfd, count, offset):
+            calls.append(offset)
+            if offset:
+                raise OSError(errno.EIO, "I/O error")
+            return 100
+        mock_get_kernel_copy_functions.return_value = [('copy_file_range', fails_part_way)]
+
+        with self.assertRaises(OSError):
+            copy_file(self.source, self.dest)
+
+    def test_place_file(self):
+        self.assertEqual(place_file(self.source, self.dest, 'hardlink'), 'hardlink')
+        self.assertEqual(os.stat(self.source).st_ino, os.stat(self.dest).st_ino)
+
+        self.assertIn(place_file(self.source, self.dest, 'copy'), ['copy_file_range', 'sendfile'])
+        self.assertNotEqual(os.stat(self.source).st_ino, os.stat(self.dest).st_ino)
+        self.assertEqual(self.read_dest(), self.content)
+
+        with self.assertRaises(ValueError):
+            place_file(self.source, self.dest, 'symlink')
+
+    @patch('lando_util.fileutil.reflink_file')
+    def test_place_file_reflink_errors_leave_dest(self, mock_reflink_file):
+        mock_reflink_file.side_effect = OSError("not supported")
+        with open(self.dest, 'wb') as outfile:
+            outfile.write(b'old')
+
+        with self.assertRaises(OSError):
+            place_file(self.source, self.dest, 'reflink')
+
+        self.assertEqual(self.read_dest(), b'old')
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)), ['dest.bin', 'source.bin'])
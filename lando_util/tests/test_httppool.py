@@ -0,0 +1,134 @@
+import os
+import pathlib
+import socket
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+from unittest import TestCase
+from unittest.mock import patch
+from lando_util.httppool import HTTPConnectionPool, get_proxy, get_default_pool, configure_default_pool
+from lando_util.urldownload import ResumableDownload, SegmentedDownload, get_url_size
+from lando_util.tests.test_urldownload import LocalServerTestCase
+
+
+class TestHTTPConnectionPool(LocalServerTestCase):
+    def setUp(self):
+        super(TestHTTPConnectionPool, self).setUp()
+        self.pool = HTTPConnectionPool(max_per_host=2)
+
+    def tearDown(self):
+        self.pool.clear()
+        super(TestHTTPConnectionPool, self).tearDown()
+
+    def test_reuses_connections(self):
+        for idx in range(3):
+            dest = os.path.join(self.temp_dir.name, 'file{}.bin'.format(idx))
+            ResumableDownload(self.url, dest, pool=self.pool).run()
+            with open(dest, 'rb') as infile:
+                self.assertEqual(infile.read(), self.server.content)
+        self.assertEqual(get_url_size(self.url, pool=self.pool), len(self.server.content))
+
+        self.assertEqual(self.pool.connections_opened, 1)
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_limits_connections_per_host(self):
+        first = self.pool.urlopen(self.url)
+        second = self.pool.urlopen(self.url)
+        opened = threading.Event()
+
+        def open_third():
+            with self.pool.urlopen(self.url) as response:
+                response.read()
+            opened.set()
+        thread = threading.Thread(target=open_third)
+        thread.start()
+
+        self.assertFalse(opened.wait(0.2))
+        first.close()
+        thread.join()
+        self.assertTrue(opened.is_set())
+        second.close()
+        # the partially read responses could not be reused
+        self.assertEqual(self.pool.connections_opened, 3)
+
+    def test_reconnects_when_idle_connection_was_closed(self):
+        with self.pool.urlopen(self.url) as response:
+            response.read()
+        idle_connection = self.pool.idle[('http', '127.0.0.1', self.server.server_address[1])][0]
+        idle_connection.sock.shutdown(socket.SHUT_RDWR)
+
+        with self.pool.urlopen(self.url) as response:
+            self.assertEqual(response.read(), self.server.content)
+        self.assertEqual(self.pool.connections_opened, 2)
+
+    def test_readinto(self):
+        buffer = bytearray(100)
+        with self.pool.urlopen(self.url, {'Range': 'bytes=10-'}) as response:
+            self.assertEqual(response.status, 206)
+            self.assertEqual(response.readinto(buffer), 100)
+        self.assertEqual(bytes(buffer), self.server.content[10:110])
+
+    def test_follows_redirects(self):
+        redirect_url = self.url.replace('/data.bin', '/redirect')
+        with self.pool.urlopen(redirect_url) as response:
+            self.assertEqual(response.url, self.url)
+            self.assertEqual(response.read(), self.server.content)
+
+    def test_http_errors(self):
+        self.server.error_status = 404
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            self.pool.urlopen(self.url)
+        self.assertEqual(raised.exception.code, 404)
+
+    def test_connection_errors(self):
+        with self.assertRaises(urllib.error.URLError):
+            self.pool.urlopen('http://127.0.0.1:1/missing', timeout=1)
+        with self.assertRaises(urllib.error.URLError):
+            self.pool.urlopen('ftp://127.0.0.1/file')
+
+
+class TestOtherSchemes(TestCase):
+    def test_file_urls(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, 'source.bin')
+            with open(source, 'wb') as outfile:
+                outfile.write(b'x' * 1000)
+            url = pathlib.Path(source).as_uri()
+            pool = HTTPConnectionPool()
+
+            self.assertEqual(get_url_size(url, pool=pool), 1000)
+            with pool.urlopen(url) as response:
+                buffer = bytearray(10)
+                self.assertEqual(response.readinto(buffer), 10)
+                self.assertEqual(len(response.read()), 990)
+            dest = os.path.join(temp_dir, 'dest.bin')
+            SegmentedDownload(url, dest, segments=4, segment_threshold=1, pool=pool).run()
+            with open(dest, 'rb') as infile:
+                self.assertEqual(infile.read(), b'x' * 1000)
+            with self.assertRaises(urllib.error.URLError):
+                pool.urlopen(pathlib.Path(temp_dir, 'missing.bin').as_uri())
+            self.assertEqual(pool.connections_opened, 0)
+
+
+class TestProxy(TestCase):
+    def test_get_proxy(self):
+        parsed = urllib.parse.urlsplit('https://example.com/data')
+        with patch.dict(os.environ, {'https_proxy': 'proxy.local:3128', 'no_proxy': ''}, clear=True):
+            proxy = get_proxy(parsed)
+            self.assertEqual((proxy.hostname, proxy.port), ('proxy.local', 3128))
+        with patch.dict(os.environ, {'https_proxy': 'proxy.local:3128', 'no_proxy': 'example.com'}, clear=True):
+            self.assertIsNone(get_proxy(parsed))
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(get_proxy(parsed))
+
+
+class TestDefaultPool(TestCase):
+    def test_configure_default_pool(self):
+        original = get_default_pool()
+        try:
+            configure_default_pool(4)
+            self.assertIsNot(get_default_pool(), original)
+            self.assertEqual(get_default_pool().max_per_host, 4)
+        finally:
+            configure_default_pool(original.max_per_host)
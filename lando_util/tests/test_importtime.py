@@ -0,0 +1,27 @@
+import json
+import subprocess
+import sys
+from unittest import TestCase
+
+
+def get_imported_modules(module):
+    """
+    Import module in a new interpreter and return the names of every module that was loaded.
+    """
+    output = subprocess.check_output([
+        sys.executable, "-c", "import json, sys, {}; print(json.dumps(sorted(sys.modules)))".format(module)
+    ], universal_newlines=True)
+    return set(json.loads(output))
+
+
+class TestDeferredImports(TestCase):
+    def test_stagedata_defers_dukeds_client(self):
+        imported = get_imported_modules("lando_util.stagedata")
+        self.assertNotIn("ddsc", imported)
+        self.assertNotIn("requests", imported)
+        self.assertNotIn("boto3", imported)
+
+    def test_organize_project_defers_report_dependencies(self):
+        imported = get_imported_modules("lando_util.organize_project.organizer")
+        for module in ("jinja2", "markdown", "yaml", "dateutil"):
+            self.assertNotIn(module, imported)
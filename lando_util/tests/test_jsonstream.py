@@ -0,0 +1,49 @@
+import io
+import json
+from unittest import TestCase
+from lando_util.jsonstream import iter_json_items
+
+ITEMS = [
+    {"type": "DukeDS", "source": "123456", "dest": "/data/file1.dat"},
+    {"type": "url", "source": "ref.zip", "dest": "/data/ref.zip", "unzip_members": ["genome/*.fa"], "size": 12345},
+    {"type": "write", "source": "{\"items\": [1, 2]}", "dest": "/data/file3.dat", "flag": True, "none": None},
+]
+
+
+class TestIterJsonItems(TestCase):
+    def check_items(self, text):
+        for chunk_size in [1, 2, 7, 64, 1024]:
+            self.assertEqual(list(iter_json_items(io.StringIO(text), chunk_size=chunk_size)), ITEMS)
+
+    def test_items_object(self):
+        self.check_items(json.dumps({"items": ITEMS}))
+        self.check_items(json.dumps({"items": ITEMS}, indent=4))
+        self.check_items(json.dumps({"version": 1, "items": ITEMS, "other": {"a": [1]}}))
+
+    def test_one_item_per_line(self):
+        self.check_items("\n".join(json.dumps(item) for item in ITEMS) + "\n\n")
+
+    def test_numbers_split_between_chunks(self):
+        items = [{"c": 3.5}, {"c": 3.5e10}, {"c": -2E-3, "d": [10, 0.25]}, {"c": 1234567}]
+        text = json.dumps({"version": 1.5e0, "items": items})
+        for chunk_size in range(1, len(text) + 1):
+            self.assertEqual(list(iter_json_items(io.StringIO(text), chunk_size=chunk_size)), items)
+        self.assertEqual(list(iter_json_items(io.StringIO('{"c":3.5}\n{"c":3.5e10}'), chunk_size=1)),
+                         [{"c": 3.5}, {"c": 3.5e10}])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_json_items(io.StringIO('{"items": []}'))), [])
+        self.assertEqual(list(iter_json_items(io.StringIO(''))), [])
+
+    def test_reads_lazily(self):
+        infile = io.StringIO(json.dumps({"items": ITEMS}))
+        items = iter_json_items(infile, chunk_size=16)
+
+        self.assertEqual(next(items), ITEMS[0])
+        self.assertLess(infile.tell(), len(infile.getvalue()))
+
+    def test_invalid_data(self):
+        for text in ['{"items": [{"type": "url"}', '{"items": [{"type": "url"} {"type": "url"}]}', '[1, 2]',
+                     '{"items": [{"type": "ur']:
+            with self.assertRaises(ValueError):
+                list(iter_json_items(io.StringIO(text), chunk_size=4))
@@ -0,0 +1,74 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch, Mock, ANY
+from click.testing import CliRunner
+from lando_util.pipeline import Pipeline, main
+
+
+def create_cmdfile(directory):
+    path = os.path.join(directory, "cmdfile.json")
+    with open(path, "w") as outfile:
+        outfile.write("{}")
+    return path
+
+
+class TestPipeline(TestCase):
+    @patch('lando_util.upload.upload_cmdfile')
+    @patch('lando_util.organize_project.organizer.organize_cmdfile')
+    @patch('lando_util.pipeline.stage_cmdfile')
+    @patch('lando_util.pipeline.click')
+    def test_steps_share_dukeds_client(self, mock_click, mock_stage_cmdfile, mock_organize_cmdfile,
+                                       mock_upload_cmdfile):
+        dds_client = Mock()
+        pipeline = Pipeline(dds_client)
+        metadata_file = Mock()
+        options = Mock()
+
+        pipeline.stage("stage.json", metadata_file, workers=4, options=options)
+        pipeline.organize("organize.json")
+        pipeline.upload("upload.json", "project.sh", "json")
+
+        mock_stage_cmdfile.assert_called_with(dds_client, "stage.json", metadata_file, 4, (), options, False)
+        metadata_file.flush.assert_called_with()
+        mock_organize_cmdfile.assert_called_with("organize.json")
+        mock_upload_cmdfile.assert_called_with("upload.json", "project.sh", "json", dds_client, None)
+        mock_click.echo.assert_any_call("Starting upload step.")
+
+    @patch('lando_util.pipeline.stage_cmdfile')
+    @patch('lando_util.pipeline.click')
+    def test_logs_failed_step(self, mock_click, mock_stage_cmdfile):
+        mock_stage_cmdfile.side_effect = ValueError("bad item")
+
+        with self.assertRaises(ValueError):
+            Pipeline(Mock()).stage("stage.json")
+
+        self.assertTrue(mock_click.echo.call_args[0][0].startswith("The stage step failed after"))
+
+
+class TestMain(TestCase):
+    @patch('lando_util.pipeline.Pipeline')
+    def test_runs_selected_steps(self, mock_pipeline):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cmdfile = create_cmdfile(temp_dir)
+            result = CliRunner().invoke(main, [
+                "--organize-cmdfile", cmdfile, "--upload-cmdfile", cmdfile,
+                "--upload-outfile", os.path.join(temp_dir, "project.json"), "--upload-outfile-format", "json"
+            ])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        pipeline = mock_pipeline.return_value
+        pipeline.stage.assert_not_called()
+        pipeline.organize.assert_called_with(ANY)
+        pipeline.upload.assert_called_with(ANY, ANY, "json", None)
+
+    def test_requires_a_step(self):
+        result = CliRunner().invoke(main, [])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("At least one of", result.output)
+
+    def test_upload_requires_outfile(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            result = CliRunner().invoke(main, ["--upload-cmdfile", create_cmdfile(temp_dir)])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("--upload-outfile is required", result.output)
@@ -0,0 +1,59 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+from lando_util.projectcache import ProjectIdCache, create_project_cache
+
+
+class TestProjectIdCache(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "cache", "projects.json")
+        self.clock = Mock(return_value=1000)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_set_and_get(self):
+        cache = ProjectIdCache(self.path, ttl_seconds=60, clock=self.clock)
+        self.assertIsNone(cache.get("https://dds/api/v1", "myproject"))
+
+        cache.set("https://dds/api/v1", "myproject", "123")
+
+        # a new instance reads the file written by the first
+        other_cache = ProjectIdCache(self.path, ttl_seconds=60, clock=self.clock)
+        self.assertEqual(other_cache.get("https://dds/api/v1", "myproject"), "123")
+        self.assertIsNone(other_cache.get("https://other-dds/api/v1", "myproject"))
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ["projects.json"])
+
+    def test_entries_expire(self):
+        cache = ProjectIdCache(self.path, ttl_seconds=60, clock=self.clock)
+        cache.set("https://dds/api/v1", "myproject", "123")
+        self.clock.return_value = 1059
+        self.assertEqual(cache.get("https://dds/api/v1", "myproject"), "123")
+        self.clock.return_value = 1060
+        self.assertIsNone(cache.get("https://dds/api/v1", "myproject"))
+
+    def test_remove(self):
+        cache = ProjectIdCache(self.path, clock=self.clock)
+        cache.set("https://dds/api/v1", "myproject", "123")
+        cache.set("https://dds/api/v1", "otherproject", "456")
+        cache.remove("https://dds/api/v1", "myproject")
+        cache.remove("https://dds/api/v1", "missing")
+        self.assertIsNone(cache.get("https://dds/api/v1", "myproject"))
+        self.assertEqual(cache.get("https://dds/api/v1", "otherproject"), "456")
+
+    def test_unreadable_file_is_empty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as outfile:
+            outfile.write("{not json")
+        cache = ProjectIdCache(self.path, clock=self.clock)
+        self.assertIsNone(cache.get("https://dds/api/v1", "myproject"))
+        cache.set("https://dds/api/v1", "myproject", "123")
+        self.assertEqual(cache.get("https://dds/api/v1", "myproject"), "123")
+
+    def test_create_project_cache(self):
+        self.assertIsNone(create_project_cache(None, 60))
+        cache = create_project_cache(self.path, 60)
+        self.assertEqual(cache.path, self.path)
+        self.assertEqual(cache.ttl_seconds, 60)
@@ -0,0 +1,68 @@
+import io
+import os
+import zipfile
+from lando_util.remotezip import HTTPRangeFile, extract_remote_zip, RangeRequestsNotSupportedError
+from lando_util.urldownload import RemoteFileChangedError
+from lando_util.tests.test_urldownload import LocalServerTestCase
+
+
+def create_zip():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr("big.bin", bytes(range(256)) * 4000)
+        z.writestr("genome/chr1.fa", b">chr1" * 1000)
+        z.writestr("genome/chr2.fa", b">chr2" * 1000)
+    return buffer.getvalue()
+
+
+class TestHTTPRangeFile(LocalServerTestCase):
+    def test_read_and_seek(self):
+        with HTTPRangeFile(self.url) as remote_file:
+            self.assertEqual(remote_file.size, len(self.server.content))
+            remote_file.seek(-10, io.SEEK_END)
+            self.assertEqual(remote_file.read(), self.server.content[-10:])
+            remote_file.seek(1000)
+            self.assertEqual(remote_file.read(5), self.server.content[1000:1005])
+            self.assertEqual(remote_file.read(5), self.server.content[1005:1010])
+            self.assertEqual(remote_file.tell(), 1010)
+
+        ranges = [request.get('Range') for request in self.server.requests]
+        self.assertEqual(ranges, ['bytes=0-0', 'bytes={}-'.format(len(self.server.content) - 10), 'bytes=1000-'])
+
+    def test_reopens_after_dropped_connection(self):
+        self.server.drops = 1
+        self.server.drop_after = 100
+
+        with HTTPRangeFile(self.url, retry_wait_seconds=0) as remote_file:
+            data = io.BufferedReader(remote_file).read()
+
+        self.assertEqual(data, self.server.content)
+        self.assertEqual(self.server.requests[-1]['Range'], 'bytes=100-')
+
+    def test_requires_range_support(self):
+        self.server.supports_ranges = False
+
+        with self.assertRaises(RangeRequestsNotSupportedError):
+            HTTPRangeFile(self.url)
+
+    def test_remote_file_changed(self):
+        self.server.changed_etag = '"v2"'
+
+        with HTTPRangeFile(self.url) as remote_file:
+            with self.assertRaises(RemoteFileChangedError):
+                remote_file.read(10)
+
+
+class TestExtractRemoteZip(LocalServerTestCase):
+    def test_extracts_selected_members(self):
+        self.server.content = create_zip()
+        dest = os.path.join(self.temp_dir.name, 'unzipped')
+
+        member_count, bytes_read = extract_remote_zip(self.url, dest, ["genome/*"])
+
+        self.assertEqual(member_count, 2)
+        self.assertEqual(sorted(os.listdir(os.path.join(dest, "genome"))), ["chr1.fa", "chr2.fa"])
+        with open(os.path.join(dest, "genome", "chr2.fa"), 'rb') as infile:
+            self.assertEqual(infile.read(), b">chr2" * 1000)
+        self.assertFalse(os.path.exists(os.path.join(dest, "big.bin")))
+        self.assertLess(bytes_read, len(self.server.content) // 4)
@@ -0,0 +1,162 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from lando_util.extract import UnsafeArchiveMemberError
+from lando_util.s3download import S3Downloader, parse_s3_url, is_s3_prefix, create_s3_client, get_error_code
+from lando_util.urldownload import RemoteFileChangedError
+
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        super(FakeClientError, self).__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class DroppingBody(io.BytesIO):
+    """
+    Body whose connection drops after drop_after bytes.
+    """
+    def __init__(self, data, drop_after):
+        super(DroppingBody, self).__init__(data)
+        self.drop_after = drop_after
+
+    def read(self, size=-1):
+        if self.tell() >= self.drop_after:
+            raise ConnectionResetError("connection dropped")
+        return super(DroppingBody, self).read(min(size, self.drop_after - self.tell()))
+
+
+class FakeS3Client(object):
+    """
+    In memory stand-in for the parts of a boto3 S3 client used by S3Downloader.
+    """
+    def __init__(self, objects):
+        self.objects = objects
+        self.etags = dict((key, '"{}"'.format(idx)) for idx, key in enumerate(objects))
+        self.requests = []
+        self.drops = 0
+        self.drop_after = 0
+        self.lock = threading.Lock()
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[(Bucket, Key)]), "ETag": self.etags[(Bucket, Key)]}
+
+    def get_object(self, Bucket, Key, Range, IfMatch):
+        with self.lock:
+            self.requests.append((Key, Range))
+            drop = self.drops > 0
+            self.drops -= 1 if drop else 0
+        if IfMatch != self.etags[(Bucket, Key)]:
+            raise FakeClientError("PreconditionFailed")
+        start, end = [int(value) for value in Range.split('=')[1].split('-')]
+        data = self.objects[(Bucket, Key)][start:end + 1]
+        return {"Body": DroppingBody(data, self.drop_after) if drop else io.BytesIO(data)}
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2'
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        # two pages to check every page is read
+        for page_keys in (keys[:1], keys[1:]):
+            yield {"Contents": [{"Key": key, "Size": len(self.objects[(Bucket, key)]),
+                                 "ETag": self.etags[(Bucket, key)]} for key in page_keys]}
+
+
+class TestS3Download(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.content = bytes(range(256)) * 400
+        self.client = FakeS3Client({
+            ("refs", "genome/hg38.fa"): self.content,
+            ("refs", "genome/index/hg38.idx"): b"index",
+            ("refs", "genome/index/"): b"",
+            ("refs", "empty.txt"): b"",
+        })
+        self.downloader = S3Downloader(client=self.client, retry_wait_seconds=0)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read(self, path):
+        with open(path, 'rb') as infile:
+            return infile.read()
+
+    def test_parse_s3_url(self):
+        self.assertEqual(parse_s3_url("s3://refs/genome/hg38.fa"), ("refs", "genome/hg38.fa"))
+        self.assertEqual(parse_s3_url("s3://refs/genome/"), ("refs", "genome/"))
+        for bad_url in ("https://refs/genome", "s3://refs", "s3:///genome"):
+            with self.assertRaises(ValueError):
+                parse_s3_url(bad_url)
+        self.assertTrue(is_s3_prefix("s3://refs/genome/"))
+        self.assertFalse(is_s3_prefix("s3://refs/genome"))
+
+    def test_download_object_in_ranges(self):
+        dest = os.path.join(self.temp_dir.name, "hg38.fa")
+
+        size = self.downloader.download("s3://refs/genome/hg38.fa", dest, segments=4, segment_threshold=1000)
+
+        self.assertEqual(size, len(self.content))
+        self.assertEqual(self.read(dest), self.content)
+        self.assertEqual(sorted(request[1] for request in self.client.requests),
+                         ['bytes=0-25599', 'bytes=25600-51199', 'bytes=51200-76799', 'bytes=76800-102399'])
+        self.assertFalse(os.path.exists(dest + ".partial"))
+
+    def test_small_objects_use_a_single_request(self):
+        dest = os.path.join(self.temp_dir.name, "hg38.fa")
+        self.downloader.download("s3://refs/genome/hg38.fa", dest, segments=4, segment_threshold=len(self.content) + 1)
+        self.assertEqual(self.client.requests, [("genome/hg38.fa", "bytes=0-102399")])
+        dest = os.path.join(self.temp_dir.name, "empty.txt")
+        self.assertEqual(self.downloader.download("s3://refs/empty.txt", dest), 0)
+        self.assertEqual(self.read(dest), b"")
+
+    def test_range_resumes_after_dropped_connection(self):
+        self.client.drops = 1
+        self.client.drop_after = 1000
+        dest = os.path.join(self.temp_dir.name, "hg38.fa")
+
+        self.downloader.download("s3://refs/genome/hg38.fa", dest)
+
+        self.assertEqual(self.read(dest), self.content)
+        self.assertEqual([request[1] for request in self.client.requests], ["bytes=0-102399", "bytes=1000-102399"])
+
+    def test_object_changed(self):
+        self.client.etags[("refs", "genome/hg38.fa")] = '"changed"'
+        with self.assertRaises(RemoteFileChangedError):
+            self.downloader.download_object("refs", "genome/hg38.fa", len(self.content), '"0"',
+                                            os.path.join(self.temp_dir.name, "hg38.fa"))
+
+    def test_download_prefix(self):
+        dest = os.path.join(self.temp_dir.name, "genome")
+
+        size = self.downloader.download("s3://refs/genome/", dest, segments=2)
+
+        self.assertEqual(size, len(self.content) + 5)
+        self.assertEqual(self.read(os.path.join(dest, "hg38.fa")), self.content)
+        self.assertEqual(self.read(os.path.join(dest, "index", "hg38.idx")), b"index")
+
+    def test_get_size(self):
+        self.assertEqual(self.downloader.get_size("s3://refs/genome/hg38.fa"), len(self.content))
+        self.assertEqual(self.downloader.get_size("s3://refs/genome/"), len(self.content) + 5)
+        self.assertEqual(self.downloader.get_size("s3://refs/empty.txt"), 0)
+        self.assertEqual(self.client.requests, [])
+
+    def test_download_prefix_rejects_keys_outside_dest(self):
+        self.client.objects[("refs", "genome/../../escape.txt")] = b"x"
+        self.client.etags[("refs", "genome/../../escape.txt")] = '"9"'
+        with self.assertRaises(UnsafeArchiveMemberError):
+            self.downloader.download("s3://refs/genome/", os.path.join(self.temp_dir.name, "genome"))
+
+    def test_get_error_code(self):
+        self.assertEqual(get_error_code(FakeClientError("PreconditionFailed")), "PreconditionFailed")
+        self.assertIsNone(get_error_code(ValueError()))
+
+    def test_create_s3_client_requires_boto3(self):
+        with patch.dict(sys.modules, {"boto3": None}):
+            with self.assertRaises(ValueError):
+                create_s3_client()
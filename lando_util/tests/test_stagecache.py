@@ -0,0 +1,179 @@
+import errno
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from lando_util.stagecache import FileCache, get_dukeds_cache_key
+from lando_util.stagedata import StageItem
+from lando_util.stagemanifest import StageManifest
+
+
+class TestGetDukeDSCacheKey(TestCase):
+    def test_key_from_hashes(self):
+        file_data = {
+            "current_version": {
+                "id": "abc-123",
+                "upload": {"hashes": [{"algorithm": "md5", "value": "cafe"}]}
+            }
+        }
+        self.assertEqual(get_dukeds_cache_key(file_data), "abc-123-md5-cafe")
+
+    def test_key_from_older_hash_format(self):
+        file_data = {
+            "current_version": {
+                "id": "abc-123",
+                "upload": {"hash": {"algorithm": "md5", "value": "beef"}}
+            }
+        }
+        self.assertEqual(get_dukeds_cache_key(file_data), "abc-123-md5-beef")
+
+    def test_no_key_without_hash_or_with_unsafe_values(self):
+        self.assertIsNone(get_dukeds_cache_key({}))
+        self.assertIsNone(get_dukeds_cache_key({"current_version": {"id": "abc", "upload": {"hashes": []}}}))
+        file_data = {
+            "current_version": {
+                "id": "../../etc",
+                "upload": {"hashes": [{"algorithm": "md5", "value": "cafe"}]}
+            }
+        }
+        self.assertIsNone(get_dukeds_cache_key(file_data))
+
+
+class TestFileCache(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_file(self, name, size):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, 'wb') as outfile:
+            outfile.write(b'x' * size)
+        return path
+
+    def test_add_then_fetch(self):
+        cache = FileCache(self.cache_dir)
+        cache.add('key1', self.create_file('download.dat', 10))
+        dest = os.path.join(self.temp_dir.name, 'dest.dat')
+
+        self.assertTrue(cache.fetch('key1', dest))
+        with open(dest, 'rb') as infile:
+            self.assertEqual(infile.read(), b'x' * 10)
+        self.assertFalse(cache.fetch('key2', os.path.join(self.temp_dir.name, 'other.dat')))
+
+    def test_stats(self):
+        cache = FileCache(self.cache_dir, max_size=100)
+        self.assertEqual(cache.stats()['entries'], 0)
+        cache.add('key1', self.create_file('file1.dat', 10))
+        cache.add('key2', self.create_file('file2.dat', 20))
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['size'], 30)
+        self.assertEqual(stats['max_size'], 100)
+
+    def test_add_evicts_least_recently_used(self):
+        cache = FileCache(self.cache_dir, max_size=25)
+        cache.add('key1', self.create_file('file1.dat', 10))
+        cache.add('key2', self.create_file('file2.dat', 10))
+        os.utime(os.path.join(self.cache_dir, 'used', 'key1.used'), (1000, 1000))
+        os.utime(os.path.join(self.cache_dir, 'used', 'key2.used'), (2000, 2000))
+        # using key1 makes key2 the least recently used entry
+        cache.fetch('key1', os.path.join(self.temp_dir.name, 'dest.dat'))
+
+        cache.add('key3', self.create_file('file3.dat', 10))
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.cache_dir, 'objects'))), ['key1', 'key3'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.cache_dir, 'used'))), ['key1.used', 'key3.used'])
+
+    def test_prune(self):
+        cache = FileCache(self.cache_dir)
+        for idx in range(4):
+            key = 'key{}'.format(idx)
+            cache.add(key, self.create_file('file{}.dat'.format(idx), 10))
+            os.utime(os.path.join(self.cache_dir, 'used', key + '.used'), (1000 + idx, 1000 + idx))
+
+        removed = cache.prune(20)
+
+        self.assertEqual([os.path.basename(entry.path) for entry in removed], ['key0', 'key1'])
+        self.assertEqual(cache.stats()['size'], 20)
+
+    def test_fetch_keeps_linked_dests_unchanged(self):
+        cache = FileCache(self.cache_dir)
+        download_path = self.create_file('download.dat', 10)
+        cache.add('key1', download_path)
+        first_dest = os.path.join(self.temp_dir.name, 'first.dat')
+        cache.fetch('key1', first_dest)
+        item = StageItem("DukeDS", "file1", first_dest)
+        manifest = StageManifest(os.path.join(self.temp_dir.name, 'manifest.jsonl'))
+        manifest.record(item, version="1")
+        first_dest_mtime = os.stat(first_dest).st_mtime_ns
+        time.sleep(0.01)
+
+        cache.fetch('key1', os.path.join(self.temp_dir.name, 'second.dat'))
+        cache.add('key1', download_path)
+
+        self.assertEqual(os.stat(first_dest).st_mtime_ns, first_dest_mtime)
+        self.assertIsNotNone(manifest.get_current_entry(item, version="1"))
+
+    def test_entries_without_used_file_use_object_mtime(self):
+        os.makedirs(os.path.join(self.cache_dir, 'objects'))
+        for key, mtime in [('old', 1000), ('new', 2000)]:
+            path = os.path.join(self.cache_dir, 'objects', key)
+            with open(path, 'wb') as outfile:
+                outfile.write(b'x')
+            os.utime(path, (mtime, mtime))
+
+        self.assertEqual([entry.last_used for entry in FileCache(self.cache_dir).entries()], [1000, 2000])
+
+    def test_lock_waits_for_holder(self):
+        cache = FileCache(self.cache_dir)
+        events = []
+        on_wait = Mock()
+        with cache.lock('key1'):
+            with open(os.path.join(self.cache_dir, 'locks', 'key1.lock')) as infile:
+                marker = json.load(infile)
+            self.assertEqual(marker['pid'], os.getpid())
+            self.assertEqual(marker['key'], 'key1')
+
+            def wait_for_lock():
+                with FileCache(self.cache_dir).lock('key1', on_wait=on_wait, poll_seconds=0.01):
+                    events.append('waiter')
+            thread = threading.Thread(target=wait_for_lock)
+            thread.start()
+            thread.join(0.2)
+            events.append('holder')
+        thread.join()
+
+        self.assertEqual(events, ['holder', 'waiter'])
+        self.assertEqual(on_wait.call_args[0][0]['pid'], os.getpid())
+
+    def test_lock_recovered_after_holder_crashes(self):
+        cache = FileCache(self.cache_dir)
+        os.makedirs(cache.objects_dir)
+        partial_path = os.path.join(cache.objects_dir, 'key1.123.456.tmp')
+        with open(partial_path, 'w') as outfile:
+            outfile.write('partial')
+        # a process that is killed while holding the lock
+        script = "import os\n" \
+                 "from lando_util.stagecache import FileCache\n" \
+                 "with FileCache({!r}).lock('key1'):\n" \
+                 "    os._exit(1)\n".format(self.cache_dir)
+        subprocess.run([sys.executable, "-c", script])
+
+        on_wait = Mock()
+        with cache.lock('key1', on_wait=on_wait):
+            self.assertFalse(os.path.exists(partial_path))
+        on_wait.assert_not_called()
+
+    def test_lock_without_file_system_support(self):
+        cache = FileCache(self.cache_dir)
+        with patch('lando_util.stagecache.fcntl.flock', side_effect=OSError(errno.ENOLCK, 'No locks available')):
+            with cache.lock('key1'):
+                pass
@@ -1,8 +1,24 @@
+import io
 import os
+import gzip
 import json
+import tempfile
+import threading
+import time
+import zipfile
+import click
 from unittest import TestCase
-from unittest.mock import patch, Mock, call
-from lando_util.stagedata import get_stage_items, stage_data, write_downloaded_metadata, main
+from unittest.mock import patch, Mock, MagicMock, call, ANY
+from click.testing import CliRunner
+from lando_util.stagedata import get_stage_items, stage_data, write_downloaded_metadata, main, StagingPool, \
+    StagingError, parse_type_limits, download_dukeds_file, create_cache, cli, StageItem, StageOptions, stage_item, \
+    iter_stage_items, stream_stage_data, stream_downloaded_metadata, get_source_version, NDJSONMetadataWriter
+from lando_util.stagemanifest import StageManifest
+from lando_util.stagestatus import StageStatus
+from lando_util.stagemetrics import StageMetrics
+from lando_util.checksum import ChecksumMismatchError
+from lando_util.stagepreflight import InsufficientSpaceError
+from lando_util.stageshard import ShardAssignmentError
 
 
 class TestDownloadFunctions(TestCase):
@@ -14,6 +30,8 @@ class TestDownloadFunctions(TestCase):
                 {"type": "url", "source": "someurl", "dest": "/data/file2.dat"},
                 {"type": "write", "source": "MYDATA:12", "dest": "/data/file3.dat"},
                 {"type": "url", "source": "myfile.zip", "dest": "/data/myfile.zip", "unzip_to": "/data"},
+                {"type": "url", "source": "ref.zip", "dest": "/data/ref.zip", "unzip_to": "/data/ref",
+                 "unzip_members": ["genome/*.fa"]},
             ]
         }
         mock_cmdfile = Mock()
@@ -21,21 +39,29 @@ class TestDownloadFunctions(TestCase):
         result = get_stage_items(mock_cmdfile)
 
         mock_json.load.assert_called_with(mock_cmdfile)
-        self.assertEqual(len(result), 4)
+        self.assertEqual(len(result), 5)
         self.assertEqual(result[0], ("DukeDS", "123456", "/data/file1.dat", None))
         self.assertEqual(result[1], ("url", "someurl", "/data/file2.dat", None))
         self.assertEqual(result[2], ("write", "MYDATA:12", "/data/file3.dat", None))
         self.assertEqual(result[3], ("url", "myfile.zip", "/data/myfile.zip", "/data"))
+        self.assertEqual(result[3].settings, {})
+        self.assertEqual(result[4], ("url", "ref.zip", "/data/ref.zip", "/data/ref"))
+        self.assertEqual(result[4].settings, {"unzip_members": ["genome/*.fa"]})
 
     @patch("lando_util.stagedata.os")
-    @patch("lando_util.stagedata.urllib")
-    @patch("lando_util.stagedata.zipfile")
+    @patch("lando_util.stagedata.SegmentedDownload")
+    @patch("lando_util.stagedata.extract_zip")
     @patch("builtins.open")
     @patch("lando_util.stagedata.click")
-    def test_stage_data(self, mock_click, mock_open, mock_zipfile, mock_urllib, mock_os):
+    @patch("lando_util.stagedata.DukeDSDownloader")
+    def test_stage_data(self, mock_dukeds_downloader, mock_click, mock_open, mock_extract_zip,
+                        mock_segmented_download, mock_os):
         mock_os.path.dirname = lambda x: os.path.dirname(x)
         mock_dds_client = Mock()
-        mock_dds_client.get_file_by_id.return_value = Mock(_data_dict={"current_version": {"id": "999"}})
+        mock_downloader = mock_dukeds_downloader.return_value
+        mock_downloader.workers = 8
+        mock_downloader.get_file_info.return_value = Mock(metadata={"current_version": {"id": "999"}})
+        mock_downloader.download.return_value = {"algorithm": "md5", "value": "abc", "verified": False}
         stage_items = [
             ("DukeDS", "123456", "/data/file1.dat", None),
             ("url", "someurl", "/data/file2.dat", None),
@@ -47,6 +73,7 @@ class TestDownloadFunctions(TestCase):
 
         mock_click.echo.assert_has_calls([
             call("Staging 4 items."),
+            call("Fetching metadata for 1 DukeDS files."),
             call("Downloading DukeDS file 123456 to /data/file1.dat."),
             call("Downloading URL someurl to /data/file2.dat."),
             call("Writing file /data/file3.dat."),
@@ -60,20 +87,505 @@ class TestDownloadFunctions(TestCase):
             call("/data", exist_ok=True),
         ])
 
-        mock_dds_client.get_file_by_id.assert_called_with(file_id="123456")
-        mock_dds_client.get_file_by_id.return_value.download_to_path.assert_called_with('/data/file1.dat')
+        mock_dukeds_downloader.assert_called_with(mock_dds_client, 8)
+        mock_downloader.configure_connection_pool.assert_called_with(8)
+        mock_downloader.prefetch.assert_called_with(["123456"])
+        mock_downloader.get_file_info.assert_called_with("123456")
+        mock_downloader.download.assert_called_with(mock_downloader.get_file_info.return_value, '/data/file1.dat', None)
 
-        mock_urllib.request.urlretrieve.assert_has_calls([
-            call("someurl", "/data/file2.dat"),
-            call("https://someurl/myfile.zip", "/data/myfile.zip"),
+        mock_segmented_download.assert_has_calls([
+            call("someurl", "/data/file2.dat", 1, 256 * 1000 ** 2, hash_algorithm=None),
+            call().run(),
+            call("https://someurl/myfile.zip", "/data/myfile.zip", 1, 256 * 1000 ** 2, hash_algorithm=None),
+            call().run(),
         ])
 
         mock_open.assert_called_with('/data/file3.dat', 'w')
         mock_open.return_value.__enter__.return_value.write.assert_called_with('MYDATA:12')
-        self.assertEqual(result, [{'current_version': {'id': '999'}}])
+        self.assertEqual(result, [{
+            'current_version': {'id': '999'},
+            'checksum': {"algorithm": "md5", "value": "abc", "verified": False}
+        }])
 
-        mock_zipfile.ZipFile.assert_called_with("/data/myfile.zip")
-        mock_zipfile.ZipFile.return_value.__enter__.return_value.extractall.assert_called_with("/data")
+        mock_extract_zip.assert_called_with("/data/myfile.zip", "/data", None, 1)
+
+    @patch("lando_util.stagedata.SegmentedDownload")
+    @patch("lando_util.stagedata.extract_zip")
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_unzip_members(self, mock_click, mock_extract_zip, mock_segmented_download):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "ref.zip")
+            unzip_to = os.path.join(temp_dir, "ref")
+            stage_items = [StageItem("url", "https://someurl/ref.zip", dest, unzip_to, unzip_members=["*.fa"])]
+
+            stage_data(Mock(), stage_items, options=StageOptions(unzip_workers=4))
+
+        mock_extract_zip.assert_called_with(dest, unzip_to, ["*.fa"], 4)
+
+    @patch("lando_util.stagedata.SegmentedDownload")
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_url_checksum_mismatch(self, mock_click, mock_segmented_download):
+        mock_segmented_download.return_value.hexdigest = "0" * 64
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "file.dat")
+            with open(dest, 'w') as outfile:
+                outfile.write("data")
+            good_dest = os.path.join(temp_dir, "good.txt")
+            stage_items = [StageItem("url", "https://someurl/file.dat", dest, None, checksum="SHA256:" + "A" * 64),
+                           StageItem("write", "good", good_dest)]
+
+            with self.assertRaises(StagingError) as raised_exception:
+                stage_data(Mock(), stage_items)
+
+            self.assertFalse(os.path.exists(dest))
+            # the mismatch only fails its own item
+            with open(good_dest) as infile:
+                self.assertEqual(infile.read(), "good")
+        self.assertEqual([item.dest for item, error in raised_exception.exception.failures], [dest])
+        self.assertIsInstance(raised_exception.exception.failures[0][1], ChecksumMismatchError)
+        mock_segmented_download.assert_called_with("https://someurl/file.dat", dest, 1, 256 * 1000 ** 2,
+                                                   hash_algorithm="sha256")
+
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_skips_items_recorded_in_manifest(self, mock_click):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            manifest_path = os.path.join(temp_dir, "manifest.jsonl")
+            dest1 = os.path.join(temp_dir, "data", "file1.txt")
+            dest2 = os.path.join(temp_dir, "data", "file2.txt")
+            stage_items = [StageItem("write", "one", dest1), StageItem("write", "two", dest2)]
+            stage_data(Mock(), stage_items, options=StageOptions(manifest=StageManifest(manifest_path)))
+            with open(dest2, 'w') as outfile:
+                outfile.write("changed")
+            mock_click.reset_mock()
+
+            stage_data(Mock(), stage_items, options=StageOptions(manifest=StageManifest(manifest_path)))
+
+            with open(dest2) as infile:
+                self.assertEqual(infile.read(), "two")
+        mock_click.echo.assert_has_calls([
+            call("Skipping write one, already staged to {}.".format(dest1)),
+            call("Writing file {}.".format(dest2)),
+        ])
+
+    @patch("lando_util.stagedata.click")
+    def test_stage_item_restages_new_dukeds_version(self, mock_click):
+        mock_downloader = Mock()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "file1.dat")
+            with open(dest, 'w') as outfile:
+                outfile.write("data")
+            item = StageItem("DukeDS", "123456", dest)
+            manifest = StageManifest(os.path.join(temp_dir, "manifest.jsonl"))
+            manifest.record(item, "999", metadata={"current_version": {"id": "999"}})
+            options = StageOptions(manifest=manifest)
+
+            mock_downloader.get_file_info.return_value = Mock(metadata={"current_version": {"id": "999"}})
+            self.assertEqual(stage_item(mock_downloader, item, options), {"current_version": {"id": "999"}})
+            mock_downloader.download.assert_not_called()
+
+            mock_downloader.get_file_info.return_value = Mock(metadata={"current_version": {"id": "1000"}})
+            mock_downloader.download.return_value = {"algorithm": "md5", "value": "abc", "verified": True}
+            result = stage_item(mock_downloader, item, options)
+
+        self.assertEqual(result, {"current_version": {"id": "1000"}, "checksum": mock_downloader.download.return_value})
+        self.assertEqual(manifest.entries[dest]["version"], "1000")
+
+    def test_iter_stage_items(self):
+        cmdfile = io.StringIO(
+            '{"type": "DukeDS", "source": "123456", "dest": "/data/file1.dat"}\n'
+            '{"type": "url", "source": "ref.zip", "dest": "/data/ref.zip", "unzip_to": "/data/ref", '
+            '"unzip_members": ["genome/*.fa"]}\n'
+        )
+
+        result = list(iter_stage_items(cmdfile))
+
+        self.assertEqual(result, [
+            ("DukeDS", "123456", "/data/file1.dat", None),
+            ("url", "ref.zip", "/data/ref.zip", "/data/ref"),
+        ])
+        self.assertEqual(result[1].settings, {"unzip_members": ["genome/*.fa"]})
+
+    @patch("lando_util.stagedata.stage_item")
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.DukeDSDownloader")
+    def test_stream_stage_data_stages_in_batches(self, mock_dukeds_downloader, mock_click, mock_stage_item):
+        mock_downloader = mock_dukeds_downloader.return_value
+        mock_downloader.workers = 8
+        mock_stage_item.side_effect = lambda downloader, item, options: (
+            {"id": item[1]} if item[0] == "DukeDS" else None)
+        read_items = []
+
+        def iter_items():
+            for idx in range(5):
+                read_items.append(idx)
+                yield StageItem("DukeDS" if idx % 2 == 0 else "write", str(idx), "/data/{}".format(idx))
+
+        results = stream_stage_data(Mock(), iter_items(), batch_size=2)
+        self.assertEqual(next(results), {"id": "0"})
+        self.assertEqual(read_items, [0, 1])
+        self.assertEqual(list(results), [{"id": "2"}, {"id": "4"}])
+
+        mock_downloader.prefetch.assert_has_calls([call(["0"]), call(["2"]), call(["4"])])
+        self.assertEqual(mock_downloader.clear.call_count, 3)
+        mock_click.echo.assert_called_with("Staging complete, staged 5 items.")
+
+    @patch("lando_util.stagedata.click")
+    def test_stream_downloaded_metadata(self, mock_click):
+        outfile = io.StringIO()
+        outfile.name = "metadata.json"
+        items = [{'current_version': {'id': '111'}}, {'current_version': {'id': '222'}}]
+
+        stream_downloaded_metadata(outfile, iter(items))
+
+        self.assertEqual(outfile.getvalue(), json.dumps({"items": items}))
+        self.assertEqual(json.loads(outfile.getvalue()), {"items": items})
+        stream_downloaded_metadata(outfile, iter([]))
+        mock_click.echo.assert_called_with("Wrote 0 metadata items to metadata.json.")
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
+    @patch('lando_util.stagedata.stream_stage_data')
+    @patch('lando_util.stagedata.stream_downloaded_metadata')
+    def test_main_with_stream(self, mock_stream_downloaded_metadata, mock_stream_stage_data,
+                              mock_duke_ds_client):
+        cmdfile = io.StringIO('{"type": "write", "source": "data", "dest": "/data/file1.dat"}')
+        mock_metadata_file = Mock()
+
+        self.run_main(cmdfile, mock_metadata_file, stream=True)
+
+        args, kwargs = mock_stream_stage_data.call_args
+        self.assertEqual(list(args[1]), [("write", "data", "/data/file1.dat", None)])
+        mock_stream_downloaded_metadata.assert_called_with(mock_metadata_file, mock_stream_stage_data.return_value)
+
+    @patch("lando_util.stagedata.SegmentedDownload")
+    @patch("lando_util.stagedata.extract_zip")
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_records_metrics(self, mock_click, mock_extract_zip, mock_segmented_download):
+        metrics = StageMetrics()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            stage_items = [
+                StageItem("write", "data", os.path.join(temp_dir, "file1.txt")),
+                StageItem("url", "https://someurl/ref.zip", os.path.join(temp_dir, "ref.zip"),
+                          os.path.join(temp_dir, "ref")),
+                StageItem("faketype", "123", os.path.join(temp_dir, "file3.txt")),
+            ]
+            with self.assertRaises(ValueError):
+                stage_data(Mock(), stage_items, options=StageOptions(metrics=metrics))
+
+        summary = metrics.summary()
+        self.assertEqual(summary["total_items"], 3)
+        self.assertEqual(summary["items"], {"staged": 2, "failed": 1})
+        self.assertEqual(set(summary["phase_seconds"].keys()), {"prefetch", "transfer", "unzip"})
+        self.assertEqual(set(summary["sources"].keys()), {"write", "someurl", "faketype"})
+        self.assertEqual(summary["sources"]["write"]["bytes"], 4)
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
+    @patch('lando_util.stagedata.get_stage_items')
+    @patch('lando_util.stagedata.stage_data')
+    def test_main_writes_metrics_file_when_staging_fails(self, mock_stage_data, mock_get_stage_items,
+                                                         mock_duke_ds_client):
+        mock_stage_data.side_effect = StagingError([])
+        metrics_file = io.StringIO()
+        metrics_file.name = "metrics.json"
+
+        with self.assertRaises(StagingError):
+            self.run_main(Mock(), None, metrics_file=metrics_file)
+
+        self.assertEqual(json.loads(metrics_file.getvalue())["completed_items"], 0)
+
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.DukeDSDownloader")
+    def test_stage_data_downloads_duplicate_sources_once(self, mock_dukeds_downloader, mock_click):
+        mock_downloader = mock_dukeds_downloader.return_value
+        mock_downloader.workers = 8
+        mock_downloader.get_file_info.return_value = Mock(metadata={"current_version": {"id": "999"}})
+
+        def download(file_info, dest, decompress_format=None):
+            with open(dest, 'w') as outfile:
+                outfile.write("index")
+            return {"algorithm": "md5", "value": "abc", "verified": True}
+        mock_downloader.download.side_effect = download
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dests = [os.path.join(temp_dir, "sample{}".format(i), "index.dat") for i in range(3)]
+            stage_items = [StageItem("DukeDS", "123456", dest) for dest in dests]
+
+            result = stage_data(Mock(), stage_items, workers=2)
+
+            for dest in dests:
+                with open(dest) as infile:
+                    self.assertEqual(infile.read(), "index")
+        self.assertEqual(mock_downloader.download.call_count, 1)
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[2], result[0])
+        self.assertIsNot(result[2], result[0])
+        mock_click.echo.assert_any_call("Copying 2 items whose source was already staged.")
+
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.DukeDSDownloader")
+    def test_stage_data_copies_critical_duplicates_first(self, mock_dukeds_downloader, mock_click):
+        mock_downloader = mock_dukeds_downloader.return_value
+        mock_downloader.workers = 8
+        mock_downloader.get_file_info.return_value = Mock(metadata={"current_version": {"id": "999"}})
+
+        def download(file_info, dest, decompress_format=None):
+            with open(dest, 'w') as outfile:
+                outfile.write("index")
+            return {"algorithm": "md5", "value": "abc", "verified": True}
+        mock_downloader.download.side_effect = download
+
+        def stage(workers, names):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                outfile = io.StringIO()
+                stage_items = []
+                for name in names:
+                    if name.endswith(".txt"):
+                        stage_items.append(StageItem("write", "data", os.path.join(temp_dir, name)))
+                    else:
+                        stage_items.append(StageItem("DukeDS", "123456", os.path.join(temp_dir, name),
+                                                     critical=name.startswith("critical")))
+                stage_data(Mock(), stage_items, workers=workers, options=StageOptions(status=StageStatus(outfile)))
+            return [os.path.basename(json.loads(line).get("dest", json.loads(line)["event"]))
+                    for line in outfile.getvalue().splitlines()]
+
+        # the shared source starts first and the critical copy follows it before the other items
+        self.assertEqual(stage(1, ["a.dat", "b.txt", "c.txt", "critical.dat"]),
+                         ["a.dat", "critical.dat", "critical", "b.txt", "c.txt", "complete"])
+        self.assertEqual(stage(2, ["a.dat", "b.dat", "critical.dat"]),
+                         ["a.dat", "critical.dat", "critical", "b.dat", "complete"])
+
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.DukeDSDownloader")
+    def test_stage_data_failed_source_fails_its_duplicates(self, mock_dukeds_downloader, mock_click):
+        mock_downloader = mock_dukeds_downloader.return_value
+        mock_downloader.workers = 8
+        mock_downloader.get_file_info.side_effect = lambda file_id: Mock(file_id=file_id, metadata={
+            "current_version": {"id": file_id}})
+
+        def download(file_info, dest, decompress_format=None):
+            if file_info.file_id == "bad":
+                raise ValueError("Download failed")
+            with open(dest, 'w') as outfile:
+                outfile.write("data")
+        mock_downloader.download.side_effect = download
+        with tempfile.TemporaryDirectory() as temp_dir:
+            stage_items = [
+                StageItem("DukeDS", "bad", os.path.join(temp_dir, "a.dat")),
+                StageItem("DukeDS", "bad", os.path.join(temp_dir, "b.dat")),
+                StageItem("DukeDS", "ok", os.path.join(temp_dir, "c.dat")),
+                StageItem("DukeDS", "ok", os.path.join(temp_dir, "d.dat")),
+                StageItem("DukeDS", "bad", os.path.join(temp_dir, "e.dat"), critical=True),
+            ]
+
+            with self.assertRaises(StagingError) as raised_exception:
+                stage_data(Mock(), stage_items, workers=2)
+
+            self.assertEqual(sorted(os.listdir(temp_dir)), ["c.dat", "d.dat"])
+        failures = raised_exception.exception.failures
+        self.assertEqual([item.dest for item, error in failures], [stage_items[idx].dest for idx in (0, 1, 4)])
+        self.assertEqual([str(error) for item, error in failures], ["Download failed"] * 3)
+        self.assertIn("Failed to stage 3 item(s)", str(raised_exception.exception))
+
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_local_item(self, mock_click):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, "pvc", "ref.zip")
+            os.makedirs(os.path.dirname(source))
+            with zipfile.ZipFile(source, 'w') as z:
+                z.writestr("genome/chr1.fa", ">chr1")
+            dest = os.path.join(temp_dir, "data", "ref.zip")
+            unzip_to = os.path.join(temp_dir, "data", "ref")
+
+            stage_data(Mock(), [StageItem("local", source, dest, unzip_to, copy_method="hardlink")])
+
+            self.assertEqual(os.stat(source).st_ino, os.stat(dest).st_ino)
+            with open(os.path.join(unzip_to, "genome", "chr1.fa")) as infile:
+                self.assertEqual(infile.read(), ">chr1")
+        mock_click.echo.assert_any_call("Copied local file {} to {} using hardlink.".format(source, dest))
+
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_s3_item(self, mock_click):
+        s3_downloader = Mock()
+        s3_downloader.download.return_value = 1200
+        metrics = StageMetrics()
+        options = StageOptions(s3_downloader=s3_downloader, url_segments=4, url_segment_threshold=1000,
+                               metrics=metrics)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "refs") + os.sep
+
+            stage_data(Mock(), [StageItem("s3", "s3://bucket/refs/", dest)], options=options)
+
+            self.assertTrue(os.path.isdir(dest))
+        s3_downloader.download.assert_called_with("s3://bucket/refs/", dest, 4, 1000)
+        self.assertEqual(metrics.summary()["bytes"], 1200)
+        mock_click.echo.assert_any_call("Downloading S3 s3://bucket/refs/ to {}.".format(dest))
+
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_s3_item_checksum(self, mock_click):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "ref.fa")
+
+            def download(source, dest, segments, segment_threshold):
+                with open(dest, "w") as outfile:
+                    outfile.write("data")
+                return 4
+            options = StageOptions(s3_downloader=Mock(download=download))
+            item = StageItem("s3", "s3://bucket/ref.fa", dest, checksum="md5:00000000000000000000000000000000")
+
+            with self.assertRaises(ChecksumMismatchError):
+                stage_item(Mock(), item, options)
+            self.assertFalse(os.path.exists(dest))
+
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_decompress_local_item(self, mock_click):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, "reads.fq.gz")
+            with gzip.open(source, 'wb') as outfile:
+                outfile.write(b"@read1")
+            dest = os.path.join(temp_dir, "reads.fq")
+
+            stage_data(Mock(), [StageItem("local", source, dest, decompress="gzip")])
+
+            with open(dest, 'rb') as infile:
+                self.assertEqual(infile.read(), b"@read1")
+        mock_click.echo.assert_any_call("Decompressing local file {} to {}.".format(source, dest))
+
+    @patch('lando_util.stagedata.DecompressingDownload')
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_decompress_url_item(self, mock_click, mock_decompressing_download):
+        stage_data(Mock(), [StageItem("url", "https://host/ref.tar.gz", "/data/ref", decompress="tar.gz")])
+
+        mock_decompressing_download.assert_called_with("https://host/ref.tar.gz", "/data/ref", "tar.gz",
+                                                       hash_algorithm=None)
+        mock_decompressing_download.return_value.run.assert_called_with()
+
+    @patch('lando_util.stagedata.extract_remote_zip')
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_remote_unzip(self, mock_click, mock_extract_remote_zip):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "ref.zip")
+            unzip_to = os.path.join(temp_dir, "ref")
+            item = StageItem("url", "https://host/ref.zip", dest, unzip_to, unzip_members=["genome/*.fa"],
+                             remote_unzip=True)
+            mock_extract_remote_zip.side_effect = lambda url, path, patterns: os.makedirs(path) or (1, 2000)
+            metrics = StageMetrics()
+            options = StageOptions(manifest=StageManifest(os.path.join(temp_dir, "manifest.jsonl")), metrics=metrics)
+
+            stage_data(Mock(), [item], options=options)
+            stage_data(Mock(), [item], options=options)
+
+            self.assertFalse(os.path.exists(dest))
+        mock_extract_remote_zip.assert_called_once_with("https://host/ref.zip", unzip_to, ["genome/*.fa"])
+        self.assertEqual(metrics.summary()["bytes"], 2000)
+        self.assertEqual(metrics.summary()["items"], {"staged": 1, "skipped": 1})
+
+    @patch('lando_util.stagedata.json')
+    def test_get_stage_items_with_invalid_decompress_or_remote_unzip(self, mock_json):
+        for item in [
+            {"type": "url", "source": "https://host/file.gz", "dest": "/data/file", "decompress": "rar"},
+            {"type": "write", "source": "data", "dest": "/data/file", "decompress": "gzip"},
+            {"type": "url", "source": "https://host/f.tar", "dest": "/data/f", "unzip_to": "/data/f2",
+             "decompress": "tar"},
+            {"type": "url", "source": "https://host/f.zip", "dest": "/data/f.zip", "remote_unzip": True},
+            {"type": "DukeDS", "source": "123", "dest": "/data/f.zip", "unzip_to": "/data/f", "remote_unzip": True},
+            {"type": "url", "source": "https://host/f.zip", "dest": "/data/f.zip", "unzip_to": "/data/f",
+             "remote_unzip": True, "checksum": "md5:abc"},
+        ]:
+            mock_json.load.return_value = {"items": [item]}
+            with self.assertRaises(ValueError):
+                get_stage_items(Mock())
+
+    def test_get_source_version(self):
+        with tempfile.NamedTemporaryFile() as local_file:
+            local_file.write(b"12345")
+            local_file.flush()
+            version = get_source_version(Mock(), StageItem("local", local_file.name, "/data/file"))
+            self.assertEqual(version, "5-{}".format(os.stat(local_file.name).st_mtime_ns))
+        self.assertIsNone(get_source_version(Mock(), StageItem("url", "https://host/file", "/data/file")))
+
+    @patch('lando_util.stagedata.json')
+    def test_get_stage_items_with_invalid_copy_method(self, mock_json):
+        mock_json.load.return_value = {
+            "items": [{"type": "local", "source": "/pvc/file", "dest": "/data/file", "copy_method": "symlink"}]
+        }
+        with self.assertRaises(ValueError):
+            get_stage_items(Mock())
+
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.DukeDSDownloader")
+    def test_stage_data_writes_ndjson_metadata_as_items_finish(self, mock_dukeds_downloader, mock_click):
+        mock_downloader = mock_dukeds_downloader.return_value
+        mock_downloader.workers = 8
+        mock_downloader.get_file_info.side_effect = lambda file_id: Mock(
+            metadata={"current_version": {"id": "v" + file_id}})
+        mock_downloader.download.return_value = {"algorithm": "md5", "value": "abc", "verified": True}
+        outfile = io.StringIO()
+        options = StageOptions(metadata_writer=NDJSONMetadataWriter(outfile))
+        stage_items = [
+            ("DukeDS", "1", "/data/file1.dat", None),
+            ("DukeDS", "2", "/data/file2.dat", None),
+            ("faketype", "3", "/data/file3.dat", None),
+        ]
+
+        with patch("lando_util.stagedata.os"):
+            with self.assertRaises(ValueError):
+                stage_data(Mock(), stage_items, options=options)
+
+        lines = [json.loads(line) for line in outfile.getvalue().splitlines()]
+        self.assertEqual([line["current_version"]["id"] for line in lines], ["v1", "v2"])
+        self.assertEqual(options.metadata_writer.count, 2)
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
+    @patch('lando_util.stagedata.get_stage_items')
+    @patch('lando_util.stagedata.stage_data')
+    @patch('lando_util.stagedata.write_downloaded_metadata')
+    def test_main_with_ndjson_metadata_format(self, mock_write_downloaded_metadata, mock_stage_data,
+                                              mock_get_stage_items, mock_duke_ds_client):
+        def stage_data(dds_client, stage_items, workers, type_limits, options):
+            options.metadata_writer.write({"current_version": {"id": "111"}})
+            return [{"current_version": {"id": "111"}}]
+        mock_stage_data.side_effect = stage_data
+        metadata_file = io.StringIO()
+        metadata_file.name = "metadata.ndjson"
+
+        self.run_main(Mock(), metadata_file, metadata_format="ndjson")
+
+        self.assertEqual(metadata_file.getvalue(), '{"current_version": {"id": "111"}}\n')
+        mock_write_downloaded_metadata.assert_not_called()
+
+    @patch('lando_util.stagedata.json')
+    def test_get_stage_items_with_invalid_priority(self, mock_json):
+        mock_json.load.return_value = {
+            "items": [{"type": "url", "source": "someurl", "dest": "/data/file2.dat", "priority": "high"}]
+        }
+        with self.assertRaises(ValueError):
+            get_stage_items(Mock())
+
+    @patch('lando_util.stagedata.json')
+    def test_get_stage_items_with_invalid_s3_items(self, mock_json):
+        for file_data in [
+            {"type": "s3", "source": "https://bucket/key", "dest": "/data/file"},
+            {"type": "s3", "source": "s3://bucket/refs/", "dest": "/data/refs", "unzip_to": "/data/x"},
+            {"type": "s3", "source": "s3://bucket/refs/", "dest": "/data/refs", "checksum": "md5:abc"},
+        ]:
+            mock_json.load.return_value = {"items": [file_data]}
+            with self.assertRaises(ValueError):
+                get_stage_items(Mock())
+
+    @patch('lando_util.stagedata.json')
+    def test_get_stage_items_with_invalid_critical(self, mock_json):
+        mock_json.load.return_value = {
+            "items": [{"type": "url", "source": "someurl", "dest": "/data/file2.dat", "critical": "yes"}]
+        }
+        with self.assertRaises(ValueError):
+            get_stage_items(Mock())
+
+    @patch('lando_util.stagedata.json')
+    def test_get_stage_items_with_invalid_checksum(self, mock_json):
+        mock_json.load.return_value = {
+            "items": [{"type": "url", "source": "someurl", "dest": "/data/file2.dat", "checksum": "nohash:123"}]
+        }
+        with self.assertRaises(ValueError):
+            get_stage_items(Mock())
 
     @patch("lando_util.stagedata.os")
     def test_stage_data_with_unknown_type(self, mock_os):
@@ -102,31 +614,489 @@ class TestDownloadFunctions(TestCase):
             ]
         }))
 
-    @patch('lando_util.stagedata.DukeDSClient')
+    @staticmethod
+    def run_main(cmdfile, downloaded_metadata_file, **options):
+        """
+        Run the main command callback with default values for any options not specified.
+        """
+        params = {
+            "workers": 1,
+            "type_limits": (),
+            "cache_dir": None,
+            "cache_max_size": None,
+            "url_segments": 1,
+            "url_segment_threshold": "256MB",
+            "url_connections_per_host": 16,
+            "s3_endpoint_url": None,
+            "unzip_workers": 1,
+            "prefetch_workers": 8,
+            "manifest": None,
+            "metrics_file": None,
+            "progress_interval": 0,
+            "schedule": "cmdfile",
+            "metadata_format": "json",
+            "stream": False,
+            "plan_file": None,
+            "space_check": True,
+            "expected_rate": "50MB",
+            "status_file": None,
+            "ready_markers": False,
+            "detach_after_critical": False,
+            "detach_log": os.devnull,
+            "shard": None,
+        }
+        params.update(options)
+        main.callback(cmdfile, downloaded_metadata_file, **params)
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
     @patch('lando_util.stagedata.get_stage_items')
     @patch('lando_util.stagedata.stage_data')
     @patch('lando_util.stagedata.write_downloaded_metadata')
-    def test_main_without_downloaded_metadata_file(self, mock_write_downloaded_metadata, mock_stage_data,
-                                                   mock_get_stage_items, mock_duke_ds_client):
+    @patch('lando_util.stagedata.StageOptions')
+    def test_main_without_downloaded_metadata_file(self, mock_stage_options, mock_write_downloaded_metadata,
+                                                   mock_stage_data, mock_get_stage_items, mock_duke_ds_client):
         mock_cmdfile = Mock()
 
-        main.callback(mock_cmdfile, None)
+        self.run_main(mock_cmdfile, None)
 
         mock_get_stage_items.assert_called_with(mock_cmdfile)
-        mock_stage_data.assert_called_with(mock_duke_ds_client.return_value, mock_get_stage_items.return_value)
+        mock_stage_data.assert_called_with(mock_duke_ds_client.return_value, mock_get_stage_items.return_value,
+                                           workers=1, type_limits={}, options=mock_stage_options.return_value)
+        mock_stage_options.assert_called_with(cache=None, url_segments=1, url_segment_threshold=256 * 1000 ** 2,
+                                              unzip_workers=1, prefetch_workers=8, manifest=None,
+                                              metrics=ANY, schedule="cmdfile", space_check=True,
+                                              expected_rate=50 * 1000 ** 2, status=None,
+                                              s3_downloader=ANY)
         mock_write_downloaded_metadata.assert_not_called()
 
-    @patch('lando_util.stagedata.DukeDSClient')
+    @patch('lando_util.stagedata.LazyDukeDSClient')
     @patch('lando_util.stagedata.get_stage_items')
     @patch('lando_util.stagedata.stage_data')
     @patch('lando_util.stagedata.write_downloaded_metadata')
-    def test_main_with_downloaded_metadata_file(self, mock_write_downloaded_metadata, mock_stage_data,
-                                                   mock_get_stage_items, mock_duke_ds_client):
+    @patch('lando_util.stagedata.StageOptions')
+    def test_main_with_downloaded_metadata_file(self, mock_stage_options, mock_write_downloaded_metadata,
+                                                mock_stage_data, mock_get_stage_items, mock_duke_ds_client):
         mock_cmdfile = Mock()
         mock_metadata_file = Mock()
 
-        main.callback(mock_cmdfile, mock_metadata_file)
+        self.run_main(mock_cmdfile, mock_metadata_file)
 
         mock_get_stage_items.assert_called_with(mock_cmdfile)
-        mock_stage_data.assert_called_with(mock_duke_ds_client.return_value, mock_get_stage_items.return_value)
+        mock_stage_data.assert_called_with(mock_duke_ds_client.return_value, mock_get_stage_items.return_value,
+                                           workers=1, type_limits={}, options=mock_stage_options.return_value)
         mock_write_downloaded_metadata.assert_called_with(mock_metadata_file, mock_stage_data.return_value)
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
+    @patch('lando_util.stagedata.get_stage_items')
+    @patch('lando_util.stagedata.stage_data')
+    @patch('lando_util.stagedata.write_downloaded_metadata')
+    @patch('lando_util.stagedata.StageOptions')
+    @patch('lando_util.stagedata.StageManifest')
+    @patch('lando_util.stagedata.configure_default_pool')
+    @patch('lando_util.stagedata.S3Downloader')
+    def test_main_with_options(self, mock_s3_downloader, mock_configure_default_pool, mock_stage_manifest,
+                               mock_stage_options, mock_write_downloaded_metadata, mock_stage_data,
+                               mock_get_stage_items, mock_duke_ds_client):
+        mock_cmdfile = Mock()
+
+        self.run_main(mock_cmdfile, None, workers=8, type_limits=("DukeDS=2", "url=4"), url_segments=4,
+                      url_segment_threshold="1GB", url_connections_per_host=4, s3_endpoint_url="http://minio:9000",
+                      unzip_workers=3, prefetch_workers=16, manifest="/work/stage-manifest.jsonl",
+                      schedule="largest-first", space_check=False, expected_rate="1GB")
+
+        mock_configure_default_pool.assert_called_with(4)
+        mock_s3_downloader.assert_called_with("http://minio:9000", 4)
+
+        mock_stage_data.assert_called_with(mock_duke_ds_client.return_value, mock_get_stage_items.return_value,
+                                           workers=8, type_limits={"DukeDS": 2, "url": 4},
+                                           options=mock_stage_options.return_value)
+        mock_stage_options.assert_called_with(cache=None, url_segments=4, url_segment_threshold=1000 ** 3,
+                                              unzip_workers=3, prefetch_workers=16,
+                                              manifest=mock_stage_manifest.return_value, metrics=ANY,
+                                              schedule="largest-first", space_check=False, expected_rate=1000 ** 3,
+                                              status=None, s3_downloader=ANY)
+        mock_stage_manifest.assert_called_with("/work/stage-manifest.jsonl")
+
+    @patch('lando_util.stagepreflight.get_free_space')
+    @patch("lando_util.stagedata.click")
+    def test_stage_data_space_check_fails_before_staging(self, mock_click, mock_get_free_space):
+        mock_get_free_space.return_value = 3
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "data", "hello.txt")
+
+            with self.assertRaises(InsufficientSpaceError):
+                stage_data(Mock(), [StageItem("write", "hello", dest)], options=StageOptions(space_check=True))
+
+            self.assertFalse(os.path.exists(dest))
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
+    @patch('lando_util.stagedata.stage_data')
+    @patch("lando_util.stagedata.click")
+    def test_main_with_plan(self, mock_click, mock_stage_data, mock_duke_ds_client):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dest = os.path.join(temp_dir, "hello.txt")
+            cmdfile = io.StringIO(json.dumps({"items": [{"type": "write", "source": "hello", "dest": dest}]}))
+            plan_file = io.StringIO()
+            plan_file.name = "plan.json"
+
+            self.run_main(cmdfile, None, plan_file=plan_file)
+
+        plan = json.loads(plan_file.getvalue())
+        self.assertEqual(plan["transfer_bytes"], 5)
+        self.assertEqual(plan["items"][0]["dest"], dest)
+        mock_stage_data.assert_not_called()
+
+    def test_main_detach_after_critical_requires_list_cmdfile(self):
+        with self.assertRaises(click.UsageError):
+            self.run_main(Mock(), None, detach_after_critical=True, stream=True)
+
+    def test_parse_type_limits(self):
+        self.assertEqual(parse_type_limits([]), {})
+        self.assertEqual(parse_type_limits(["DukeDS=3", "write=1"]), {"DukeDS": 3, "write": 1})
+        for bad_value in ["DukeDS", "faketype=2", "url=0", "url=abc"]:
+            with self.assertRaises(click.BadParameter):
+                parse_type_limits([bad_value])
+
+    @patch("lando_util.stagedata.click")
+    def test_download_dukeds_file_uses_cache(self, mock_click):
+        mock_downloader = Mock()
+        mock_downloader.get_file_info.return_value = Mock(metadata={
+            "current_version": {"id": "999", "upload": {"hashes": [{"algorithm": "md5", "value": "abc"}]}}
+        })
+        mock_cache = Mock()
+        mock_cache.fetch.return_value = True
+
+        result = download_dukeds_file(mock_downloader, "123456", "/data/file1.dat", mock_cache)
+
+        self.assertEqual(result["current_version"]["id"], "999")
+        self.assertEqual(result["checksum"], {"algorithm": "md5", "value": "abc", "verified": True})
+        mock_cache.fetch.assert_called_with("999-md5-abc", "/data/file1.dat")
+        mock_downloader.download.assert_not_called()
+        mock_click.echo.assert_called_with("Using cached DukeDS file 123456 for /data/file1.dat.")
+
+    @patch("lando_util.stagedata.click")
+    def test_download_dukeds_file_adds_to_cache(self, mock_click):
+        mock_downloader = Mock()
+        mock_downloader.get_file_info.return_value = Mock(metadata={
+            "current_version": {"id": "999", "upload": {"hashes": [{"algorithm": "md5", "value": "abc"}]}}
+        })
+        mock_cache = MagicMock()
+        mock_cache.fetch.return_value = False
+
+        download_dukeds_file(mock_downloader, "123456", "/data/file1.dat", mock_cache)
+
+        mock_cache.lock.assert_called_with("999-md5-abc", on_wait=ANY)
+        mock_downloader.download.assert_called_with(mock_downloader.get_file_info.return_value, "/data/file1.dat", None)
+        mock_cache.add.assert_called_with("999-md5-abc", "/data/file1.dat")
+
+    @patch("lando_util.stagedata.click")
+    def test_download_dukeds_file_waits_for_other_process(self, mock_click):
+        mock_downloader = Mock()
+        mock_downloader.get_file_info.return_value = Mock(metadata={
+            "current_version": {"id": "999", "upload": {"hashes": [{"algorithm": "md5", "value": "abc"}]}}
+        })
+        mock_cache = MagicMock()
+        # another process added the file while this one waited for the lock
+        mock_cache.fetch.side_effect = [False, True]
+
+        def lock(key, on_wait):
+            on_wait({"host": "pod-2", "pid": 42})
+            return MagicMock()
+        mock_cache.lock.side_effect = lock
+
+        result = download_dukeds_file(mock_downloader, "123456", "/data/file1.dat", mock_cache)
+
+        self.assertEqual(result["checksum"], {"algorithm": "md5", "value": "abc", "verified": True})
+        mock_downloader.download.assert_not_called()
+        mock_cache.add.assert_not_called()
+        mock_click.echo.assert_has_calls([
+            call("Waiting for pod-2 pid 42 to download DukeDS file 123456."),
+            call("Using cached DukeDS file 123456 for /data/file1.dat."),
+        ])
+
+    def test_download_dukeds_file_single_flight(self):
+        file_info = Mock(metadata={
+            "current_version": {"id": "999", "upload": {"hashes": [{"algorithm": "md5", "value": "abc"}]}}
+        })
+        downloads = []
+
+        def download(file_info, dest, decompress_format=None):
+            downloads.append(dest)
+            time.sleep(0.2)
+            with open(dest, "w") as outfile:
+                outfile.write("data")
+            return {"algorithm": "md5", "value": "abc", "verified": True}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # each thread uses its own cache object like separate processes sharing a cache volume
+            def stage(name):
+                downloader = Mock(download=download)
+                downloader.get_file_info.return_value = file_info
+                cache = create_cache(os.path.join(temp_dir, "cache"), None)
+                download_dukeds_file(downloader, "123456", os.path.join(temp_dir, name), cache)
+
+            threads = [threading.Thread(target=stage, args=("file{}.dat".format(idx),)) for idx in range(3)]
+            with patch("lando_util.stagecache.LOCK_POLL_SECONDS", 0.01), patch("lando_util.stagedata.click"):
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            self.assertEqual(len(downloads), 1)
+            for idx in range(3):
+                with open(os.path.join(temp_dir, "file{}.dat".format(idx))) as infile:
+                    self.assertEqual(infile.read(), "data")
+
+    def test_create_cache(self):
+        self.assertIsNone(create_cache(None, "10GB"))
+        cache = create_cache("/tmp/cache", "10GB")
+        self.assertEqual(cache.cache_dir, "/tmp/cache")
+        self.assertEqual(cache.max_size, 10 * 1000 ** 3)
+        self.assertIsNone(create_cache("/tmp/cache", None).max_size)
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
+    @patch('lando_util.stagedata.stage_data')
+    def test_cli_defaults_to_stage_command(self, mock_stage_data, mock_duke_ds_client):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cmdfile_path = os.path.join(temp_dir, "cmdfile.json")
+            with open(cmdfile_path, "w") as outfile:
+                outfile.write(json.dumps({"items": []}))
+            result = runner.invoke(cli, [cmdfile_path, "--workers", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(mock_stage_data.call_args[0], (mock_duke_ds_client.return_value, []))
+        self.assertEqual(mock_stage_data.call_args[1]['workers'], 2)
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
+    @patch('lando_util.stagedata.get_item_sizes')
+    @patch('lando_util.stagedata.stage_data')
+    def test_cli_shards_and_merge(self, mock_stage_data, mock_get_item_sizes, mock_duke_ds_client):
+        mock_get_item_sizes.return_value = [100, 10, 80, 30, None]
+        mock_stage_data.side_effect = lambda dds_client, stage_items, **kwargs: [
+            {"file": item.source} for item in stage_items if item.item_type == "DukeDS"]
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cmdfile_path = os.path.join(temp_dir, "cmdfile.json")
+            with open(cmdfile_path, "w") as outfile:
+                outfile.write(json.dumps({"items": [
+                    {"type": "DukeDS", "source": "file1", "dest": "/data/file1.txt"},
+                    {"type": "DukeDS", "source": "file2", "dest": "/data/file2.txt"},
+                    {"type": "DukeDS", "source": "file3", "dest": "/data/file3.txt"},
+                    {"type": "url", "source": "https://x/a.txt", "dest": "/data/a.txt"},
+                    {"type": "DukeDS", "source": "file2", "dest": "/data/copy/file2.txt"},
+                ]}))
+            partial_paths = []
+            for shard in range(2):
+                partial_path = os.path.join(temp_dir, "metadata.{}.json".format(shard))
+                result = runner.invoke(cli, [cmdfile_path, partial_path, "--shard", "{}/2".format(shard)])
+                self.assertEqual(result.exit_code, 0, result.output)
+                partial_paths.append(partial_path)
+            merged_path = os.path.join(temp_dir, "metadata.json")
+
+            result = runner.invoke(cli, ["merge", merged_path] + partial_paths)
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(merged_path) as infile:
+                self.assertEqual(json.load(infile)["items"], [
+                    {"file": "file1"}, {"file": "file2"}, {"file": "file3"}, {"file": "file2"}
+                ])
+            # shard 0 gets the largest item, shard 1 the next two, the duplicate source follows its first item
+            self.assertEqual([[item.dest for item in call_args[0][1]] for call_args in mock_stage_data.call_args_list],
+                             [["/data/file1.txt", "/data/file2.txt", "/data/copy/file2.txt"],
+                              ["/data/file3.txt", "/data/a.txt"]])
+
+            result = runner.invoke(cli, ["merge", merged_path, partial_paths[0]])
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertIn("Expected partial metadata for shards 0 to 1, found shards 0.", result.output)
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
+    @patch('lando_util.stagedata.DukeDSDownloader')
+    def test_cli_shard_reuses_dukeds_metadata(self, mock_dukeds_downloader, mock_duke_ds_client):
+        mock_downloader = mock_dukeds_downloader.return_value
+        mock_downloader.workers = 8
+        mock_downloader.get_file_info.side_effect = lambda file_id: Mock(metadata={
+            "id": file_id, "current_version": {"id": file_id, "upload": {"size": 4}}})
+
+        def download(file_info, dest, decompress_format=None):
+            with open(dest, 'w') as outfile:
+                outfile.write("data")
+        mock_downloader.download.side_effect = download
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cmdfile_path = os.path.join(temp_dir, "cmdfile.json")
+            with open(cmdfile_path, "w") as outfile:
+                outfile.write(json.dumps({"items": [
+                    {"type": "DukeDS", "source": "file1", "dest": os.path.join(temp_dir, "file1.txt")},
+                    {"type": "DukeDS", "source": "file2", "dest": os.path.join(temp_dir, "file2.txt")},
+                ]}))
+            partial_path = os.path.join(temp_dir, "metadata.0.json")
+
+            result = runner.invoke(cli, [cmdfile_path, partial_path, "--shard", "0/1", "--no-space-check"])
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(partial_path) as infile:
+                self.assertEqual(len(json.load(infile)["items"]), 2)
+        # the downloader that looked up sizes for the shard split also stages the shard
+        self.assertEqual(mock_dukeds_downloader.call_count, 1)
+
+    @patch('lando_util.stagedata.LazyDukeDSClient')
+    @patch('lando_util.stagedata.get_item_sizes')
+    @patch('lando_util.stagedata.stage_data')
+    def test_cli_shard_fails_when_sizes_can_not_be_looked_up(self, mock_stage_data, mock_get_item_sizes,
+                                                             mock_duke_ds_client):
+        mock_get_item_sizes.side_effect = ConnectionError("reset")
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cmdfile_path = os.path.join(temp_dir, "cmdfile.json")
+            with open(cmdfile_path, "w") as outfile:
+                outfile.write(json.dumps({"items": [
+                    {"type": "url", "source": "https://x/a.txt", "dest": "/data/a.txt"},
+                ]}))
+            result = runner.invoke(cli, [cmdfile_path, os.path.join(temp_dir, "metadata.0.json"), "--shard", "0/2"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIsInstance(result.exception, ShardAssignmentError)
+        self.assertTrue(mock_get_item_sizes.call_args[1]["strict"])
+        mock_stage_data.assert_not_called()
+
+    def test_cli_shard_validation(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cmdfile_path = os.path.join(temp_dir, "cmdfile.json")
+            with open(cmdfile_path, "w") as outfile:
+                outfile.write(json.dumps({"items": []}))
+            result = runner.invoke(cli, [cmdfile_path, "--shard", "2/2"])
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertIn("Invalid shard 2/2", result.output)
+            result = runner.invoke(cli, [cmdfile_path, "--shard", "0/2", "--stream"])
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertIn("--shard can not be used with --stream", result.output)
+
+    def test_cli_cache_stats_and_prune(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_dir = os.path.join(temp_dir, "cache")
+            os.makedirs(os.path.join(cache_dir, "objects"))
+            for name, mtime in [("old", 1000), ("new", 2000)]:
+                path = os.path.join(cache_dir, "objects", name)
+                with open(path, "wb") as outfile:
+                    outfile.write(b"x" * 1000)
+                os.utime(path, (mtime, mtime))
+
+            result = runner.invoke(cli, ["cache", "stats", "--cache-dir", cache_dir])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Entries: 2", result.output)
+            self.assertIn("Size: 2 KB", result.output)
+
+            result = runner.invoke(cli, ["cache", "prune", "--cache-dir", cache_dir, "--cache-max-size", "1KB"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Removed 1 entries (1 KB).", result.output)
+            self.assertEqual(os.listdir(os.path.join(cache_dir, "objects")), ["new"])
+
+            result = runner.invoke(cli, ["cache", "prune", "--cache-dir", cache_dir])
+            self.assertNotEqual(result.exit_code, 0)
+
+
+class TestStagingPool(TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+        self.started = []
+
+    def fake_stage_item(self, dds_client, item, options):
+        item_type, source, dest, unzip_to = item
+        with self.lock:
+            self.started.append(source)
+            self.running[item_type] = self.running.get(item_type, 0) + 1
+            self.max_running[item_type] = max(self.max_running.get(item_type, 0), self.running[item_type])
+        time.sleep(0.01)
+        with self.lock:
+            self.running[item_type] -= 1
+        if source == "bad":
+            raise IOError("Download failed")
+        if item_type == "DukeDS":
+            return {"id": source}
+        return None
+
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.stage_item")
+    def test_stage_data_with_workers_keeps_cmdfile_order(self, mock_stage_item, mock_click):
+        mock_stage_item.side_effect = self.fake_stage_item
+        stage_items = [("DukeDS", str(i), "/data/file{}.dat".format(i), None) for i in range(10)]
+
+        result = stage_data(Mock(), stage_items, workers=4)
+
+        self.assertEqual(result, [{"id": str(i)} for i in range(10)])
+        self.assertEqual(self.max_running["DukeDS"], 4)
+
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.stage_item")
+    def test_run_applies_type_limits(self, mock_stage_item, mock_click):
+        mock_stage_item.side_effect = self.fake_stage_item
+        stage_items = [("DukeDS", "d{}".format(i), "/data/d{}.dat".format(i), None) for i in range(6)]
+        stage_items.extend([("url", "u{}".format(i), "/data/u{}.dat".format(i), None) for i in range(6)])
+
+        results = StagingPool(Mock(), workers=4, type_limits={"DukeDS": 1}).run(stage_items)
+
+        self.assertEqual(len(results), 12)
+        self.assertEqual(self.max_running["DukeDS"], 1)
+        self.assertEqual(self.max_running["url"], 3)
+        # url items do not wait behind the DukeDS items that are over their limit
+        self.assertLess(self.started.index("u0"), self.started.index("d1"))
+
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.stage_item")
+    def test_run_follows_schedule(self, mock_stage_item, mock_click):
+        mock_stage_item.side_effect = self.fake_stage_item
+        stage_items = [("url", "u{}".format(i), "/data/u{}.dat".format(i), None) for i in range(4)]
+
+        results = StagingPool(Mock(), workers=1).run(stage_items, [2, 0, 3, 1])
+
+        self.assertEqual(self.started, ["u2", "u0", "u3", "u1"])
+        self.assertEqual(len(results), 4)
+
+    @patch("lando_util.stagedata.get_item_sizes")
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.stage_item")
+    def test_stage_data_largest_first(self, mock_stage_item, mock_click, mock_get_item_sizes):
+        mock_stage_item.side_effect = self.fake_stage_item
+        mock_get_item_sizes.return_value = [10, 2000, None, 30]
+        stage_items = [StageItem("DukeDS", "d{}".format(i), "/data/d{}.dat".format(i)) for i in range(3)]
+        stage_items.append(StageItem("url", "u3", "/data/u3.dat", None, priority=1))
+
+        result = stage_data(Mock(), stage_items, options=StageOptions(schedule="largest-first"))
+
+        self.assertEqual(self.started, ["u3", "d1", "d0", "d2"])
+        self.assertEqual(result, [{"id": "d0"}, {"id": "d1"}, {"id": "d2"}])
+        mock_click.echo.assert_any_call("Schedule largest-first: 4 items, 2.04 KB known.")
+        mock_click.echo.assert_any_call("  1. url /data/u3.dat (30 bytes)")
+        mock_click.echo.assert_any_call("  4. DukeDS /data/d2.dat (unknown size)")
+
+    @patch("lando_util.stagedata.click")
+    @patch("lando_util.stagedata.stage_item")
+    def test_run_reports_errors_per_item(self, mock_stage_item, mock_click):
+        mock_stage_item.side_effect = self.fake_stage_item
+        stage_items = [
+            ("url", "good1", "/data/file1.dat", None),
+            ("url", "bad", "/data/file2.dat", None),
+            ("url", "good2", "/data/file3.dat", None),
+        ]
+
+        with self.assertRaises(StagingError) as raised_exception:
+            StagingPool(Mock(), workers=2).run(stage_items)
+
+        self.assertEqual(len(raised_exception.exception.failures), 1)
+        failed_item, error = raised_exception.exception.failures[0]
+        self.assertEqual(failed_item, ("url", "bad", "/data/file2.dat", None))
+        self.assertEqual(str(error), "Download failed")
+        self.assertIn("url bad to /data/file2.dat: Download failed", str(raised_exception.exception))
+        # all other items were still staged
+        self.assertEqual(sorted(self.started), ["bad", "good1", "good2"])
+
+    @patch("lando_util.stagedata.stage_item")
+    def test_run_with_unknown_type(self, mock_stage_item):
+        stage_items = [("faketype", "123456", "/data/file1.dat", None)]
+        with self.assertRaises(ValueError) as raised_exception:
+            StagingPool(Mock(), workers=2).run(stage_items)
+        self.assertEqual(str(raised_exception.exception), 'Unsupported type faketype')
+        mock_stage_item.assert_not_called()
@@ -0,0 +1,70 @@
+import os
+import json
+import tempfile
+from unittest import TestCase
+from lando_util.stagedata import StageItem
+from lando_util.stagemanifest import StageManifest, read_manifest_entries
+
+
+class TestStageManifest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "manifest.jsonl")
+        self.dest = os.path.join(self.temp_dir.name, "file.dat")
+        with open(self.dest, 'w') as outfile:
+            outfile.write("data")
+        self.item = StageItem("url", "https://host/file.dat", self.dest, None, checksum="md5:abc")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_record_and_get_current_entry(self):
+        manifest = StageManifest(self.path)
+        self.assertIsNone(manifest.get_current_entry(self.item))
+
+        manifest.record(self.item, checksum={"algorithm": "md5", "value": "abc", "verified": True})
+
+        entry = StageManifest(self.path).get_current_entry(self.item)
+        self.assertEqual(entry["size"], 4)
+        self.assertEqual(entry["checksum"], {"algorithm": "md5", "value": "abc", "verified": True})
+
+    def test_changed_items_are_not_current(self):
+        manifest = StageManifest(self.path)
+        manifest.record(self.item, version="1")
+
+        self.assertIsNone(manifest.get_current_entry(self.item, version="2"))
+        changed_source = StageItem("url", "https://host/other.dat", self.dest, None, checksum="md5:abc")
+        self.assertIsNone(manifest.get_current_entry(changed_source, version="1"))
+        changed_settings = StageItem("url", "https://host/file.dat", self.dest, None)
+        self.assertIsNone(manifest.get_current_entry(changed_settings, version="1"))
+        self.assertIsNotNone(manifest.get_current_entry(self.item, version="1"))
+
+        with open(self.dest, 'w') as outfile:
+            outfile.write("new data")
+        self.assertIsNone(manifest.get_current_entry(self.item, version="1"))
+        os.remove(self.dest)
+        self.assertIsNone(manifest.get_current_entry(self.item, version="1"))
+
+    def test_missing_unzip_to_is_not_current(self):
+        item = StageItem("url", "https://host/file.zip", self.dest, os.path.join(self.temp_dir.name, "unzipped"))
+        manifest = StageManifest(self.path)
+        manifest.record(item)
+
+        self.assertIsNone(manifest.get_current_entry(item))
+        os.mkdir(item.unzip_to)
+        self.assertIsNotNone(manifest.get_current_entry(item))
+
+    def test_ignores_partial_lines_and_compacts(self):
+        manifest = StageManifest(self.path)
+        manifest.record(self.item)
+        manifest.record(self.item)
+        with open(self.path, 'a') as outfile:
+            outfile.write('{"dest": "/data/trunc')
+
+        StageManifest(self.path)
+
+        with open(self.path) as infile:
+            lines = infile.readlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["dest"], self.dest)
+        self.assertEqual(list(read_manifest_entries(self.path).keys()), [self.dest])
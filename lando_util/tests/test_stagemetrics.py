@@ -0,0 +1,121 @@
+import io
+import os
+import json
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+from lando_util.stagedata import StageItem
+from lando_util.stagemetrics import StageMetrics, ProgressReporter, format_progress
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStageMetrics(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_file(self, name, size):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, 'wb') as outfile:
+            outfile.write(b'x' * size)
+        return path
+
+    def stage(self, metrics, item, transfer_seconds, status="staged", metadata_seconds=0):
+        item_metrics = metrics.start_item(item)
+        with metrics.phase('metadata', item_metrics):
+            self.clock.now += metadata_seconds
+        with metrics.phase('transfer', item_metrics):
+            self.clock.now += transfer_seconds
+        metrics.finish_item(item_metrics, status)
+
+    def test_s3_items_grouped_by_bucket(self):
+        metrics = StageMetrics(clock=self.clock)
+        self.stage(metrics, StageItem("s3", "s3://refs/genome/hg38.fa", self.create_file("a", 1000)), 1)
+        self.stage(metrics, StageItem("s3", "s3://refs/genome/hg19.fa", self.create_file("b", 1000)), 1)
+
+        self.assertEqual(metrics.summary()["sources"]["s3://refs"]["items"], 2)
+
+    def test_summary(self):
+        metrics = StageMetrics(slowest_count=2, clock=self.clock)
+        metrics.expect_items(4)
+        self.stage(metrics, StageItem("url", "https://host1/a", self.create_file("a", 1000)), 1)
+        self.stage(metrics, StageItem("url", "https://host1/b", self.create_file("b", 3000)), 2)
+        self.stage(metrics, StageItem("DukeDS", "123", self.create_file("c", 500)), 5, metadata_seconds=1)
+        self.stage(metrics, StageItem("url", "https://host2/d", "/missing/d"), 0.5, status="failed")
+
+        summary = metrics.summary()
+
+        self.assertEqual(summary["elapsed_seconds"], 9.5)
+        self.assertEqual(summary["completed_items"], 4)
+        self.assertEqual(summary["eta_seconds"], 0)
+        self.assertEqual(summary["items"], {"staged": 3, "failed": 1})
+        self.assertEqual(summary["bytes"], 4500)
+        self.assertEqual(summary["phase_seconds"], {"metadata": 1, "transfer": 8.5})
+        self.assertEqual(summary["sources"]["host1"], {
+            "items": 2, "bytes": 4000, "transfer_seconds": 3, "bytes_per_second": 4000 / 3
+        })
+        self.assertEqual(summary["sources"]["DukeDS"]["bytes_per_second"], 100)
+        self.assertEqual(summary["sources"]["host2"]["items"], 1)
+        self.assertEqual([item["source"] for item in summary["slowest_items"]], ["123", "https://host1/b"])
+        self.assertEqual(summary["slowest_items"][0]["phase_seconds"], {"metadata": 1, "transfer": 5})
+        self.assertEqual(summary["slowest_items"][1]["bytes_per_second"], 1500)
+        json.dumps(summary)
+
+    def test_progress_eta(self):
+        metrics = StageMetrics(clock=self.clock)
+        self.assertIsNone(metrics.progress()["eta_seconds"])
+        metrics.expect_items(3)
+        self.stage(metrics, StageItem("write", "data", self.create_file("a", 10)), 2)
+        metrics.start_item(StageItem("write", "data", "/data/b"))
+
+        progress = metrics.progress()
+
+        self.assertEqual(progress["eta_seconds"], 4)
+        self.assertEqual(progress["running_items"], 1)
+        self.assertEqual(format_progress(progress),
+                         "Progress: 1/3 items staged, 1 running, 10 bytes at 5 bytes/s, about 4 seconds remaining.")
+
+    def test_progress_reports_failed_items(self):
+        metrics = StageMetrics(clock=self.clock)
+        metrics.expect_items(4)
+        self.stage(metrics, StageItem("write", "data", self.create_file("a", 10)), 1)
+        self.stage(metrics, StageItem("url", "https://host/b", "/missing/b"), 1, status="failed")
+
+        progress = metrics.progress()
+
+        self.assertEqual(progress["completed_items"], 2)
+        self.assertEqual(progress["failed_items"], 1)
+        self.assertEqual(format_progress(progress),
+                         "Progress: 1/4 items staged, 1 failed, 0 running, 10 bytes at 5 bytes/s, "
+                         "about 2 seconds remaining.")
+
+    def test_write_items_do_not_record_source(self):
+        metrics = StageMetrics(clock=self.clock)
+        self.stage(metrics, StageItem("write", "secret data", self.create_file("a", 10)), 1)
+        outfile = io.StringIO()
+
+        metrics.write(outfile)
+
+        summary = json.loads(outfile.getvalue())
+        self.assertIsNone(summary["slowest_items"][0]["source"])
+        self.assertEqual(list(summary["sources"].keys()), ["write"])
+
+    def test_progress_reporter(self):
+        metrics = StageMetrics(clock=self.clock)
+        echo = Mock()
+
+        with ProgressReporter(metrics, interval=0.001, echo=echo):
+            while not echo.called:
+                pass
+
+        echo.assert_called_with("Progress: 0 items staged, 0 running, 0 bytes at 0 bytes/s.")
@@ -0,0 +1,125 @@
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch, Mock
+from lando_util.stagedata import StageItem
+from lando_util.stageplan import get_item_sizes, create_schedule, format_schedule, get_dukeds_size, \
+    find_duplicate_sources, promote_duplicate_sources
+from lando_util.s3download import S3Downloader
+from lando_util.tests.test_s3download import FakeS3Client
+
+
+class TestStagePlan(TestCase):
+    def setUp(self):
+        self.stage_items = [
+            StageItem("write", "abc", "/data/file1.txt"),
+            StageItem("DukeDS", "123", "/data/file2.dat"),
+            StageItem("url", "https://host/big.dat", "/data/big.dat"),
+            StageItem("DukeDS", "456", "/data/file4.dat"),
+            StageItem("url", "https://host/small.dat", "/data/small.dat", None, priority=5),
+        ]
+
+    @patch('lando_util.stageplan.get_url_size')
+    def test_get_item_sizes(self, mock_get_url_size):
+        mock_get_url_size.side_effect = lambda url: {"https://host/big.dat": 5000}.get(url)
+        dukeds_downloader = Mock(file_infos={
+            "123": Mock(metadata={"current_version": {"upload": {"size": 200}}}),
+        })
+
+        sizes = get_item_sizes(dukeds_downloader, self.stage_items)
+
+        self.assertEqual(sizes, [3, 200, 5000, None, None])
+
+        with tempfile.NamedTemporaryFile() as local_file:
+            local_file.write(b"12345")
+            local_file.flush()
+            local_items = [StageItem("local", local_file.name, "/data/file"), StageItem("local", "/missing", "/a")]
+            self.assertEqual(get_item_sizes(dukeds_downloader, local_items), [5, None])
+
+    @patch('lando_util.stageplan.get_url_size')
+    def test_get_item_sizes_strict(self, mock_get_url_size):
+        mock_get_url_size.side_effect = ConnectionError("reset")
+        dukeds_downloader = Mock()
+        dukeds_downloader.get_file_info.return_value = Mock(metadata={"current_version": {"upload": {"size": 200}}})
+
+        with self.assertRaises(ConnectionError):
+            get_item_sizes(dukeds_downloader, self.stage_items, strict=True)
+        mock_get_url_size.assert_any_call("https://host/big.dat", raise_errors=True)
+
+        mock_get_url_size.side_effect = None
+        mock_get_url_size.return_value = 5000
+        self.assertEqual(get_item_sizes(dukeds_downloader, self.stage_items, strict=True), [3, 200, 5000, 200, 5000])
+        dukeds_downloader.get_file_info.assert_called_with("456")
+
+    def test_get_item_sizes_s3(self):
+        s3_downloader = S3Downloader(client=FakeS3Client({
+            ("refs", "genome/hg38.fa"): b"x" * 1000,
+            ("refs", "genome/index/hg38.idx"): b"x" * 20,
+        }))
+        s3_items = [StageItem("s3", "s3://refs/genome/hg38.fa", "/data/hg38.fa"),
+                    StageItem("s3", "s3://refs/genome/", "/data/genome"),
+                    StageItem("s3", "s3://refs/missing.fa", "/data/missing.fa")]
+
+        self.assertEqual(get_item_sizes(Mock(), s3_items, s3_downloader=s3_downloader), [1000, 1020, None])
+        self.assertEqual(get_item_sizes(Mock(), s3_items), [None, None, None])
+        with self.assertRaises(KeyError):
+            get_item_sizes(Mock(), s3_items, strict=True, s3_downloader=s3_downloader)
+
+    def test_get_dukeds_size(self):
+        self.assertEqual(get_dukeds_size({"current_version": {"upload": {"size": 12}}}), 12)
+        self.assertIsNone(get_dukeds_size({}))
+
+    def test_create_schedule(self):
+        sizes = [3, 200, 5000, None, None]
+        self.assertEqual(create_schedule(self.stage_items), [4, 0, 1, 2, 3])
+        self.assertEqual(create_schedule(self.stage_items, sizes, "largest-first"), [4, 2, 1, 0, 3])
+        with self.assertRaises(ValueError):
+            create_schedule(self.stage_items, sizes, "random")
+
+    def test_create_schedule_starts_critical_items_first(self):
+        self.stage_items.append(StageItem("write", "ref", "/data/ref.txt", critical=True))
+        sizes = [3, 200, 5000, None, None, 3]
+        self.assertEqual(create_schedule(self.stage_items), [5, 4, 0, 1, 2, 3])
+        self.assertEqual(create_schedule(self.stage_items, sizes, "largest-first"), [5, 4, 2, 1, 0, 3])
+
+    def test_format_schedule(self):
+        sizes = [3, 200, 5000, None, None]
+
+        lines = format_schedule(self.stage_items, [4, 2, 1, 0, 3], sizes, "largest-first", log_count=2)
+
+        self.assertEqual(lines, [
+            "Schedule largest-first: 5 items, 5.2 KB known.",
+            "  1. url /data/small.dat (unknown size)",
+            "  2. url /data/big.dat (5 KB)",
+            "  ... 3 more items.",
+        ])
+
+    def test_find_duplicate_sources(self):
+        stage_items = [
+            StageItem("DukeDS", "123", "/data/sample1/index.dat"),
+            StageItem("url", "https://host/ref.zip", "/data/sample1/ref.zip", "/data/sample1/ref"),
+            StageItem("DukeDS", "123", "/data/sample2/index.dat"),
+            StageItem("url", "https://host/ref.zip", "/data/sample2/ref.zip", None, checksum="md5:abc"),
+            StageItem("write", "abc", "/data/sample1/file.txt"),
+            StageItem("write", "abc", "/data/sample2/file.txt"),
+            StageItem("url", "https://host/ref.zip", "/data/sample3/ref.zip", "/data/sample3/ref"),
+        ]
+
+        self.assertEqual(find_duplicate_sources(stage_items), {2: 0, 6: 1})
+
+    def test_promote_duplicate_sources(self):
+        stage_items = [
+            StageItem("DukeDS", "123", "/data/sample1/index.dat", priority=1),
+            StageItem("write", "abc", "/data/file.txt"),
+            StageItem("DukeDS", "123", "/data/sample2/index.dat", critical=True),
+            StageItem("DukeDS", "123", "/data/sample3/index.dat", priority=5),
+            StageItem("url", "https://host/ref.zip", "/data/ref.zip"),
+            StageItem("url", "https://host/ref.zip", "/data/copy/ref.zip"),
+        ]
+
+        promoted_items = promote_duplicate_sources(stage_items, find_duplicate_sources(stage_items))
+
+        self.assertEqual(promoted_items, stage_items)
+        self.assertEqual(promoted_items[0].settings, {"priority": 5, "critical": True})
+        self.assertEqual(stage_items[0].settings, {"priority": 1})
+        self.assertIs(promoted_items[4], stage_items[4])
+        self.assertEqual(create_schedule(promoted_items), [0, 2, 3, 1, 4, 5])
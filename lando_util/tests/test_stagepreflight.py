@@ -0,0 +1,139 @@
+import os
+import tempfile
+import zipfile
+from unittest import TestCase
+from unittest.mock import patch, Mock
+from lando_util.stagedata import StageItem
+from lando_util.stagecache import FileCache, get_dukeds_cache_key
+from lando_util.stagepreflight import create_plan, plan_item, get_archive_size, check_free_space, format_plan, \
+    get_existing_parent, InsufficientSpaceError
+
+
+class TestStagePreflight(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.temp_dir.name, "ref.zip")
+        with zipfile.ZipFile(self.archive, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr("genome/chr1.fa", b"A" * 5000)
+            z.writestr("genome/chr2.fa", b"C" * 3000)
+            z.writestr("notes.txt", b"notes")
+        self.unzip_to = os.path.join(self.temp_dir.name, "data", "ref")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_archive_size(self):
+        item = StageItem("local", self.archive, "/data/ref.zip", self.unzip_to, unzip_members=["genome/*"])
+        os.makedirs(os.path.join(self.unzip_to, "genome"))
+        with open(os.path.join(self.unzip_to, "genome", "chr2.fa"), 'wb') as outfile:
+            outfile.write(b"C" * 3000)
+
+        compressed_size, extracted_size, existing_size = get_archive_size(Mock(), item)
+
+        self.assertLess(compressed_size, 8000)
+        self.assertEqual(extracted_size, 8000)
+        self.assertEqual(existing_size, 3000)
+        self.assertIsNone(get_archive_size(Mock(), StageItem("local", self.archive, "/data/ref.zip")))
+        self.assertIsNone(get_archive_size(Mock(), StageItem("local", "/missing.zip", "/data/ref.zip", "/data/r")))
+
+    def test_plan_item_subtracts_existing_dest(self):
+        dest = os.path.join(self.temp_dir.name, "data", "file.dat")
+        os.makedirs(os.path.dirname(dest))
+        with open(dest, 'wb') as outfile:
+            outfile.write(b"x" * 400)
+
+        item_plan = plan_item(StageItem("url", "https://host/file.dat", dest), 1000, None)
+
+        self.assertEqual(item_plan["transfer_bytes"], 1000)
+        self.assertEqual(item_plan["required"], [{"path": dest, "bytes": 600}])
+        self.assertFalse(item_plan["estimated"])
+
+    def test_plan_item_estimates(self):
+        unknown = plan_item(StageItem("url", "https://host/file.zip", "/data/file.zip", "/data/file"), None, None)
+        self.assertIsNone(unknown["transfer_bytes"])
+        self.assertTrue(unknown["estimated"])
+
+        remote_unzip = plan_item(StageItem("url", "https://host/file.zip", "/data/file.zip", "/data/file",
+                                           remote_unzip=True), 9000, (300, 2000, 0))
+        self.assertEqual(remote_unzip["transfer_bytes"], 300)
+        self.assertEqual(remote_unzip["required"], [{"path": "/data/file.zip", "bytes": 0},
+                                                    {"path": "/data/file", "bytes": 2000}])
+
+        duplicate = plan_item(StageItem("url", "https://host/file.dat", "/data/copy.dat"), 1000, None, True)
+        self.assertEqual(duplicate["transfer_bytes"], 0)
+        self.assertEqual(duplicate["dest_bytes"], 1000)
+
+    @patch('lando_util.stagepreflight.get_free_space')
+    def test_create_plan(self, mock_get_free_space):
+        mock_get_free_space.return_value = 10000
+        stage_items = [
+            StageItem("write", "hello", os.path.join(self.temp_dir.name, "data", "hello.txt")),
+            StageItem("local", self.archive, os.path.join(self.temp_dir.name, "data", "ref.zip"), self.unzip_to),
+        ]
+        archive_size = os.path.getsize(self.archive)
+
+        plan = create_plan(Mock(), stage_items, [5, archive_size], expected_rate=1000)
+
+        self.assertEqual(plan["transfer_bytes"], 5 + archive_size)
+        self.assertEqual(plan["unknown_size_items"], 0)
+        self.assertEqual(plan["estimated_transfer_seconds"], (5 + archive_size) / 1000)
+        self.assertEqual(len(plan["filesystems"]), 1)
+        self.assertEqual(plan["filesystems"][0]["required_bytes"], 5 + archive_size + 8005)
+        self.assertEqual(plan["filesystems"][0]["free_bytes"], 10000)
+        self.assertEqual(plan["items"][1]["unzip_bytes"], 8005)
+        self.assertTrue(format_plan(plan)[0].startswith("Plan: 2 items"))
+
+        check_free_space(plan)
+        mock_get_free_space.return_value = 100
+        with self.assertRaises(InsufficientSpaceError):
+            check_free_space(create_plan(Mock(), stage_items, [5, archive_size], expected_rate=1000))
+
+    @patch('lando_util.stagepreflight.get_free_space')
+    def test_linked_items_need_no_space(self, mock_get_free_space):
+        mock_get_free_space.return_value = 100
+        data_dir = os.path.join(self.temp_dir.name, "data")
+        cache = FileCache(os.path.join(self.temp_dir.name, "cache"))
+        metadata = {"current_version": {"id": "v1", "upload": {"size": 5000,
+                                                               "hashes": [{"algorithm": "md5", "value": "abc"}]}}}
+        cache.add(get_dukeds_cache_key(metadata), self.archive)
+        dukeds_downloader = Mock(file_infos={"123": Mock(metadata=metadata)})
+        stage_items = [
+            StageItem("DukeDS", "123", os.path.join(data_dir, "cached.zip")),
+            StageItem("local", self.archive, os.path.join(data_dir, "linked.zip"), copy_method="hardlink"),
+            StageItem("local", self.archive, os.path.join(data_dir, "auto.zip"), copy_method="auto"),
+            StageItem("url", "https://host/ref.dat", os.path.join(data_dir, "ref.dat")),
+            StageItem("url", "https://host/ref.dat", os.path.join(data_dir, "copy", "ref.dat")),
+        ]
+
+        plan = create_plan(dukeds_downloader, stage_items, [5000, 5000, 5000, 50, 50], expected_rate=1000,
+                           duplicates={4: 3}, cache=cache)
+
+        self.assertEqual([item_plan["linked"] for item_plan in plan["items"]], [True, True, True, False, True])
+        self.assertEqual(plan["filesystems"][0]["required_bytes"], 50)
+        check_free_space(plan)
+        # without the cache the DukeDS file is downloaded
+        plan = create_plan(dukeds_downloader, stage_items, [5000, 5000, 5000, 50, 50], expected_rate=1000,
+                           duplicates={4: 3})
+        self.assertEqual(plan["filesystems"][0]["required_bytes"], 5050)
+
+    @patch('lando_util.stagepreflight.get_free_space')
+    def test_estimated_shortfall_warns(self, mock_get_free_space):
+        mock_get_free_space.return_value = 1000
+        stage_items = [
+            StageItem("write", "hello", os.path.join(self.temp_dir.name, "data", "hello.txt")),
+            StageItem("local", self.archive, os.path.join(self.temp_dir.name, "data", "ref.gz"), decompress="gzip"),
+        ]
+
+        plan = create_plan(Mock(), stage_items, [5, 2000], expected_rate=1000)
+
+        self.assertEqual(plan["filesystems"][0]["estimated_bytes"], 2000)
+        warnings = check_free_space(plan)
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("including 2 KB of estimated sizes", warnings[0])
+        mock_get_free_space.return_value = 1
+        with self.assertRaises(InsufficientSpaceError):
+            check_free_space(create_plan(Mock(), stage_items, [5, 2000], expected_rate=1000))
+
+    def test_get_existing_parent(self):
+        self.assertEqual(get_existing_parent(os.path.join(self.temp_dir.name, "a", "b", "c")), self.temp_dir.name)
+        self.assertEqual(get_existing_parent(self.archive), self.archive)
@@ -0,0 +1,84 @@
+from unittest import TestCase
+from lando_util.stagedata import StageItem
+from lando_util.stageshard import parse_shard, assign_shards, get_cmdfile_digest, create_shard_metadata, \
+    merge_shard_metadata, get_item_hash, ShardMergeError
+
+
+class TestStageShard(TestCase):
+    def setUp(self):
+        self.stage_items = [
+            StageItem("DukeDS", "file1", "/data/file1.txt"),
+            StageItem("url", "https://x/a.txt", "/data/a.txt"),
+            StageItem("DukeDS", "file2", "/data/file2.txt"),
+            StageItem("DukeDS", "file3", "/data/file3.txt"),
+        ]
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("0/4"), (0, 4))
+        self.assertEqual(parse_shard("3/4"), (3, 4))
+        for bad_value in ("4/4", "1", "-1/4", "a/4", "0/0"):
+            with self.assertRaises(ValueError):
+                parse_shard(bad_value)
+
+    def test_assign_shards_balances_sizes(self):
+        sizes = [10, 500, 300, 200, 40, 30]
+        stage_items = [StageItem("write", "data", "/data/{}.txt".format(idx)) for idx in range(len(sizes))]
+
+        shards = assign_shards(stage_items, sizes, 2)
+
+        self.assertEqual(shards, [[1, 4], [0, 2, 3, 5]])
+        self.assertEqual([sum(sizes[idx] for idx in shard) for shard in shards], [540, 540])
+        self.assertEqual(assign_shards(stage_items, sizes, 2), shards)
+
+    def test_assign_shards_hashes_unknown_sizes(self):
+        stage_items = [StageItem("s3", "s3://refs/{}".format(idx), "/data/{}".format(idx)) for idx in range(5)]
+        shards = assign_shards(stage_items, [None] * 5, 3)
+        for idx, item in enumerate(stage_items):
+            self.assertIn(idx, shards[get_item_hash(item) % 3])
+
+        # unknown items stay on the same shard whatever the sizes of the other items
+        stage_items.append(StageItem("DukeDS", "file1", "/data/file1.txt"))
+        for size in (0, 100, None):
+            self.assertEqual([[idx for idx in shard if idx < 5] for shard in assign_shards(stage_items,
+                                                                                           [None] * 5 + [size], 3)],
+                             shards)
+
+    def test_assign_shards_keeps_duplicate_sources_together(self):
+        stage_items = self.stage_items + [StageItem("DukeDS", "file3", "/data/copy/file3.txt")]
+        shards = assign_shards(stage_items, [100, 100, 100, 100, 100], 4)
+        self.assertIn([3, 4], shards)
+
+    def test_merge_restores_cmdfile_order(self):
+        partials = [
+            create_shard_metadata((1, 2), self.stage_items, [1, 2], [{"file": "file2"}]),
+            create_shard_metadata((0, 2), self.stage_items, [0, 3], [{"file": "file1"}, {"file": "file3"}]),
+        ]
+        self.assertEqual(partials[1]["items"], [{"index": 0, "metadata": {"file": "file1"}},
+                                                {"index": 3, "metadata": {"file": "file3"}}])
+
+        self.assertEqual(merge_shard_metadata(partials), [{"file": "file1"}, {"file": "file2"}, {"file": "file3"}])
+
+    def test_merge_requires_every_item_once(self):
+        with self.assertRaises(ShardMergeError):
+            merge_shard_metadata([])
+        partials = [
+            create_shard_metadata((0, 2), self.stage_items, [0, 3], [{"file": "file1"}, {"file": "file3"}]),
+            create_shard_metadata((1, 2), self.stage_items, [1, 3], [{"file": "file3"}]),
+        ]
+        with self.assertRaises(ShardMergeError) as raised:
+            merge_shard_metadata(partials)
+        self.assertIn("every cmdfile item exactly once", str(raised.exception))
+        other_items = self.stage_items[:3] + [StageItem("DukeDS", "file4", "/data/file3.txt")]
+        partials[1] = create_shard_metadata((1, 2), other_items, [1, 2], [{"file": "file2"}])
+        with self.assertRaises(ShardMergeError):
+            merge_shard_metadata(partials)
+
+    def test_get_cmdfile_digest_includes_settings(self):
+        items = [StageItem("url", "https://x/a.txt", "/data/a.txt")]
+        with_checksum = [StageItem("url", "https://x/a.txt", "/data/a.txt", checksum="md5:abc")]
+        self.assertEqual(get_cmdfile_digest(items), get_cmdfile_digest(list(items)))
+        self.assertNotEqual(get_cmdfile_digest(items), get_cmdfile_digest(with_checksum))
+
+    def test_create_shard_metadata_checks_metadata_count(self):
+        with self.assertRaises(ValueError):
+            create_shard_metadata((0, 1), self.stage_items, [0, 1, 2, 3], [{"file": "file1"}])
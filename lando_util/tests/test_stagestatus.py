@@ -0,0 +1,188 @@
+import io
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase
+from unittest.mock import patch, Mock
+from lando_util.stagedata import StageItem, StageOptions, stage_data
+from lando_util.stagestatus import StageStatus, get_ready_marker_path
+
+
+def read_events(outfile):
+    return [json.loads(line) for line in outfile.getvalue().splitlines()]
+
+
+class TestStageStatus(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_ready_marker_path(self):
+        self.assertEqual(get_ready_marker_path(StageItem("url", "https://x/a.zip", "/data/a.zip")), "/data/a.zip.ready")
+        item = StageItem("url", "https://x/a.zip", "/data/a.zip", "/data/a/", remote_unzip=True)
+        self.assertEqual(get_ready_marker_path(item), "/data/a.ready")
+
+    def test_ready_markers(self):
+        dest = os.path.join(self.temp_dir.name, "file1.txt")
+        item = StageItem("write", "data", dest)
+        with open(dest + ".ready", "w") as outfile:
+            outfile.write("{}")
+        status = StageStatus(ready_markers=True, clock=Mock(return_value=100))
+
+        status.start_item(item)
+        self.assertFalse(os.path.exists(dest + ".ready"))
+        status.finish_item(item, "staged")
+
+        with open(dest + ".ready") as infile:
+            marker = json.load(infile)
+        self.assertEqual(marker["status"], "staged")
+        self.assertEqual(marker["dest"], dest)
+        self.assertIsNone(marker["source"])
+        status.start_item(item)
+        status.finish_item(item, "failed", ValueError("boom"))
+        self.assertFalse(os.path.exists(dest + ".ready"))
+
+    def test_critical_event_after_last_critical_item(self):
+        outfile = io.StringIO()
+        status = StageStatus(outfile, clock=Mock(return_value=100))
+        status.expect_critical(2)
+        critical_items = [StageItem("write", "data", "/data/{}.txt".format(idx), critical=True) for idx in range(2)]
+        on_critical = Mock()
+        status.on_critical = on_critical
+
+        status.finish_item(critical_items[0], "staged")
+        self.assertFalse(status.wait_critical(timeout=0))
+        status.finish_item(StageItem("write", "data", "/data/other.txt"), "staged")
+        status.finish_item(critical_items[1], "skipped")
+        self.assertTrue(status.wait_critical(timeout=0))
+        status.finish()
+
+        on_critical.assert_called_once_with(True)
+        self.assertEqual([(event["event"], event["status"]) for event in read_events(outfile)], [
+            ("item", "staged"), ("item", "staged"), ("item", "skipped"), ("critical", "staged"),
+            ("complete", "staged"),
+        ])
+
+    def test_failed_critical_item(self):
+        outfile = io.StringIO()
+        status = StageStatus(outfile)
+        status.expect_critical(2)
+        on_critical = Mock()
+        status.on_critical = on_critical
+
+        status.finish_item(StageItem("url", "https://x/a", "/data/a", critical=True), "failed", IOError("404"))
+        status.finish(IOError("404"))
+
+        self.assertFalse(status.wait_critical(timeout=0))
+        on_critical.assert_called_once_with(False)
+        events = read_events(outfile)
+        self.assertEqual(events[0]["error"], "404")
+        self.assertEqual([(event["event"], event["status"]) for event in events[1:]],
+                         [("critical", "failed"), ("complete", "failed")])
+
+    def test_no_critical_items_waits_for_every_item(self):
+        status = StageStatus()
+        status.expect_critical(0)
+        status.finish_item(StageItem("write", "data", "/data/file.txt"), "staged")
+        self.assertFalse(status.wait_critical(timeout=0))
+        status.finish()
+        self.assertTrue(status.wait_critical(timeout=0))
+
+    @patch('lando_util.stagedata.click')
+    def test_stage_data_publishes_status(self, mock_click):
+        outfile = io.StringIO()
+        stage_items = [
+            StageItem("write", "data", os.path.join(self.temp_dir.name, "later.txt")),
+            StageItem("write", "data", os.path.join(self.temp_dir.name, "first.txt"), critical=True),
+        ]
+        options = StageOptions(status=StageStatus(outfile, ready_markers=True))
+
+        stage_data(Mock(), stage_items, options=options)
+
+        events = read_events(outfile)
+        # critical items start first
+        self.assertEqual([os.path.basename(event.get("dest", "")) for event in events],
+                         ["first.txt", "", "later.txt", ""])
+        self.assertEqual([event["event"] for event in events], ["item", "critical", "item", "complete"])
+        for item in stage_items:
+            self.assertTrue(os.path.exists(item.dest + ".ready"))
+
+
+class HeldFileHandler(BaseHTTPRequestHandler):
+    """
+    Serves a small file once the test sets server.release.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.release.wait(30)
+        self.send_response(200)
+        self.send_header('Content-Length', '4')
+        self.end_headers()
+        self.wfile.write(b'data')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestDetachAfterCritical(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), HeldFileHandler)
+        self.server.release = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_command_returns_once_critical_items_are_staged(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cmdfile = os.path.join(temp_dir, "cmdfile.json")
+            status_file = os.path.join(temp_dir, "status.ndjson")
+            detach_log = os.path.join(temp_dir, "detach.log")
+            with open(cmdfile, "w") as outfile:
+                json.dump({"items": [
+                    {"type": "url", "source": "http://127.0.0.1:{}/large.dat".format(self.server.server_port),
+                     "dest": os.path.join(temp_dir, "out", "large.dat")},
+                    {"type": "write", "source": "{}", "dest": os.path.join(temp_dir, "out", "ref.json"),
+                     "critical": True},
+                ]}, outfile)
+
+            # output is captured so the command only returns once the background process has released it
+            result = subprocess.run([sys.executable, "-m", "lando_util.stagedata", cmdfile, "--status-file",
+                                     status_file, "--detach-after-critical", "--detach-log", detach_log,
+                                     "--no-space-check"],
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                                    timeout=20)
+
+            self.assertEqual(result.returncode, 0, result.stdout)
+            self.assertIn("Critical items staged, staging the remaining items in the background.", result.stdout)
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, "out", "ref.json")))
+            # the url item is still being staged by the background process
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, "out", "large.dat")))
+            with open(status_file) as infile:
+                self.assertNotIn('"complete"', infile.read())
+            self.server.release.set()
+            deadline = time.monotonic() + 30
+            events = []
+            while time.monotonic() < deadline and (not events or events[-1]["event"] != "complete"):
+                time.sleep(0.05)
+                with open(status_file) as infile:
+                    events = [json.loads(line) for line in infile if line.endswith("\n")]
+            self.assertEqual([event["event"] for event in events], ["item", "critical", "item", "complete"])
+            self.assertEqual(events[-1]["status"], "staged")
+            with open(detach_log) as infile:
+                self.assertIn("Staging complete.", infile.read())
@@ -1,5 +1,6 @@
 from unittest import TestCase
 from unittest.mock import patch, Mock, call, mock_open
+from ddsc.core.ddsapi import DataServiceError
 from lando_util.upload import Settings, UploadUtil, main, UploadedFilesInfo, DukeDSActivity
 import json
 
@@ -86,6 +87,66 @@ class TestUploadUtil(TestCase):
         self.assertEqual(project, mock_project)
         util.dds_client.create_project.assert_not_called()
 
+    def test_get_or_create_project_uses_cached_id(self, mock_duke_ds_client, mock_settings):
+        mock_settings.return_value.destination = 'myproject'
+        dds_client = mock_duke_ds_client.return_value
+        dds_client.dds_connection.config.url = 'https://dds/api/v1'
+        mock_project = Mock(id='123', is_deleted=False)
+        mock_project.name = 'myproject'
+        dds_client.get_project_by_id.return_value = mock_project
+        project_cache = Mock()
+        project_cache.get.return_value = '123'
+        util = UploadUtil(Mock(), project_cache=project_cache)
+
+        project = util.get_or_create_project()
+
+        self.assertEqual(project, mock_project)
+        project_cache.get.assert_called_with('https://dds/api/v1', 'myproject')
+        dds_client.get_project_by_id.assert_called_with('123')
+        dds_client.get_projects.assert_not_called()
+        project_cache.set.assert_not_called()
+
+    @patch('lando_util.upload.click')
+    def test_get_or_create_project_replaces_invalid_cached_id(self, mock_click, mock_duke_ds_client, mock_settings):
+        mock_settings.return_value.destination = 'myproject'
+        dds_client = mock_duke_ds_client.return_value
+        dds_client.dds_connection.config.url = 'https://dds/api/v1'
+        renamed_project = Mock(id='123', is_deleted=False)
+        renamed_project.name = 'otherproject'
+        mock_project = Mock(id='456')
+        mock_project.name = 'myproject'
+        dds_client.get_projects.return_value = [renamed_project, mock_project]
+        project_cache = Mock()
+        project_cache.get.return_value = '123'
+        util = UploadUtil(Mock(), project_cache=project_cache)
+
+        for get_project_result in [renamed_project, DataServiceError(Mock(status_code=404), '/projects/123', {})]:
+            dds_client.get_project_by_id.side_effect = [get_project_result]
+            project = util.get_or_create_project()
+
+            self.assertEqual(project, mock_project)
+            project_cache.remove.assert_called_with('https://dds/api/v1', 'myproject')
+            project_cache.set.assert_called_with('https://dds/api/v1', 'myproject', '456')
+
+        dds_client.get_project_by_id.side_effect = DataServiceError(Mock(status_code=500), '/projects/123', {})
+        with self.assertRaises(DataServiceError):
+            util.get_or_create_project()
+
+    def test_get_or_create_project_caches_created_project(self, mock_duke_ds_client, mock_settings):
+        mock_settings.return_value.destination = 'myproject'
+        dds_client = mock_duke_ds_client.return_value
+        dds_client.dds_connection.config.url = 'https://dds/api/v1'
+        dds_client.get_projects.return_value = []
+        dds_client.create_project.return_value.id = '789'
+        project_cache = Mock()
+        project_cache.get.return_value = None
+        util = UploadUtil(Mock(), project_cache=project_cache)
+
+        util.get_or_create_project()
+
+        dds_client.get_project_by_id.assert_not_called()
+        project_cache.set.assert_called_with('https://dds/api/v1', 'myproject', '789')
+
     @patch('lando_util.upload.ProjectUpload')
     @patch('lando_util.upload.ProjectNameOrId')
     @patch('lando_util.upload.UploadedFilesInfo')
@@ -186,9 +247,9 @@ class TestMain(TestCase):
         mock_cmdfile = Mock()
         mock_outfile = Mock()
 
-        main.callback(mock_cmdfile, mock_outfile, "annotate_script")
+        main.callback(mock_cmdfile, mock_outfile, "annotate_script", None, 86400)
 
-        mock_upload_util.assert_called_with(mock_cmdfile)
+        mock_upload_util.assert_called_with(mock_cmdfile, None, None)
         upload_util = mock_upload_util.return_value
         upload_util.get_or_create_project.assert_called_with()
         mock_project = upload_util.get_or_create_project.return_value
@@ -205,9 +266,9 @@ class TestMain(TestCase):
         mock_cmdfile = Mock()
         mock_outfile = Mock()
 
-        main.callback(mock_cmdfile, mock_outfile, "json")
+        main.callback(mock_cmdfile, mock_outfile, "json", None, 86400)
 
-        mock_upload_util.assert_called_with(mock_cmdfile)
+        mock_upload_util.assert_called_with(mock_cmdfile, None, None)
         upload_util = mock_upload_util.return_value
         upload_util.get_or_create_project.assert_called_with()
         mock_project = upload_util.get_or_create_project.return_value
@@ -314,3 +375,19 @@ class TestDukeDSActivity(TestCase):
         self.mock_dds_client.get_file_by_id.assert_has_calls([
             call('678'), call('890')
         ])
+
+    @patch('lando_util.upload.click')
+    def test_create_reads_ndjson_input_file_versions(self, mock_click):
+        ndjson_input_file_versions_str = '{"current_version": {"id": "222"}}\n{"current_version": {"id": "333"}}\n'
+        with patch("builtins.open", mock_open(read_data=ndjson_input_file_versions_str)) as mock_file:
+            handlers = (mock_file.return_value, mock_open(read_data=self.mock_workflow_output_str).return_value,)
+            mock_file.side_effect = handlers
+
+            activity = DukeDSActivity(self.mock_dds_client, self.mock_settings, self.mock_project_info)
+            activity.create()
+
+        self.mock_data_service.create_used_relation.assert_has_calls([
+            call('111', 'dds-file', '222'),
+            call('111', 'dds-file', '333'),
+        ])
+        mock_click.echo.assert_any_call('Attaching 2 used relations.')
@@ -0,0 +1,335 @@
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+import socketserver
+import threading
+import urllib.error
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase
+from lando_util.httppool import get_default_pool
+from lando_util.urldownload import ResumableDownload, IncompleteDownloadError, get_validator, SegmentedDownload, \
+    RemoteFileChangedError, split_ranges, get_url_size, DecompressingDownload
+
+
+class FlakyFileHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.content supporting Range/If-Range requests.
+    Closes the connection after server.drop_after bytes for the first server.drops responses
+    (other than single byte probe requests). Connections are kept alive between requests.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        server.client_ports.add(self.client_address[1])
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/data.bin')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if server.changed_etag and len(server.requests) > 1:
+            server.etag = server.changed_etag
+        if server.error_status:
+            self.send_error(server.error_status)
+            return
+        content = server.content
+        start = 0
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if server.supports_ranges and range_header and (if_range is None or if_range == server.etag):
+            start, end = range_header.split('=')[1].split('-')
+            start = int(start)
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(content)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            end = int(end) if end else len(content) - 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(content)))
+        else:
+            end = len(content) - 1
+            self.send_response(200)
+        body = content[start:end + 1]
+        self.send_header('Content-Length', str(len(body)))
+        if server.etag:
+            self.send_header('ETag', server.etag)
+        self.end_headers()
+        if server.drops and range_header != 'bytes=0-0':
+            server.drops -= 1
+            self.wfile.write(body[:server.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.server.requests.append(dict(self.headers))
+        if self.server.error_status:
+            self.send_error(self.server.error_status)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.server.content)))
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalServerTestCase(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyFileHandler)
+        self.server.content = bytes(range(256)) * 400
+        self.server.etag = '"v1"'
+        self.server.supports_ranges = True
+        self.server.drops = 0
+        self.server.drop_after = 0
+        self.server.requests = []
+        self.server.error_status = None
+        self.server.changed_etag = None
+        self.server.client_ports = set()
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01})
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/data.bin'.format(self.server.server_address[1])
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.temp_dir.name, 'data.bin')
+
+    def tearDown(self):
+        get_default_pool().clear()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.temp_dir.cleanup()
+
+    def read_dest(self):
+        with open(self.dest, 'rb') as infile:
+            return infile.read()
+
+
+class TestResumableDownload(LocalServerTestCase):
+    def test_download(self):
+        ResumableDownload(self.url, self.dest).run()
+        self.assertEqual(self.read_dest(), self.server.content)
+        self.assertEqual(os.listdir(self.temp_dir.name), ['data.bin'])
+
+    def test_resumes_after_dropped_connections(self):
+        self.server.drops = 2
+        self.server.drop_after = 10000
+
+        ResumableDownload(self.url, self.dest, retry_wait_seconds=0).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+        ranges = [request.get('Range') for request in self.server.requests]
+        self.assertEqual(ranges, [None, 'bytes=10000-', 'bytes=20000-'])
+        self.assertEqual(self.server.requests[1]['If-Range'], '"v1"')
+
+    def test_hexdigest_after_resume(self):
+        self.server.drops = 1
+        self.server.drop_after = 10000
+
+        download = ResumableDownload(self.url, self.dest, retry_wait_seconds=0, hash_algorithm='sha256')
+        download.run()
+
+        self.assertEqual(download.hexdigest, hashlib.sha256(self.server.content).hexdigest())
+
+    def test_hexdigest_resuming_existing_partial_file(self):
+        with open(self.dest + '.partial', 'wb') as outfile:
+            outfile.write(self.server.content[:5000])
+        with open(self.dest + '.partial.json', 'w') as outfile:
+            json.dump({'url': self.url, 'validator': '"v1"'}, outfile)
+
+        download = ResumableDownload(self.url, self.dest, hash_algorithm='md5')
+        download.run()
+
+        self.assertEqual(self.server.requests[0]['Range'], 'bytes=5000-')
+        self.assertEqual(download.hexdigest, hashlib.md5(self.server.content).hexdigest())
+
+    def test_restarts_when_remote_file_changed(self):
+        with open(self.dest + '.partial', 'wb') as outfile:
+            outfile.write(b'old bytes')
+        with open(self.dest + '.partial.json', 'w') as outfile:
+            json.dump({'url': self.url, 'validator': '"v0"'}, outfile)
+
+        ResumableDownload(self.url, self.dest).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+        self.assertEqual(self.server.requests[0]['Range'], 'bytes=9-')
+
+    def test_restarts_when_server_does_not_support_ranges(self):
+        self.server.supports_ranges = False
+        self.server.drops = 1
+        self.server.drop_after = 5000
+
+        ResumableDownload(self.url, self.dest, retry_wait_seconds=0).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+
+    def test_does_not_resume_without_validator(self):
+        self.server.etag = None
+        self.server.drops = 1
+        self.server.drop_after = 5000
+
+        ResumableDownload(self.url, self.dest, retry_wait_seconds=0).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+        self.assertEqual([request.get('Range') for request in self.server.requests], [None, None])
+
+    def test_gives_up_after_retries(self):
+        self.server.drops = 3
+        self.server.drop_after = 100
+
+        with self.assertRaises(IncompleteDownloadError):
+            ResumableDownload(self.url, self.dest, retries=2, retry_wait_seconds=0).run()
+
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertEqual(os.path.getsize(self.dest + '.partial'), 300)
+
+    def test_http_errors_are_not_retried(self):
+        self.server.error_status = 404
+
+        with self.assertRaises(urllib.error.HTTPError):
+            ResumableDownload(self.url, self.dest, retry_wait_seconds=0).run()
+
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class TestSegmentedDownload(LocalServerTestCase):
+    def get_ranges(self):
+        return sorted(request.get('Range') for request in self.server.requests)
+
+    def test_download_in_segments(self):
+        SegmentedDownload(self.url, self.dest, segments=4, segment_threshold=1000).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+        self.assertEqual(self.get_ranges(), [
+            'bytes=0-0', 'bytes=0-25599', 'bytes=25600-51199', 'bytes=51200-76799', 'bytes=76800-102399'
+        ])
+        self.assertEqual(os.listdir(self.temp_dir.name), ['data.bin'])
+
+    def test_hexdigest(self):
+        download = SegmentedDownload(self.url, self.dest, segments=4, segment_threshold=1000, hash_algorithm='sha1')
+        download.run()
+        self.assertEqual(download.hexdigest, hashlib.sha1(self.server.content).hexdigest())
+
+        download = SegmentedDownload(self.url, self.dest, segments=4, segment_threshold=len(self.server.content) + 1,
+                                     hash_algorithm='sha1')
+        download.run()
+        self.assertEqual(download.hexdigest, hashlib.sha1(self.server.content).hexdigest())
+
+    def test_small_files_use_a_single_stream(self):
+        SegmentedDownload(self.url, self.dest, segments=4, segment_threshold=len(self.server.content) + 1).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1].get('Range'), None)
+
+    def test_single_segment_skips_probe(self):
+        SegmentedDownload(self.url, self.dest, segments=1, segment_threshold=0).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+        self.assertEqual([request.get('Range') for request in self.server.requests], [None])
+
+    def test_empty_file(self):
+        self.server.content = b''
+        for segments in (1, 4):
+            SegmentedDownload(self.url, self.dest, segments=segments, segment_threshold=0).run()
+            self.assertEqual(self.read_dest(), b'')
+
+    def test_falls_back_when_ranges_are_not_supported(self):
+        self.server.supports_ranges = False
+
+        SegmentedDownload(self.url, self.dest, segments=4, segment_threshold=1000).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_falls_back_without_validator(self):
+        self.server.etag = None
+
+        SegmentedDownload(self.url, self.dest, segments=4, segment_threshold=1000).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_segment_resumes_after_dropped_connection(self):
+        self.server.drops = 1
+        self.server.drop_after = 1000
+
+        SegmentedDownload(self.url, self.dest, segments=2, segment_threshold=1000, retry_wait_seconds=0).run()
+
+        self.assertEqual(self.read_dest(), self.server.content)
+        ranges = self.get_ranges()
+        self.assertEqual(len(ranges), 4)
+        self.assertTrue('bytes=1000-51199' in ranges or 'bytes=52200-102399' in ranges, ranges)
+
+    def test_remote_file_changed(self):
+        self.server.changed_etag = '"v2"'
+
+        with self.assertRaises(RemoteFileChangedError):
+            SegmentedDownload(self.url, self.dest, segments=2, segment_threshold=1000).run()
+
+    def test_split_ranges(self):
+        self.assertEqual(split_ranges(10, 3), [(0, 3), (4, 7), (8, 9)])
+        self.assertEqual(split_ranges(9, 3), [(0, 2), (3, 5), (6, 8)])
+        self.assertEqual(split_ranges(2, 4), [(0, 0), (1, 1)])
+
+
+class TestDecompressingDownload(LocalServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = self.server.content
+        self.server.content = gzip.compress(self.content)
+
+    def test_download(self):
+        download = DecompressingDownload(self.url, self.dest, "gzip", hash_algorithm="md5")
+        download.run()
+
+        self.assertEqual(self.read_dest(), self.content)
+        self.assertEqual(download.hexdigest, hashlib.md5(self.server.content).hexdigest())
+        self.assertEqual(os.listdir(self.temp_dir.name), ['data.bin'])
+
+    def test_restarts_after_dropped_connection(self):
+        self.server.drops = 1
+        self.server.drop_after = 100
+
+        download = DecompressingDownload(self.url, self.dest, "gzip", retry_wait_seconds=0, hash_algorithm="md5")
+        download.run()
+
+        self.assertEqual(self.read_dest(), self.content)
+        self.assertEqual(download.hexdigest, hashlib.md5(self.server.content).hexdigest())
+        self.assertEqual([request.get('Range') for request in self.server.requests], [None, None])
+
+
+class TestGetValidator(TestCase):
+    def test_get_validator(self):
+        self.assertEqual(get_validator({'ETag': '"abc"', 'Last-Modified': 'Mon'}), '"abc"')
+        self.assertEqual(get_validator({'ETag': 'W/"abc"', 'Last-Modified': 'Mon'}), 'Mon')
+        self.assertIsNone(get_validator({}))
+
+
+class TestGetUrlSize(LocalServerTestCase):
+    def test_get_url_size(self):
+        self.assertEqual(get_url_size(self.url), len(self.server.content))
+
+    def test_get_url_size_errors(self):
+        self.server.error_status = 404
+        self.assertIsNone(get_url_size(self.url))
+        self.assertIsNone(get_url_size('http://127.0.0.1:1/missing', timeout=1))
+
+    def test_get_url_size_raise_errors(self):
+        self.server.error_status = 405
+        self.assertIsNone(get_url_size(self.url, raise_errors=True))
+        self.server.error_status = 503
+        with self.assertRaises(urllib.error.HTTPError):
+            get_url_size(self.url, raise_errors=True)
+        with self.assertRaises(urllib.error.URLError):
+            get_url_size('http://127.0.0.1:1/missing', timeout=1, raise_errors=True)
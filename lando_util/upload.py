@@ -3,8 +3,14 @@ import json
 from ddsc.sdk.client import Client as DukeDSClient, KindType
 from ddsc.core.upload import ProjectUpload
 from ddsc.core.remotestore import RemoteStore, ProjectNameOrId
+from ddsc.core.ddsapi import DataServiceError
 from ddsc.core.d4s2 import D4S2Project
 from urllib.parse import urlparse
+from lando_util.jsonstream import iter_json_items
+from lando_util.projectcache import create_project_cache, project_cache_option, project_cache_ttl_option
+
+# statuses DukeDS returns for a cached project id that was deleted or is not visible to this account
+PROJECT_NOT_FOUND_STATUS_CODES = (403, 404)
 
 
 class Settings(object):
@@ -120,9 +126,9 @@ class DukeDSActivity(object):
             return file_paths
 
     def _get_input_file_version_ids(self):
+        # accepts the {"items": [...]} document or the ndjson file written by stagedata --metadata-format ndjson
         with open(self.activity_settings.input_file_versions_json_path) as infile:
-            data = json.load(infile)
-            return [file_metadata["current_version"]["id"] for file_metadata in data["items"]]
+            return [file_metadata["current_version"]["id"] for file_metadata in iter_json_items(infile)]
 
     @staticmethod
     def _recursive_add_cwl_file_paths(dict_or_array, file_paths):
@@ -141,10 +147,16 @@ class DukeDSActivity(object):
 
 
 class UploadUtil(object):
-    def __init__(self, cmdfile):
+    def __init__(self, cmdfile, dds_client=None, project_cache=None):
+        """
+        :param cmdfile: file: upload command file
+        :param dds_client: DukeDSClient: client to upload with, None to create one
+        :param project_cache: ProjectIdCache: optional cache of project ids by name
+        """
         self.settings = Settings(cmdfile)
-        self.dds_client = DukeDSClient()
+        self.dds_client = dds_client or DukeDSClient()
         self.dds_config = self.dds_client.dds_connection.config
+        self.project_cache = project_cache
 
     def get_or_create_project(self):
         """
@@ -152,10 +164,41 @@ class UploadUtil(object):
         :return: ddsc.sdk.client.Project
         """
         project_name = self.settings.destination
+        project = self._get_cached_project(project_name)
+        if project:
+            return project
+        project = self._find_project(project_name)
+        if not project:
+            project = self.dds_client.create_project(project_name, description=project_name)
+        if self.project_cache:
+            self.project_cache.set(self.dds_config.url, project_name, project.id)
+        return project
+
+    def _get_cached_project(self, project_name):
+        """
+        :return: ddsc.sdk.client.Project: project the cache has for project_name if it still has that name
+        """
+        if not self.project_cache:
+            return None
+        project_id = self.project_cache.get(self.dds_config.url, project_name)
+        if not project_id:
+            return None
+        try:
+            project = self.dds_client.get_project_by_id(project_id)
+            if project.name == project_name and not getattr(project, 'is_deleted', False):
+                return project
+        except DataServiceError as e:
+            if e.status_code not in PROJECT_NOT_FOUND_STATUS_CODES:
+                raise
+        click.echo("Cached project {} for {} is no longer valid.".format(project_id, project_name))
+        self.project_cache.remove(self.dds_config.url, project_name)
+        return None
+
+    def _find_project(self, project_name):
         for project in self.dds_client.get_projects():
             if project.name == project_name:
                 return project
-        return self.dds_client.create_project(project_name, description=project_name)
+        return None
 
     def upload_files(self, project):
         """
@@ -222,8 +265,23 @@ class UploadUtil(object):
 @click.argument('cmdfile', type=click.File('r'))
 @click.argument('outfile', type=click.File('w'))
 @click.option('--outfile-format', type=click.Choice(['annotate_script', 'json']), default='annotate_script')
-def main(cmdfile, outfile, outfile_format):
-    util = UploadUtil(cmdfile)
+@project_cache_option
+@project_cache_ttl_option
+def main(cmdfile, outfile, outfile_format, project_cache, project_cache_ttl):
+    upload_cmdfile(cmdfile, outfile, outfile_format, project_cache=create_project_cache(project_cache,
+                                                                                        project_cache_ttl))
+
+
+def upload_cmdfile(cmdfile, outfile, outfile_format='annotate_script', dds_client=None, project_cache=None):
+    """
+    Upload the paths in cmdfile to DukeDS, record provenance, share the project and write its details to outfile.
+    :param cmdfile: file: upload command file
+    :param outfile: file: file to write the project details to
+    :param outfile_format: str: 'annotate_script' or 'json'
+    :param dds_client: DukeDSClient: client to upload with, None to create one
+    :param project_cache: ProjectIdCache: optional cache of project ids by name
+    """
+    util = UploadUtil(cmdfile, dds_client, project_cache)
     project = util.get_or_create_project()
     uploaded_files_info = util.upload_files(project)
     util.create_provenance_activity(uploaded_files_info)
@@ -0,0 +1,402 @@
+"""
+Downloads urls into a partial file that can be resumed with HTTP Range requests after a dropped connection.
+
+While downloading <dest>.partial holds the bytes received so far and <dest>.partial.json holds the validator
+(ETag or Last-Modified) of the remote file those bytes came from. A resumed request sends If-Range with that
+validator so a remote file that changed is downloaded again from the start instead of being spliced onto old bytes.
+
+SegmentedDownload fetches large files as several byte ranges over parallel connections.
+
+Requests go through a shared httppool.HTTPConnectionPool so consecutive downloads from a host reuse keep-alive
+connections. Bodies are read into a preallocated buffer instead of allocating a new bytes object for every chunk.
+"""
+import hashlib
+import http.client
+import json
+import os
+import socket
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from lando_util.checksum import HashingWriter, hash_file
+from lando_util.decompress import write_decompressed
+from lando_util.httppool import get_default_pool
+
+PARTIAL_SUFFIX = '.partial'
+CHECKPOINT_SUFFIX = '.partial.json'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DEFAULT_RETRIES = 5
+DEFAULT_RETRY_WAIT_SECONDS = 1
+DEFAULT_TIMEOUT_SECONDS = 60
+RETRYABLE_ERRORS = (http.client.HTTPException, ConnectionError, socket.timeout, urllib.error.URLError)
+
+
+class IncompleteDownloadError(IOError):
+    pass
+
+
+class RemoteFileChangedError(IOError):
+    pass
+
+
+class ResumableDownload(object):
+    def __init__(self, url, dest, retries=DEFAULT_RETRIES, retry_wait_seconds=DEFAULT_RETRY_WAIT_SECONDS,
+                 timeout=DEFAULT_TIMEOUT_SECONDS, hash_algorithm=None, pool=None):
+        """
+        :param url: str: url to download
+        :param dest: str: path to save the downloaded file to
+        :param retries: int: number of times to resume after a failed attempt
+        :param retry_wait_seconds: float: seconds to wait before the first retry, doubled for each further retry
+        :param timeout: float: socket timeout in seconds
+        :param hash_algorithm: str: hashlib algorithm used to hash the bytes as they are written, None to skip
+        :param pool: HTTPConnectionPool: connections to send requests over, None for the shared pool
+        """
+        self.url = url
+        self.dest = dest
+        self.retries = retries
+        self.retry_wait_seconds = retry_wait_seconds
+        self.timeout = timeout
+        self.hash_algorithm = hash_algorithm
+        self.pool = pool or get_default_pool()
+        self.partial_path = dest + PARTIAL_SUFFIX
+        self.checkpoint_path = dest + CHECKPOINT_SUFFIX
+        self.hasher = None
+        self.hashed_size = 0
+
+    @property
+    def hexdigest(self):
+        return self.hasher.hexdigest() if self.hasher else None
+
+    def run(self):
+        """
+        Download url to dest resuming from the partial file when possible.
+        """
+        attempt = 0
+        while True:
+            try:
+                self._download_to_partial()
+                break
+            except urllib.error.HTTPError as e:
+                if e.code != 416 or attempt >= self.retries:
+                    raise
+                # the partial file no longer fits the remote file so start over
+                self._remove_checkpoint()
+                attempt += 1
+            except RETRYABLE_ERRORS + (IncompleteDownloadError,):
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.retry_wait_seconds * (2 ** attempt))
+                attempt += 1
+        os.replace(self.partial_path, self.dest)
+        os.remove(self.checkpoint_path)
+
+    def _download_to_partial(self):
+        offset, validator = self._read_checkpoint()
+        headers = {}
+        if offset and validator:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = validator
+        with self.pool.urlopen(self.url, headers, timeout=self.timeout) as response:
+            response_validator = get_validator(response.headers)
+            if response.status == 206 and self._resumes_at(response.headers, offset, validator, response_validator):
+                mode = 'ab'
+            else:
+                # the server sent the whole file (no range support or the remote file changed)
+                offset = 0
+                mode = 'wb'
+            self._write_checkpoint(response_validator)
+            expected_size = get_content_length(response.headers)
+            with open(self.partial_path, mode) as outfile:
+                if self.hash_algorithm:
+                    outfile = HashingWriter(outfile, self._get_hasher(offset))
+                try:
+                    received = copy_stream(response, outfile)
+                finally:
+                    if self.hash_algorithm:
+                        self.hashed_size = offset + outfile.size
+        if expected_size is not None and received < expected_size:
+            raise IncompleteDownloadError("Received {} of {} bytes for {}.".format(
+                offset + received, offset + expected_size, self.url))
+
+    def _get_hasher(self, offset):
+        """
+        :param offset: int: number of bytes already in the partial file
+        :return: hashlib hash object that has been updated with the first offset bytes of the partial file
+        """
+        if offset == 0:
+            self.hasher = hashlib.new(self.hash_algorithm)
+        elif not self.hasher or self.hashed_size != offset:
+            # resuming a partial file from an earlier process so hash the bytes it already holds
+            self.hasher = hash_file(self.partial_path, self.hash_algorithm)
+        return self.hasher
+
+    @staticmethod
+    def _resumes_at(headers, offset, validator, response_validator):
+        content_range = headers.get('Content-Range', '')
+        return content_range.startswith('bytes {}-'.format(offset)) and response_validator == validator
+
+    def _read_checkpoint(self):
+        """
+        :return: (int, str): number of bytes already downloaded, validator for those bytes
+        """
+        try:
+            with open(self.checkpoint_path) as infile:
+                checkpoint = json.load(infile)
+            if checkpoint.get('url') != self.url:
+                return 0, None
+            return os.path.getsize(self.partial_path), checkpoint.get('validator')
+        except (FileNotFoundError, ValueError):
+            return 0, None
+
+    def _remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _write_checkpoint(self, validator):
+        with open(self.checkpoint_path, 'w') as outfile:
+            json.dump({'url': self.url, 'validator': validator}, outfile)
+
+
+class DecompressingDownload(object):
+    """
+    Downloads url decompressing the data as it arrives so only the decompressed file (or extracted tar
+    directory) is written. A failed attempt starts over since decompression can not resume part way through.
+    """
+    def __init__(self, url, dest, decompress_format, retries=DEFAULT_RETRIES,
+                 retry_wait_seconds=DEFAULT_RETRY_WAIT_SECONDS, timeout=DEFAULT_TIMEOUT_SECONDS, hash_algorithm=None,
+                 pool=None):
+        """
+        :param url: str: url to download
+        :param dest: str: path to save the decompressed file or directory to
+        :param decompress_format: str: format of the data at url, see decompress.DECOMPRESS_FORMATS
+        :param retries: int: number of times to start over after a failed attempt
+        :param retry_wait_seconds: float: seconds to wait before the first retry, doubled for each further retry
+        :param timeout: float: socket timeout in seconds
+        :param hash_algorithm: str: hashlib algorithm used to hash the compressed bytes, None to skip
+        :param pool: HTTPConnectionPool: connections to send requests over, None for the shared pool
+        """
+        self.url = url
+        self.dest = dest
+        self.decompress_format = decompress_format
+        self.retries = retries
+        self.retry_wait_seconds = retry_wait_seconds
+        self.timeout = timeout
+        self.hash_algorithm = hash_algorithm
+        self.pool = pool or get_default_pool()
+        self.hasher = None
+
+    @property
+    def hexdigest(self):
+        return self.hasher.hexdigest() if self.hasher else None
+
+    def run(self):
+        attempt = 0
+        while True:
+            try:
+                self._download()
+                return
+            except RETRYABLE_ERRORS + (IncompleteDownloadError, EOFError):
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.retry_wait_seconds * (2 ** attempt))
+                attempt += 1
+
+    def _download(self):
+        self.hasher = hashlib.new(self.hash_algorithm) if self.hash_algorithm else None
+        with self.pool.urlopen(self.url, timeout=self.timeout) as response:
+            # the decompressor may hold on to chunks so each read returns a new bytes object
+            chunks = iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b'')
+            write_decompressed(chunks, self.dest, self.decompress_format, self.hasher)
+
+
+def get_validator(headers):
+    """
+    Find a value suitable for an If-Range header: a strong ETag or a Last-Modified date.
+    :param headers: response headers
+    :return: str: validator or None if the response can not be safely resumed
+    """
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def get_content_length(headers):
+    content_length = headers.get('Content-Length')
+    if content_length is None:
+        return None
+    return int(content_length)
+
+
+def get_url_size(url, timeout=DEFAULT_TIMEOUT_SECONDS, pool=None, raise_errors=False):
+    """
+    Find the size of the file at url with a HEAD request.
+    :param url: str: url of the file
+    :param timeout: float: seconds to wait for the server
+    :param pool: HTTPConnectionPool: connections to send requests over, None for the shared pool
+    :param raise_errors: bool: raise connection failures and server errors (5xx) instead of returning None, client
+    errors such as 405 for servers that do not support HEAD still return None
+    :return: int: size in bytes or None when the server does not report it or the request fails
+    """
+    try:
+        with (pool or get_default_pool()).urlopen(url, method='HEAD', timeout=timeout) as response:
+            return get_content_length(response.headers)
+    except (RETRYABLE_ERRORS + (OSError, ValueError)) as e:
+        if raise_errors and not (isinstance(e, urllib.error.HTTPError) and e.code < 500):
+            raise
+        return None
+
+
+def probe_ranges(url, timeout=DEFAULT_TIMEOUT_SECONDS, pool=None):
+    """
+    Request the first byte of url to find out if the server supports ranges.
+    :param url: str: url of the file
+    :param timeout: float: socket timeout in seconds
+    :param pool: HTTPConnectionPool: connections to send requests over, None for the shared pool
+    :return: (int, str): size of the remote file and its validator, (None, None) when ranges are unsupported
+    """
+    with (pool or get_default_pool()).urlopen(url, {'Range': 'bytes=0-0'}, timeout=timeout) as response:
+        content_range = response.headers.get('Content-Range', '')
+        if response.status != 206 or '/' not in content_range:
+            return None, None
+        total = content_range.rsplit('/', 1)[1]
+        if not total.isdigit():
+            return None, None
+        return int(total), get_validator(response.headers)
+
+
+def copy_stream(response, outfile, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Copy response to outfile flushing each chunk so the partial file always holds every byte received.
+    Reads into a single buffer allocated up front.
+    :return: int: number of bytes copied
+    """
+    buffer = memoryview(bytearray(chunk_size))
+    received = 0
+    while True:
+        count = response.readinto(buffer)
+        if not count:
+            break
+        outfile.write(buffer[:count])
+        outfile.flush()
+        received += count
+    return received
+
+
+class SegmentedDownload(object):
+    """
+    Downloads a large url as several byte ranges fetched in parallel, each written at its offset into a
+    preallocated partial file. Falls back to a single ResumableDownload stream when the server does not support
+    ranges, the file is smaller than segment_threshold or the server provides no validator to keep the segments
+    consistent.
+    """
+    def __init__(self, url, dest, segments, segment_threshold, retries=DEFAULT_RETRIES,
+                 retry_wait_seconds=DEFAULT_RETRY_WAIT_SECONDS, timeout=DEFAULT_TIMEOUT_SECONDS, hash_algorithm=None,
+                 pool=None):
+        """
+        :param url: str: url to download
+        :param dest: str: path to save the downloaded file to
+        :param segments: int: number of byte ranges to download in parallel
+        :param segment_threshold: int: files smaller than this many bytes are downloaded in a single stream
+        :param retries: int: number of times to resume each segment after a failed attempt
+        :param retry_wait_seconds: float: seconds to wait before the first retry, doubled for each further retry
+        :param timeout: float: socket timeout in seconds
+        :param hash_algorithm: str: hashlib algorithm used to hash the downloaded file, None to skip
+        :param pool: HTTPConnectionPool: connections to send requests over, None for the shared pool
+        """
+        self.url = url
+        self.dest = dest
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.retries = retries
+        self.retry_wait_seconds = retry_wait_seconds
+        self.timeout = timeout
+        self.hash_algorithm = hash_algorithm
+        self.pool = pool or get_default_pool()
+        self.partial_path = dest + PARTIAL_SUFFIX
+        self.hexdigest = None
+
+    def run(self):
+        size, validator = self._probe_ranges() if self.segments > 1 else (None, None)
+        if size is None or size < self.segment_threshold or not validator:
+            download = ResumableDownload(self.url, self.dest, self.retries, self.retry_wait_seconds, self.timeout,
+                                         self.hash_algorithm, self.pool)
+            download.run()
+            self.hexdigest = download.hexdigest
+            return
+        if os.path.exists(self.dest + CHECKPOINT_SUFFIX):
+            os.remove(self.dest + CHECKPOINT_SUFFIX)
+        preallocate_file(self.partial_path, size)
+        with ThreadPoolExecutor(max_workers=self.segments) as executor:
+            futures = [executor.submit(self._download_segment, start, end, validator)
+                       for start, end in split_ranges(size, self.segments)]
+            for future in futures:
+                future.result()
+        if self.hash_algorithm:
+            # segments arrive out of order so the assembled file is hashed once complete
+            self.hexdigest = hash_file(self.partial_path, self.hash_algorithm).hexdigest()
+        os.replace(self.partial_path, self.dest)
+
+    def _probe_ranges(self):
+        """
+        :return: (int, str): size and validator from probe_ranges, (None, None) when the probe fails, for example
+        with 416 for an empty file, so the url is downloaded in a single stream
+        """
+        try:
+            return probe_ranges(self.url, self.timeout, self.pool)
+        except urllib.error.URLError:
+            return None, None
+
+    def _download_segment(self, start, end, validator):
+        """
+        Download bytes start through end (inclusive) into the partial file, resuming the remainder after errors.
+        """
+        offset = start
+        attempt = 0
+        buffer = memoryview(bytearray(DOWNLOAD_CHUNK_SIZE))
+        fd = os.open(self.partial_path, os.O_WRONLY)
+        try:
+            while offset <= end:
+                headers = {'Range': 'bytes={}-{}'.format(offset, end), 'If-Range': validator}
+                try:
+                    with self.pool.urlopen(self.url, headers, timeout=self.timeout) as response:
+                        if response.status != 206 or get_validator(response.headers) != validator:
+                            raise RemoteFileChangedError("{} changed while downloading segments.".format(self.url))
+                        while offset <= end:
+                            count = response.readinto(buffer[:min(DOWNLOAD_CHUNK_SIZE, end + 1 - offset)])
+                            if not count:
+                                raise IncompleteDownloadError("Segment of {} ended early at byte {}.".format(
+                                    self.url, offset))
+                            os.pwrite(fd, buffer[:count], offset)
+                            offset += count
+                except urllib.error.HTTPError:
+                    raise
+                except RETRYABLE_ERRORS + (IncompleteDownloadError,):
+                    if attempt >= self.retries:
+                        raise
+                    time.sleep(self.retry_wait_seconds * (2 ** attempt))
+                    attempt += 1
+        finally:
+            os.close(fd)
+
+
+def split_ranges(size, segments):
+    """
+    Split size bytes into at most segments contiguous inclusive (start, end) ranges.
+    """
+    segment_size = max(1, -(-size // segments))
+    return [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+
+def preallocate_file(path, size):
+    """
+    Create path with size bytes reserved so segments can be written at their offsets.
+    """
+    with open(path, 'wb') as outfile:
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(outfile.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        outfile.truncate(size)
@@ -36,7 +36,12 @@ setup(name='lando-util',
           'python-dateutil==2.6.0',
           'Markdown==2.6.9',
           'PyYAML==5.1',
+          'requests>=2.20.0',
       ],
+      extras_require={
+          'zstd': ['zstandard'],
+          's3': ['boto3'],
+      },
       zip_safe=False,
       cmdclass={
           'verify': VerifyVersionCommand,